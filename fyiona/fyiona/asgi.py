@@ -4,4 +4,14 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fyiona.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up, the consumer uses models
+from umessages.consumers import websocket_application  # noqa: E402
+
+
+async def application(scope, receive, send):
+    """HTTP goes to Django, WebSocket connections are served by umessages.consumers."""
+    if scope["type"] == "websocket":
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
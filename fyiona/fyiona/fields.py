@@ -1,10 +1,12 @@
-from django.forms import forms
+from django.core.exceptions import ValidationError
 from django.db.models import FileField
 from django.utils.translation import gettext_lazy as _
 from django.template.defaultfilters import filesizeformat
 
 from django.conf import settings
 
+from .sniffing import sniff_file, is_allowed
+
 """
 Same as FileField, but you can specify:
     * content_types - list containing allowed content_types. Example: ['application/pdf', 'image/jpeg']
@@ -39,25 +41,21 @@ class ContentTypeRestrictedFileField(FileField):
     def clean(self, *args, **kwargs):
         """
             .clean() method is responsible for validation by FILESIZE and FILE TYPE
+            The type is sniffed from the first bytes of the file, the declared content_type is ignored
             In the result, methods returns itself but with specific modifications inside
         """
         data = super(ContentTypeRestrictedFileField, self).clean(*args, **kwargs)
-
-        file = data.file
-        try:
-            content_type = file.content_type
-            if content_type in self.content_types:
-                if file._size > self.max_upload_size:
-                    raise forms.ValidationError(
-                        _("Please keep filesize under %s. Current filesize %s")
-                        % (
-                            filesizeformat(self.max_upload_size),
-                            filesizeformat(file._size),
-                        )
-                    )
-            else:
-                raise forms.ValidationError(_("Filetype not supported."))
-        except AttributeError:
-            pass
-
+        self.validate_upload(data.file)
         return data
+
+    def validate_upload(self, file):
+        if file.size > self.max_upload_size:
+            raise ValidationError(
+                _("Please keep filesize under %s. Current filesize %s")
+                % (
+                    filesizeformat(self.max_upload_size),
+                    filesizeformat(file.size),
+                )
+            )
+        if not is_allowed(sniff_file(file), self.content_types):
+            raise ValidationError(_("Filetype not supported."))
@@ -0,0 +1,130 @@
+"""
+Resized copies of uploaded images, generated off the request path.
+
+Every image gets the derivatives of DERIVATIVES (longest side in pixels) as progressive JPEGs
+in default_storage, named after the original, plus a tiny blurred placeholder that is inlined
+as a data URI, so clients can paint something before the first request for the image.
+The names are kept in the "derivatives" JSONField of the model, "source" remembers the original
+they were made from.
+"""
+
+import io
+import os
+import base64
+import logging
+import mimetypes
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageFilter, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES = {
+    "thumbnail": 160,
+    "feed": 640,
+    "full": 1080,
+}
+PLACEHOLDER_SIZE = 16
+JPEG_QUALITY = 82
+
+executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "IMAGE_DERIVATIVES_WORKERS", 2),
+    thread_name_prefix="image-derivatives",
+)
+
+
+def is_image(name: str) -> bool:
+    content_type, _ = mimetypes.guess_type(name)
+    return bool(content_type) and content_type.startswith("image/")
+
+
+def needs_derivatives(instance, field_name: str) -> bool:
+    file = getattr(instance, field_name)
+    if not file or not is_image(file.name):
+        return False
+    # Shared default images (e.g. the default avatar) are served as they are
+    if file.name == instance._meta.get_field(field_name).get_default():
+        return False
+    return instance.derivatives.get("source") != file.name
+
+
+def get_derivative_name(source: str, derivative: str) -> str:
+    directory, filename = os.path.split(source)
+    stem, _ = os.path.splitext(filename)
+    return os.path.join(directory, "derivatives", "%s_%s.jpg" % (stem, derivative))
+
+
+def to_jpeg(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def generate_derivatives(file) -> dict:
+    """Writes the derivatives of an image FieldFile and returns the value for "derivatives"."""
+    with file.open("rb"):
+        image = Image.open(file)
+        image = ImageOps.exif_transpose(image).convert("RGB")
+
+    derivatives = {"source": file.name}
+    for derivative, size in DERIVATIVES.items():
+        resized = image.copy()
+        # Never upscales, small originals are only recompressed
+        resized.thumbnail((size, size), Image.LANCZOS)
+        name = get_derivative_name(file.name, derivative)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        derivatives[derivative] = default_storage.save(name, ContentFile(to_jpeg(resized)))
+
+    placeholder = image.copy()
+    placeholder.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    placeholder = placeholder.filter(ImageFilter.GaussianBlur(1))
+    derivatives["placeholder"] = "data:image/jpeg;base64,%s" % base64.b64encode(to_jpeg(placeholder)).decode()
+    return derivatives
+
+
+def update_derivatives(model, pk, field_name: str, source: str) -> bool:
+    """Generates derivatives of one row, skipped if the image was replaced or removed meanwhile."""
+    instance = model.objects.filter(pk=pk, **{field_name: source}).first()
+    if instance is None or not needs_derivatives(instance, field_name):
+        return False
+    derivatives = generate_derivatives(getattr(instance, field_name))
+    # The condition on the source keeps a newer upload from being overwritten by a stale job
+    model.objects.filter(pk=pk, **{field_name: source}).update(derivatives=derivatives)
+    return True
+
+
+def process(model, pk, field_name: str, source: str):
+    """Background job of the executor."""
+    try:
+        update_derivatives(model, pk, field_name, source)
+    except Exception:
+        logger.exception("Could not generate derivatives of %s %s", model._meta.label, pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(instance, field_name: str):
+    """Queues derivative generation after the current transaction commits."""
+    if not needs_derivatives(instance, field_name):
+        return
+    model, pk, source = type(instance), instance.pk, getattr(instance, field_name).name
+    transaction.on_commit(lambda: executor.submit(process, model, pk, field_name, source))
+
+
+def get_derivative_urls(instance, field_name: str, request=None) -> dict:
+    """URLs of the derivatives for serializers, empty until the ones of the current image are generated."""
+    derivatives = dict(instance.derivatives or {})
+    if derivatives.pop("source", None) != getattr(instance, field_name).name:
+        return {}
+
+    urls = {"placeholder": derivatives.pop("placeholder", None)}
+    for derivative, name in derivatives.items():
+        url = default_storage.url(name)
+        urls[derivative] = request.build_absolute_uri(url) if request is not None else url
+    return urls
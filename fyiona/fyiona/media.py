@@ -0,0 +1,207 @@
+"""
+Delivery of MEDIA_ROOT files: byte ranges (video seeking), ETag / Last-Modified conditional GETs
+and cache headers.
+
+With MEDIA_ACCEL_REDIRECT set (e.g. "/protected-media/") Django only answers with the headers and
+an X-Accel-Redirect, nginx sends the bytes and handles Range itself. The nginx container needs
+the media volume and an internal location for the prefix:
+    location /protected-media/ {
+        internal;
+        alias /main/fyiona/media/;
+    }
+Without it (development) the file is streamed by Django.
+nginx must pass /media/ to Django and never serve MEDIA_ROOT from a public location,
+message attachments are only sent to the people of the conversation (see can_read).
+"""
+
+import os
+import re
+import mimetypes
+from urllib.parse import quote
+
+from django.apps import apps
+from django.conf import settings
+from django.db.models import Q
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from rest_framework import exceptions
+
+from users.middlewares import JWTAuthentication
+from .storage import BLOB_PREFIX, is_blob_name
+
+
+READ_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+# Originals in fyiona.storage.ContentAddressedStorage, named by the SHA-256 of the content
+BLOB_RE = re.compile(r"^%s[0-9a-f]{2}/(?P<digest>[0-9a-f]{64})(\.\w+)?$" % re.escape(BLOB_PREFIX))
+
+# Files named like this may be message attachments (blobs, or stored before fyiona.storage)
+PRIVATE_PREFIXES = (BLOB_PREFIX, "messages/attachments/")
+# The same blob used by one of these is public anyway
+PUBLIC_REFERENCES = {
+    "users.UserProfile": "avatar",
+    "stories.StoryFile": "attachment",
+}
+
+# Blobs never change, other files are cached for MEDIA_CACHE_MAX_AGE.
+# A blob may be a private attachment, so only the browser caches it, never a shared cache
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def get_etag(path: str, stat) -> str:
+    blob = BLOB_RE.match(path)
+    if blob is not None:
+        return '"%s"' % blob.group("digest")
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def parse_range(header: str, size: int):
+    """
+    Returns (start, end) of a single "bytes=" range, end included, None when the header is not
+    usable (the whole file is sent) and ValueError when it can not be satisfied.
+    Multiple ranges are not supported, answering them with the whole file is allowed by RFC 7233.
+    """
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # The last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(size - length, 0), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError
+    return start, end
+
+
+def if_range_matches(request, etag: str, last_modified: int) -> bool:
+    value = request.headers.get("If-Range")
+    if value is None:
+        return True
+    if value.startswith('"') or value.startswith("W/"):
+        return value == etag
+    return parse_http_date_safe(value) == last_modified
+
+
+def read_range(path: str, start: int, length: int):
+    with open(path, "rb") as file:
+        file.seek(start)
+        while length > 0:
+            piece = file.read(min(READ_SIZE, length))
+            if not piece:
+                break
+            length -= len(piece)
+            yield piece
+
+
+def get_user(request):
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except exceptions.AuthenticationFailed:
+        return None
+    return authenticated[0] if authenticated else None
+
+
+def is_public(path: str) -> bool:
+    for label, field_name in PUBLIC_REFERENCES.items():
+        try:
+            model = apps.get_model(label)
+        except LookupError:
+            continue
+        if model.objects.filter(**{field_name: path}).exists():
+            return True
+    return False
+
+
+def can_read(request, path: str):
+    """
+    Returns (allowed, private). Message attachments are readable by the sender and the receiver only,
+    unless the same blob is an avatar or a story too. Legacy attachments without a message are hidden.
+    """
+    if not path.startswith(PRIVATE_PREFIXES) or not apps.is_installed("umessages"):
+        return True, False
+
+    attachments = apps.get_model("umessages", "MessageFile").objects.filter(attachment=path)
+    if is_blob_name(path) and (not attachments.exists() or is_public(path)):
+        return True, False
+
+    user = get_user(request)
+    if user is None:
+        return False, True
+    return attachments.filter(Q(msg__sender=user) | Q(msg__receiver=user)).exists(), True
+
+
+@require_safe
+def serve(request, path: str):
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (ValueError, OSError):
+        raise Http404("File does not exist")
+    if not os.path.isfile(full_path):
+        raise Http404("File does not exist")
+
+    allowed, private = can_read(request, path)
+    if not allowed:
+        # Same answer as for a missing file, nothing tells that the attachment exists
+        raise Http404("File does not exist")
+
+    etag = get_etag(path, stat)
+    last_modified = int(stat.st_mtime)
+    content_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = build_response(request, full_path, path, stat.st_size, content_type, etag, last_modified)
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+    if private:
+        patch_cache_control(response, private=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+        patch_vary_headers(response, ["Authorization"])
+    elif BLOB_RE.match(path):
+        patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE)
+    else:
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE)
+    return response
+
+
+def build_response(request, full_path: str, path: str, size: int, content_type: str, etag: str, last_modified: int):
+    accel_prefix = settings.MEDIA_ACCEL_REDIRECT
+    if accel_prefix:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = accel_prefix + quote(path)
+        return response
+
+    byte_range = None
+    if "Range" in request.headers and if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers["Range"], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = "bytes */%s" % size
+            return response
+
+    if byte_range is None:
+        # FileResponse lets the server use wsgi.file_wrapper (sendfile) for the whole file
+        return FileResponse(open(full_path, "rb"), content_type=content_type)
+
+    start, end = byte_range
+    length = end - start + 1
+    response = StreamingHttpResponse(read_range(full_path, start, length), status=206, content_type=content_type)
+    response["Content-Length"] = str(length)
+    response["Content-Range"] = "bytes %s-%s/%s" % (start, end, size)
+    return response
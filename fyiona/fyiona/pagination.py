@@ -0,0 +1,112 @@
+import json
+import binascii
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound
+
+
+class KeysetPagination:
+    """
+    Keyset (a.k.a. "seek") pagination over a fixed, unique ordering.
+    Instead of OFFSET the next page is located with a WHERE clause built from the last row of the
+    previous page, so every page costs one index range scan no matter how deep the client scrolls.
+
+    ordering - tuple of model fields, "-" prefix means descending. The last field MUST be unique (usually "id").
+    The cursor is an opaque urlsafe base64 string containing the ordering values of the last row.
+    """
+
+    ordering = ("-id",)
+    page_size = 50
+    max_page_size = 200
+    cursor_query_param = "cursor"
+    page_size_query_param = "page_size"
+    invalid_cursor_message = _("Invalid cursor")
+
+    def __init__(self, ordering=None, page_size=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        if page_size is not None:
+            self.page_size = page_size
+        self.next_cursor = None
+
+    def get_page_size(self, request) -> int:
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, values) -> str:
+        raw = json.dumps([str(value) for value in values], separators=(",", ":"))
+        return urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+    def get_field(self, model, field: str):
+        for name in field.lstrip("-").split("__")[:-1]:
+            model = model._meta.get_field(name).related_model
+        return model._meta.get_field(field.lstrip("-").split("__")[-1])
+
+    def decode_cursor(self, cursor: str, model=None) -> list:
+        """Values of the cursor, converted by the ordering fields of "model" when it is given."""
+        try:
+            padding = "=" * (-len(cursor) % 4)
+            values = json.loads(urlsafe_b64decode(cursor + padding).decode("utf-8"))
+        except (binascii.Error, UnicodeDecodeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        if model is None:
+            return values
+
+        # A well-formed cursor may still carry a value the database would reject
+        try:
+            return [self.get_field(model, field).to_python(value) for field, value in zip(self.ordering, values)]
+        except (ValidationError, ValueError, TypeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_seek_filter(self, values) -> Q:
+        """
+        Builds "(a, b, c) after (x, y, z)" for mixed ASC/DESC orderings:
+            a > x OR (a = x AND b > y) OR (a = x AND b = y AND c > z)
+        """
+        seek = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            seek |= Q(**equal, **{"%s__%s" % (name, lookup): value})
+            equal[name] = value
+        return seek
+
+    def get_cursor_values(self, obj) -> list:
+        values = []
+        for field in self.ordering:
+            value = obj
+            for attr in field.lstrip("-").split("__"):
+                value = getattr(value, attr)
+            values.append(value)
+        return values
+
+    def paginate_queryset(self, queryset, request) -> list:
+        """Returns one page of objects and remembers the cursor of the next page in self.next_cursor."""
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            queryset = queryset.filter(self.get_seek_filter(self.decode_cursor(cursor, queryset.model)))
+
+        # One extra row tells whether there is a next page without issuing COUNT(*)
+        page = list(queryset[: page_size + 1])
+        if len(page) > page_size:
+            page = page[:page_size]
+            self.next_cursor = self.encode_cursor(self.get_cursor_values(page[-1]))
+        else:
+            self.next_cursor = None
+
+        return page
@@ -1,4 +1,5 @@
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 from firebase_admin import initialize_app
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
     "django.contrib.messages",
     "django.contrib.staticfiles",
     "users.apps.UsersConfig",
+    "uploads.apps.UploadsConfig",
     "posts.apps.PostsConfig",
     # "stories.apps.StoriesConfig",
     # "umessages.apps.UmessagesConfig",
@@ -85,6 +87,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "fyiona.wsgi.application"
+ASGI_APPLICATION = "fyiona.asgi.application"
+
+# Fan-out of real-time messaging events, see umessages.realtime.
+# InMemoryBroker only works when HTTP and WebSocket traffic are served by the same ASGI process.
+MESSAGES_REALTIME_BROKER = "umessages.realtime.InMemoryBroker"
 
 
 DATABASES = {
@@ -134,6 +141,7 @@ REST_FRAMEWORK = {
 AUTHENTICATION_BACKENDS = (
     "users.middlewares.JWTAuthentication",
     "django.contrib.auth.backends.ModelBackend",
+    "users.backends.PhoneNumberBackend",
     # "rest_email_auth.authentication.VerifiedEmailBackend",
     # "allauth.account.auth_backends.AuthenticationBackend",
 )
@@ -158,25 +166,74 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+# Internal nginx location serving MEDIA_ROOT (e.g. "/protected-media/"), Django then only sends
+# X-Accel-Redirect headers; unset, Django streams the files itself. See fyiona.media
+MEDIA_ACCEL_REDIRECT = os.environ.get("MEDIA_ACCEL_REDIRECT") or None
+MEDIA_CACHE_MAX_AGE = 60 * 60
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 
-TOKEN_LIFETIME = 180
+# JWT, see users.tokens. Keys by key id as a JSON object, e.g. {"2024-06": "..."}; tokens are signed
+# with JWT_ACTIVE_KID, the other keys are still accepted until they are removed
+JWT_SIGNING_KEYS = json.loads(os.environ.get("JWT_SIGNING_KEYS") or "null") or {"default": SECRET_KEY}
+JWT_ACTIVE_KID = os.environ.get("JWT_ACTIVE_KID", "default")
+ACCESS_TOKEN_LIFETIME = 15  # minutes
+REFRESH_TOKEN_LIFETIME = 30  # days
+
+# Minutes a link sent by email stays valid, see users.one_time_tokens
+ONE_TIME_TOKEN_LIFETIMES = {
+    "email_confirmation": 3 * 24 * 60,
+    "password_reset": 60,
+    "email_change": 60,
+    "account_deletion": 30,
+}
+
+# Cache of authenticated users, see users.cache
+USER_CACHE = {
+    "MAX_SIZE": 10000,
+    "TTL": 30,  # seconds, bounds the staleness of the per process copy
+    "SHARED_CACHE_ALIAS": os.environ.get("USER_CACHE_ALIAS"),  # name of a CACHES entry or None
+    "SHARED_CACHE_TTL": 300,
+}
 AUTH_USER_MODEL = "users.CustomUser"
 
+# Sliding window throttles of login, password reset and registration, see users.throttling
+THROTTLING = {
+    "CACHE_ALIAS": os.environ.get("THROTTLE_CACHE_ALIAS"),  # name of a CACHES entry or None (per process)
+    "MAX_KEYS": 100000,
+    "RATES": {
+        "login": "20/min",  # per IP
+        "login_account": "5/min",  # per email or phone number
+        "password_reset": "10/hour",
+        "password_reset_account": "3/hour",
+        "registration": "10/hour",
+    },
+}
+
 APPEND_SLASH=False
 LOGIN_REDIRECT_URL = "/api/v1/users/"
 
 EMAIL_BACKEND = "django.core.mail.backends.smtp.EmailBackend"
 
-EMAIL_HOST = os.environ.get("EMAIL_HOST")
-EMAIL_PORT = os.environ.get("EMAIL_PORT")
-EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER")
-EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD")
-EMAIL_USE_TLS = os.environ.get("EMAIL_USE_TLS")
+# Emails are queued in users.models.OutboundEmail and sent by "manage.py send_queued_mail".
+# For local debugging: python -m aiosmtpd -n -l localhost:1025 and EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=False
+EMAIL_HOST = os.environ.get("EMAIL_HOST", "smtp.gmail.com")
+EMAIL_PORT = int(os.environ.get("EMAIL_PORT", 587))
+EMAIL_HOST_USER = os.environ.get("EMAIL_HOST_USER", "")
+EMAIL_HOST_PASSWORD = os.environ.get("EMAIL_HOST_PASSWORD", "")
+EMAIL_USE_TLS = os.environ.get("EMAIL_USE_TLS", "True") == "True"
+EMAIL_TIMEOUT = 30
 DEFAULT_FROM_EMAIL = "Fyiona Administration example@gmail.com"
 
+MAIL_QUEUE = {
+    "BATCH_SIZE": 50,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_BACKOFF": 30,  # seconds, doubled after every failed attempt
+    "MAX_BACKOFF": 3600,
+    "LEASE": 1800,  # seconds, a crashed worker's batch is picked up again after it
+}
+
 
 CORS_REPLACE_HTTPS_REFERER = False
 HOST_SCHEME = "http://"
@@ -192,3 +249,32 @@ SECURE_FRAME_DENY = False
 POST_MAX_FILE_SIZE = 644874240  # 750 MB
 STORY_MAX_FILE_SIZE = 214958080  # 250 MB
 MESSAGE_MAX_FILE_SIZE = 8598324  # 25 MB
+
+# Multipart files are sniffed and size-checked while being received, see fyiona.uploadhandlers
+FILE_UPLOAD_MAX_SIZE = POST_MAX_FILE_SIZE
+FILE_UPLOAD_HANDLERS = [
+    "fyiona.uploadhandlers.RestrictedFileUploadHandler",
+    "django.core.files.uploadhandler.MemoryFileUploadHandler",
+    "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+]
+
+# Threads generating resized copies of uploaded images, see fyiona.images
+IMAGE_DERIVATIVES_WORKERS = 2
+
+# Chunked uploads (see uploads.chunks) are assembled here before being moved into MEDIA_ROOT,
+# keep it on the same filesystem so the move is a rename
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, "partial_uploads")
+CHUNKED_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024  # 8 MB
+
+# Stories are visible for this number of hours, then "manage.py archive_stories" moves them out of the live table
+STORY_LIFETIME_HOURS = 24
+
+# Story views are buffered in memory and written in bulk, see stories.viewers
+STORY_VIEWS_BUFFER = {
+    "MAX_SIZE": 500,
+    "MAX_AGE": 2.0,  # seconds
+}
+
+# Accounts with at least this number of followers are not fanned out into followers' feeds,
+# their stories are merged into the feed while reading it, see stories.feed
+STORIES_FANOUT_THRESHOLD = 5000
@@ -0,0 +1,78 @@
+"""
+Detects the real type of an uploaded file from its first bytes ("magic numbers"),
+the Content-Type sent by the client is not trusted.
+Only types the project accepts are listed, anything else is reported as None.
+"""
+
+# Bytes needed to recognize every type below
+SNIFF_SIZE = 4096
+
+# (offset, signature, content type), checked in order
+SIGNATURES = (
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"OggS", "video/ogg"),
+    (0, b"\x1a\x45\xdf\xa3", "video/webm"),
+    (0, b"%PDF-", "application/pdf"),
+)
+
+# ISO base media files (mp4, mov, heic) carry "ftyp" + a major brand at offset 4,
+# the same container holds audio, images and documents too, so unknown brands are not accepted
+FTYP_BRANDS = {
+    b"isom": "video/mp4",
+    b"iso2": "video/mp4",
+    b"iso4": "video/mp4",
+    b"iso5": "video/mp4",
+    b"iso6": "video/mp4",
+    b"mp41": "video/mp4",
+    b"mp42": "video/mp4",
+    b"avc1": "video/mp4",
+    b"dash": "video/mp4",
+    b"M4V ": "video/mp4",
+    b"MSNV": "video/mp4",
+    b"qt  ": "video/quicktime",
+    b"heic": "image/heic",
+    b"heix": "image/heic",
+    b"mif1": "image/heic",
+}
+
+# Declared types that mean the same thing as the sniffed one
+ALIASES = {
+    "image/jpg": "image/jpeg",
+    "image/pjpeg": "image/jpeg",
+}
+
+
+def sniff_content_type(head: bytes):
+    """Returns the content type of a file starting with "head" or None if it is not recognized."""
+    for offset, signature, content_type in SIGNATURES:
+        if head[offset : offset + len(signature)] == signature:
+            return content_type
+
+    if head[8:12] == b"WEBP" and head[:4] == b"RIFF":
+        return "image/webp"
+
+    if head[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(head[8:12])
+
+    return None
+
+
+def sniff_file(file):
+    """Sniffs an open file (UploadedFile, File) without moving its position."""
+    position = file.tell()
+    try:
+        file.seek(0)
+        head = file.read(SNIFF_SIZE)
+    finally:
+        file.seek(position)
+    return sniff_content_type(head)
+
+
+def is_allowed(content_type, content_types) -> bool:
+    if content_type is None:
+        return False
+    allowed = {ALIASES.get(item, item) for item in content_types}
+    return ALIASES.get(content_type, content_type) in allowed
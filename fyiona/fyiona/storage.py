@@ -0,0 +1,89 @@
+"""
+Content-addressed storage: a file is stored under the SHA-256 of its content,
+    blobs/<first 2 hex digits>/<sha256><extension>
+so identical uploads (forwarded images, re-posted stories) share one file on disk.
+The requested name only contributes the extension.
+
+Every stored file has a uploads.models.Blob row, the models using the storage keep its refcount
+(see uploads.blobs) and "manage.py collect_blobs" deletes blobs nobody references anymore.
+"""
+
+import os
+import hashlib
+import tempfile
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+BLOB_PREFIX = "blobs/"
+READ_SIZE = 64 * 1024
+
+
+def get_blob_name(digest: str, extension: str) -> str:
+    return "%s%s/%s%s" % (BLOB_PREFIX, digest[:2], digest, extension.lower())
+
+
+def is_blob_name(name: str) -> bool:
+    return bool(name) and name.startswith(BLOB_PREFIX)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # The final name is decided by the content in _save, existing files are reused, not renamed
+        return name
+
+    def _save(self, name, content):
+        _, extension = os.path.splitext(name)
+
+        if hasattr(content, "temporary_file_path"):
+            # Spooled to disk already: hash it in one read and move it into place
+            source = content.temporary_file_path()
+            digest = self.get_digest(content)
+        else:
+            # Hash while copying the stream into a temporary file next to the blobs
+            directory = self.path(BLOB_PREFIX)
+            os.makedirs(directory, exist_ok=True)
+            descriptor, source = tempfile.mkstemp(dir=directory, suffix=".upload")
+            sha256 = hashlib.sha256()
+            with os.fdopen(descriptor, "wb") as temporary:
+                for chunk in content.chunks(READ_SIZE):
+                    sha256.update(chunk)
+                    temporary.write(chunk)
+            digest = sha256.hexdigest()
+
+        name = get_blob_name(digest, extension)
+        # Registered (and refreshed) first, so the garbage collector skips a blob that is being reused
+        self.register_blob(name, digest, content.size)
+
+        path = self.path(name)
+        if os.path.exists(path):
+            if not hasattr(content, "temporary_file_path"):
+                os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            file_move_safe(source, path)
+            if self.file_permissions_mode is not None:
+                os.chmod(path, self.file_permissions_mode)
+
+        return name
+
+    @staticmethod
+    def get_digest(content) -> str:
+        sha256 = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks(READ_SIZE):
+            sha256.update(chunk)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def register_blob(name: str, digest: str, size: int):
+        # Imported here, storages are instantiated while models are being loaded
+        from uploads.blobs import register_blob
+
+        register_blob(name, digest, size)
+
+
+content_addressed_storage = ContentAddressedStorage()
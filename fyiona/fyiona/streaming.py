@@ -0,0 +1,41 @@
+from django.http import StreamingHttpResponse
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def iterate_in_chunks(queryset, chunk_size: int = 1000):
+    """Yields lists of objects fetched with a server side cursor, so only one chunk lives in memory."""
+    chunk = []
+    for obj in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(obj)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def stream_serialized_list(queryset, serializer_class, context=None, chunk_size: int = 1000):
+    """
+    Generator that renders {"success": true, "result": [...]} piece by piece.
+    Every chunk of rows is serialized and encoded separately and then dropped,
+    so the memory usage stays flat regardless of the table size.
+    """
+    encoder = JSONEncoder()
+
+    yield '{"success":true,"result":['
+    first = True
+    for chunk in iterate_in_chunks(queryset, chunk_size=chunk_size):
+        serializer = serializer_class(chunk, many=True, context=context or {})
+        for item in serializer.data:
+            yield ("" if first else ",") + encoder.encode(item)
+            first = False
+    yield "]}"
+
+
+def streaming_json_response(queryset, serializer_class, context=None, chunk_size: int = 1000):
+    response = StreamingHttpResponse(
+        stream_serialized_list(queryset, serializer_class, context=context, chunk_size=chunk_size),
+        content_type="application/json",
+    )
+    response["Cache-Control"] = "no-store"
+    return response
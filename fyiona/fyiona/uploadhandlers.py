@@ -0,0 +1,98 @@
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig, SuspiciousOperation
+from django.core.files.uploadhandler import FileUploadHandler
+from django.template.defaultfilters import filesizeformat
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .sniffing import SNIFF_SIZE, sniff_content_type, is_allowed
+
+
+class UnsupportedUpload(SuspiciousOperation):
+    """The real type of an uploaded file is not accepted."""
+
+
+class FileTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_code = "file_too_large"
+
+
+class UnsupportedFileType(APIException):
+    status_code = status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+    default_code = "unsupported_file_type"
+
+
+def error(exception_class, message: str) -> APIException:
+    return exception_class(detail={"success": False, "result": message})
+
+
+class RestrictedFileUploadHandler(FileUploadHandler):
+    """
+    Validates every file of a multipart body while it is being received, before later handlers
+    spool it into memory or a temporary file:
+        * the first SNIFF_SIZE bytes are sniffed and the type is checked against "content_types"
+        * the received size is counted and the upload is aborted as soon as it exceeds "max_size"
+    The parser is interrupted with RequestDataTooBig or UnsupportedUpload (both SuspiciousOperation,
+    a plain 400 response), the rest of the body is never read.
+
+    Registered first in FILE_UPLOAD_HANDLERS with FILE_UPLOAD_MAX_SIZE and no type restriction,
+    views accepting files of one model field insert a stricter one, see restrict_uploads().
+    """
+
+    def __init__(self, request=None, max_size: int = None, content_types=None):
+        super().__init__(request)
+        self.max_size = max_size or settings.FILE_UPLOAD_MAX_SIZE
+        self.content_types = content_types
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.head = b""
+        self.sniffed = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.max_size:
+            raise RequestDataTooBig("Please keep filesize under %s." % filesizeformat(self.max_size))
+
+        if not self.sniffed:
+            self.head += raw_data[: SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE:
+                self.check_type()
+
+        return raw_data
+
+    def file_complete(self, file_size):
+        # Files shorter than SNIFF_SIZE
+        if not self.sniffed:
+            self.check_type()
+        return None
+
+    def check_type(self):
+        self.sniffed = True
+        if self.content_types is None:
+            return
+        if not is_allowed(sniff_content_type(self.head), self.content_types):
+            raise UnsupportedUpload("Filetype not supported.")
+
+
+def restrict_uploads(request, field):
+    """
+    Makes the multipart body of "request" follow the limits of a ContentTypeRestrictedFileField
+    and parses it right away, a rejected file becomes FileTooLarge (413) or UnsupportedFileType (415).
+    Has to be called before request.data or request.FILES is accessed.
+    """
+    request.upload_handlers.insert(
+        0,
+        RestrictedFileUploadHandler(
+            request,
+            max_size=field.max_upload_size,
+            content_types=field.content_types,
+        ),
+    )
+    try:
+        request.data
+    except RequestDataTooBig as exception:
+        raise error(FileTooLarge, str(exception))
+    except UnsupportedUpload as exception:
+        raise error(UnsupportedFileType, str(exception))
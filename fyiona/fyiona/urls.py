@@ -1,7 +1,8 @@
 from django.conf import settings
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
+
+from .media import serve
 
 
 
@@ -12,8 +13,8 @@ urlpatterns = [
     path("api/v1/posts/", include("posts.urls")),
     # path("api/v1/stories/", include("stories.urls")),
     # path("api/v1/messages/", include("umessages.urls")),
-]
+    path("api/v1/uploads/", include("uploads.urls")),
 
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    # Ranges and conditional GETs, behind nginx only headers + X-Accel-Redirect, see fyiona.media
+    re_path(r"^%s(?P<path>.+)$" % settings.MEDIA_URL.lstrip("/"), serve, name="media"),
+]
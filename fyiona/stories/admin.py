@@ -1,6 +1,8 @@
 from django.contrib import admin
 
-from .models import Story, StoryFile
+from .models import Story, StoryFile, StoryArchive, StoryFileArchive
 
 admin.site.register(Story)
 admin.site.register(StoryFile)
+admin.site.register(StoryArchive)
+admin.site.register(StoryFileArchive)
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.utils import timezone
+
+from uploads.blobs import add_references
+from .models import Story, StoryFile, StoryArchive, StoryFileArchive
+
+
+def archive_expired_chunk(chunk_size: int = 500, now=None) -> tuple:
+    """
+    Moves one chunk of expired stories out of the live table in a single transaction.
+    Stories with save_story_to_archive=True are copied to StoryArchive together with their files,
+    then the whole chunk is deleted (StoryFile, viewers and feed rows go away by cascade).
+    Returns (archived, deleted), (0, 0) means there is nothing left to do.
+    """
+    now = now or timezone.now()
+
+    with transaction.atomic():
+        # SKIP LOCKED lets several archivers work on different chunks at the same time
+        ids = list(
+            Story.objects.expired(now)
+            .select_for_update(skip_locked=True)
+            .order_by("expires_at", "id")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return 0, 0
+
+        stories = list(Story.objects.filter(id__in=ids, save_story_to_archive=True))
+        archives = StoryArchive.objects.bulk_create(
+            [
+                StoryArchive(
+                    original_id=story.id,
+                    author_id=story.author_id,
+                    caption=story.caption,
+                    reaction=story.reaction,
+                    viewers_count=story.viewers_count,
+                    created_at=story.created_at,
+                    expires_at=story.expires_at,
+                    archived_at=now,
+                )
+                for story in stories
+            ]
+        )
+        archive_ids = {archive.original_id: archive.id for archive in archives}
+
+        files = list(StoryFile.objects.filter(story_id__in=archive_ids).values_list("story_id", "attachment"))
+        StoryFileArchive.objects.bulk_create(
+            [
+                StoryFileArchive(story_id=archive_ids[story_id], attachment=attachment)
+                for story_id, attachment in files
+            ]
+        )
+        # The archive keeps the files alive, deleting the StoryFile rows below drops their references
+        add_references([attachment for _, attachment in files])
+
+        Story.objects.filter(id__in=ids).delete()
+
+    return len(archives), len(ids)
+
+
+def archive_expired_stories(chunk_size: int = 500, now=None, progress=None) -> tuple:
+    """Archives expired stories chunk by chunk until none is left, returns the totals (archived, deleted)."""
+    now = now or timezone.now()
+    total_archived = total_deleted = 0
+
+    while True:
+        archived, deleted = archive_expired_chunk(chunk_size=chunk_size, now=now)
+        if not deleted:
+            break
+
+        total_archived += archived
+        total_deleted += deleted
+        if progress is not None:
+            progress(total_archived, total_deleted)
+
+    return total_archived, total_deleted
@@ -0,0 +1,102 @@
+"""
+Story feed: stories of the accounts a user follows, newest first.
+
+Normal accounts push a new story into the TimelineEntry rows of every follower (fan-out-on-write),
+so reading a feed is one index range scan. Accounts with at least STORIES_FANOUT_THRESHOLD followers
+are not fanned out, their stories are pulled while reading the feed (fan-out-on-read) and merged in.
+Story ids grow with time, so the feed is ordered and paginated by story id.
+"""
+
+from django.conf import settings
+
+from users.models import Follow, UserProfile
+from .models import Story, TimelineEntry
+
+
+FANOUT_BATCH_SIZE = 1000
+
+
+def get_fanout_threshold() -> int:
+    return getattr(settings, "STORIES_FANOUT_THRESHOLD", 5000)
+
+
+def get_followers_count(author_id) -> int:
+    return UserProfile.objects.filter(user_id=author_id).values_list("followers_count", flat=True).first() or 0
+
+
+def get_follower_ids(author_id):
+    """User ids of the people who follow the author."""
+    return Follow.objects.filter(profile__user_id=author_id).values_list("follower__user_id", flat=True)
+
+
+def get_pulled_author_ids(user) -> list:
+    """Followed accounts that are too big to be fanned out, their stories are merged while reading."""
+    return list(
+        Follow.objects.filter(
+            follower__user_id=user.pk,
+            profile__followers_count__gte=get_fanout_threshold(),
+        ).values_list("profile__user_id", flat=True)
+    )
+
+
+def remove_author_from_timeline(owner_id, author_id) -> int:
+    """Drops the pushed stories of an author the owner stopped following."""
+    deleted, _ = TimelineEntry.objects.filter(owner_id=owner_id, author_id=author_id).delete()
+    return deleted
+
+
+def fan_out_story(story: Story) -> int:
+    """Writes the story into the feeds of the author's followers, returns the number of written rows."""
+    if get_followers_count(story.author_id) >= get_fanout_threshold():
+        return 0
+
+    hidden_from = set(story.hidden_story_from.values_list("id", flat=True))
+    written = 0
+    batch = []
+
+    for follower_id in get_follower_ids(story.author_id).iterator(chunk_size=FANOUT_BATCH_SIZE):
+        if follower_id in hidden_from:
+            continue
+        batch.append(TimelineEntry(owner_id=follower_id, story_id=story.id, author_id=story.author_id))
+        if len(batch) >= FANOUT_BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            written += len(batch)
+            batch = []
+
+    if batch:
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+        written += len(batch)
+
+    return written
+
+
+def get_feed(user, before=None, limit: int = 20) -> tuple:
+    """
+    Returns up to "limit" stories older than the story id "before" (newest first)
+    and the value of "before" for the next page (None on the last page).
+    Both sources are read with an index range scan limited to one page and merged.
+    """
+    pushed = TimelineEntry.objects.filter(owner=user)
+    if before is not None:
+        pushed = pushed.filter(story_id__lt=before)
+    story_ids = list(pushed.order_by("-story_id").values_list("story_id", flat=True)[:limit])
+
+    pulled_author_ids = get_pulled_author_ids(user)
+    if pulled_author_ids:
+        pulled = Story.objects.live().filter(author_id__in=pulled_author_ids).exclude(hidden_story_from=user)
+        if before is not None:
+            pulled = pulled.filter(id__lt=before)
+        story_ids += list(pulled.order_by("-id").values_list("id", flat=True)[:limit])
+
+    story_ids = sorted(set(story_ids), reverse=True)[:limit]
+    next_before = story_ids[-1] if len(story_ids) == limit else None
+
+    # Visibility may have changed after the fan-out, expired stories wait for the archiver in the timeline
+    stories = (
+        Story.objects.live()
+        .filter(id__in=story_ids)
+        .exclude(hidden_story_from=user)
+        .select_related("author")
+        .prefetch_related("attachments")
+    )
+    return sorted(stories, key=lambda story: story.id, reverse=True), next_before
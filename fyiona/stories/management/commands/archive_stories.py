@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from stories.archive import archive_expired_stories
+
+
+class Command(BaseCommand):
+    """
+    Moves expired stories out of the live table, meant to be run periodically (e.g. every 10 minutes by cron).
+    Every chunk is archived in its own short transaction, so the live table is never locked for long.
+    """
+
+    help = "Archives expired stories in chunks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Stories per transaction")
+
+    def handle(self, *args, **options):
+        def progress(archived, deleted):
+            self.stdout.write("Removed from live table: %s, archived: %s" % (deleted, archived))
+
+        archived, deleted = archive_expired_stories(chunk_size=options["chunk_size"], progress=progress)
+        self.stdout.write(
+            self.style.SUCCESS("Done. Removed from live table: %s, archived: %s" % (deleted, archived))
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from stories.viewers import refresh_viewers_count
+
+
+class Command(BaseCommand):
+    """Recomputes Story.viewers_count from stories.models.StoryView, safe to run more than once."""
+
+    help = "Recomputes viewer counters of all stories"
+
+    def handle(self, *args, **options):
+        updated = refresh_viewers_count()
+        self.stdout.write(self.style.SUCCESS("Counters recomputed for %s stories" % updated))
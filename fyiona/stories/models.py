@@ -1,11 +1,15 @@
+from datetime import timedelta
+
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from users.models import CustomUser
 from django.utils.translation import gettext_lazy as _
 from django.db.models.fields.related import ManyToManyField
 
 
 from fyiona.fields import ContentTypeRestrictedFileField
+from fyiona.storage import content_addressed_storage
 
 ALLOWED_TO_REPLY = (
     (
@@ -23,6 +27,18 @@ ALLOWED_TO_REPLY = (
 )
 
 
+def get_story_expiry_date():
+    return timezone.now() + timedelta(hours=settings.STORY_LIFETIME_HOURS)
+
+
+class StoryQuerySet(models.QuerySet):
+    def live(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def expired(self, now=None):
+        return self.filter(expires_at__lte=now or timezone.now())
+
+
 class Story(models.Model):
     author = models.ForeignKey(
         to=CustomUser,
@@ -31,6 +47,7 @@ class Story(models.Model):
         verbose_name=_("Author of a story"),
     )
 
+    # Legacy table, stories.viewers.move_legacy_views moves its rows into StoryView after every migrate
     viewers = models.ManyToManyField(
         blank=True,
         default=[],
@@ -39,6 +56,11 @@ class Story(models.Model):
         verbose_name=_("People viewed a story"),
     )
 
+    viewers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Number of people viewed a story"),
+    )
+
     caption = models.CharField(
         null=True,
         blank=True,
@@ -132,6 +154,20 @@ class Story(models.Model):
         verbose_name=_("Allow sharing messages"),
     )
 
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        editable=False,
+        verbose_name=_("Date Created"),
+    )
+
+    expires_at = models.DateTimeField(
+        default=get_story_expiry_date,
+        db_index=True,
+        verbose_name=_("Date Expires"),
+    )
+
+    objects = StoryQuerySet.as_manager()
+
     def __str__(self) -> str:
         return self.author.first_name
 
@@ -145,6 +181,9 @@ class StoryFile(models.Model):
     )
     attachment = ContentTypeRestrictedFileField(
         upload_to="accounts/stories/",
+        storage=content_addressed_storage,
+        # Looked up by name when a blob is requested, see fyiona.media.is_public
+        db_index=True,
         verbose_name=_("Story File"),
         content_types=[
             "image/jpeg",
@@ -155,6 +194,164 @@ class StoryFile(models.Model):
         ],
         max_upload_size=settings.STORY_MAX_FILE_SIZE,
     )
+    # Resized copies of image attachments, see fyiona.images
+    derivatives = models.JSONField(
+        verbose_name=_("Image Derivatives"),
+        default=dict,
+        blank=True,
+        editable=False,
+    )
 
     def __str__(self) -> str:
         return "Story ID: %s  Path: %s" % (self.story.id, self.content_file)
+
+
+class StoryView(models.Model):
+    """
+    A viewer of a story. Rows are written in bulk by stories.viewers.StoryViewBuffer,
+    the unique constraint makes repeated views of the same person a no-op.
+    """
+
+    story = models.ForeignKey(
+        to=Story,
+        on_delete=models.CASCADE,
+        related_name="views",
+        verbose_name=_("Story"),
+    )
+    viewer = models.ForeignKey(
+        to=CustomUser,
+        on_delete=models.CASCADE,
+        related_name="story_views",
+        verbose_name=_("Viewer"),
+    )
+    viewed_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Date Viewed"),
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["story", "viewer"],
+                name="stories_story_view_unique",
+            ),
+        ]
+        indexes = [
+            # Paginated list of viewers, newest first
+            models.Index(
+                fields=["story", "-viewed_at", "-id"],
+                name="stories_story_viewers_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return "Story ID: %s  Viewer: %s" % (self.story_id, self.viewer_id)
+
+
+class TimelineEntry(models.Model):
+    """
+    Precomputed story feed: a row per (follower, story), written when a story is published (fan-out-on-write).
+    Stories of accounts with a huge number of followers are not copied here,
+    they are merged into the feed while reading it (see stories.feed).
+    """
+
+    owner = models.ForeignKey(
+        to=CustomUser,
+        on_delete=models.CASCADE,
+        related_name="story_timeline",
+        verbose_name=_("Owner of the feed"),
+    )
+    story = models.ForeignKey(
+        to=Story,
+        on_delete=models.CASCADE,
+        related_name="timeline_entries",
+        verbose_name=_("Story"),
+    )
+    author = models.ForeignKey(
+        to=CustomUser,
+        on_delete=models.CASCADE,
+        related_name="+",
+        verbose_name=_("Author of a story"),
+    )
+
+    class Meta:
+        constraints = [
+            # Also serves the feed query: (owner, story) scanned backwards gives the newest stories first
+            models.UniqueConstraint(
+                fields=["owner", "story"],
+                name="stories_timeline_entry_unique",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return "Feed of %s: story %s" % (self.owner_id, self.story_id)
+
+
+class StoryArchive(models.Model):
+    """
+    Expired story moved out of the live table by the "archive_stories" management command.
+    Only stories with save_story_to_archive=True are kept here, the rest are deleted.
+    """
+
+    original_id = models.BigIntegerField(
+        unique=True,
+        verbose_name=_("ID of the live story"),
+    )
+    author = models.ForeignKey(
+        to=CustomUser,
+        on_delete=models.CASCADE,
+        related_name="archived_stories",
+        verbose_name=_("Author of a story"),
+    )
+    caption = models.CharField(
+        null=True,
+        blank=True,
+        max_length=255,
+        verbose_name=_("On screen text"),
+    )
+    reaction = models.CharField(
+        max_length=5,
+        blank=True,
+        verbose_name=_("Reaction"),
+    )
+    viewers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Number of people viewed a story"),
+    )
+    created_at = models.DateTimeField(
+        verbose_name=_("Date Created"),
+    )
+    expires_at = models.DateTimeField(
+        verbose_name=_("Date Expired"),
+    )
+    archived_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Date Archived"),
+    )
+
+    class Meta:
+        ordering = ["-original_id"]
+        indexes = [
+            models.Index(
+                fields=["author", "-original_id"],
+                name="stories_archive_author_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return "Archived story ID: %s" % self.original_id
+
+
+class StoryFileArchive(models.Model):
+    story = models.ForeignKey(
+        StoryArchive, on_delete=models.CASCADE, related_name="attachments"
+    )
+    attachment = models.FileField(
+        upload_to="accounts/stories/",
+        storage=content_addressed_storage,
+        max_length=255,
+        verbose_name=_("Story File"),
+    )
+
+    def __str__(self) -> str:
+        return "Archived story ID: %s  Path: %s" % (self.story.original_id, self.attachment)
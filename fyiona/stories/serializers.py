@@ -7,10 +7,15 @@ from rest_framework.serializers import (
     Serializer,
     ModelSerializer,
     ValidationError,
+    SerializerMethodField,
 )
 
-from users.serializers import CustomUserDetailSerializer
-from .models import Story, StoryFile
+from django.db import transaction
+
+from fyiona.images import get_derivative_urls
+from users.serializers import CustomUserListSerializer
+from .feed import fan_out_story
+from .models import Story, StoryFile, StoryView
 
 #########################################################
 ######################## Story ##########################
@@ -18,10 +23,15 @@ from .models import Story, StoryFile
 
 
 class StoryFileSerializer(ModelSerializer):
+    derivatives = SerializerMethodField()
+
     class Meta:
         model = StoryFile
         fields = "__all__"
 
+    def get_derivatives(self, story_file: StoryFile) -> dict:
+        return get_derivative_urls(story_file, "attachment", self.context.get("request"))
+
 
 class StorySerializer(ModelSerializer):
     """
@@ -30,7 +40,6 @@ class StorySerializer(ModelSerializer):
 
     def create(self, validated_data) -> Story:
         """Creates a new Story, however, adds an author's id who made a request before to save a Story"""
-        viewers = []
         hidden_story_from = validated_data.pop("hidden_story_from", [])
 
         user_id = self.context.get("request").user.id
@@ -38,7 +47,6 @@ class StorySerializer(ModelSerializer):
         story = Story(**validated_data)
         story.save()
 
-        story.viewers.set(viewers)
         story.hidden_story_from.set(hidden_story_from)
 
         attachments = self.context.get("request").FILES.getlist("attachments")
@@ -47,18 +55,34 @@ class StorySerializer(ModelSerializer):
             sf = StoryFile(story=story, attachment=attachment)
             sf.save()
 
+        transaction.on_commit(lambda: fan_out_story(story))
+
         return story
 
-    viewers = CustomUserDetailSerializer(many=True, required=False)
     attachments = StoryFileSerializer(many=True, read_only=True)
 
     class Meta:
         model = Story
-        fields = "__all__"
+        # Viewers are listed page by page, see StoryViewSet.viewers
+        exclude = ("viewers",)
 
         read_only_fields = (
             "id",
             "created_at",
+            "expires_at",
             "author",
+            "viewers_count",
             "story_files",
         )
+
+
+class StoryViewerSerializer(ModelSerializer):
+    viewer = CustomUserListSerializer(read_only=True)
+
+    class Meta:
+        model = StoryView
+        fields = (
+            "id",
+            "viewer",
+            "viewed_at",
+        )
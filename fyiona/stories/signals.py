@@ -0,0 +1,25 @@
+from django.dispatch import receiver
+from django.db.models.signals import post_save, post_migrate
+
+from fyiona.images import schedule_derivatives
+from users.signals import follow_removed
+from .feed import remove_author_from_timeline
+from .models import StoryFile
+from .viewers import move_legacy_views
+
+
+@receiver(post_migrate)
+def move_legacy_story_viewers(sender, **kwargs):
+    """Story.viewers was a plain many-to-many table before StoryView, its leftover rows are moved once."""
+    if sender.label == "stories":
+        move_legacy_views()
+
+
+@receiver(post_save, sender=StoryFile)
+def generate_story_image_derivatives(sender, instance, **kwargs):
+    schedule_derivatives(instance, "attachment")
+
+
+@receiver(follow_removed)
+def purge_unfollowed_stories(sender, follower, profile, **kwargs):
+    remove_author_from_timeline(follower.user_id, profile.user_id)
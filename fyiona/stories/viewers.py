@@ -0,0 +1,144 @@
+import atexit
+import logging
+import threading
+from collections import Counter
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Story, StoryView
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "MAX_SIZE": 500,  # buffered views that trigger a flush
+    "MAX_AGE": 2.0,  # seconds a view may wait in the buffer
+}
+
+
+class StoryViewBuffer:
+    """
+    Collects "story viewed" events in memory and writes them with one bulk INSERT per flush.
+    Repeated views are merged in the buffer and skipped if the viewer is already in the table,
+    then Story.viewers_count of every touched story is incremented by the number of its new viewers.
+    A flush happens when the buffer is full, MAX_AGE seconds after the first buffered view and at exit.
+    """
+
+    def __init__(self, max_size: int, max_age: float):
+        self.max_size = max_size
+        self.max_age = max_age
+        self._views = {}
+        self._lock = threading.Lock()
+        self._timer = None
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULT_SETTINGS, **getattr(settings, "STORY_VIEWS_BUFFER", {})}
+        return cls(max_size=options["MAX_SIZE"], max_age=options["MAX_AGE"])
+
+    def add(self, story_id, viewer_id):
+        with self._lock:
+            self._views.setdefault((story_id, viewer_id), timezone.now())
+            full = len(self._views) >= self.max_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.max_age, self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+
+        if full:
+            self.flush()
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Could not flush story views")
+        finally:
+            close_old_connections()
+
+    def flush(self) -> int:
+        """Writes buffered views, returns the number of flushed (story, viewer) pairs."""
+        with self._lock:
+            views, self._views = self._views, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+        if not views:
+            return 0
+
+        story_ids = {story_id for story_id, _ in views}
+        with transaction.atomic():
+            # Concurrent flushes of the same stories wait for each other, so nobody is counted twice.
+            # Stories may have expired or been deleted while the views were buffered.
+            existing = set(
+                Story.objects.select_for_update().filter(id__in=story_ids).order_by("id").values_list("id", flat=True)
+            )
+            seen = set(
+                StoryView.objects.filter(
+                    story_id__in=existing, viewer_id__in={viewer_id for _, viewer_id in views}
+                ).values_list("story_id", "viewer_id")
+            )
+            new_views = [
+                StoryView(story_id=story_id, viewer_id=viewer_id, viewed_at=viewed_at)
+                for (story_id, viewer_id), viewed_at in views.items()
+                if story_id in existing and (story_id, viewer_id) not in seen
+            ]
+            StoryView.objects.bulk_create(new_views, batch_size=1000, ignore_conflicts=True)
+
+            for story_id, count in Counter(view.story_id for view in new_views).items():
+                Story.objects.filter(id=story_id).update(viewers_count=F("viewers_count") + count)
+
+        return len(views)
+
+
+def refresh_viewers_count(story_ids=None) -> int:
+    """
+    Recomputes the counters from the viewers table, all stories by default.
+    Repair tool ("manage.py recount_story_viewers"), flushes keep the counters up to date incrementally.
+    """
+    viewers = (
+        StoryView.objects.filter(story=OuterRef("pk"))
+        .order_by()
+        .values("story")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    stories = Story.objects.all() if story_ids is None else Story.objects.filter(id__in=story_ids)
+    return stories.update(viewers_count=Coalesce(Subquery(viewers), 0))
+
+
+def move_legacy_views(batch_size: int = 10000) -> int:
+    """
+    Copies the rows of the legacy Story.viewers table into StoryView and deletes them,
+    returns the number of moved rows. Safe to run more than once, called after every migrate.
+    """
+    field = Story._meta.get_field("viewers")
+    legacy = field.remote_field.through.objects
+    story_field, viewer_field = field.m2m_field_name(), field.m2m_reverse_field_name()
+
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                legacy.order_by("id").values_list("id", story_field + "_id", viewer_field + "_id")[:batch_size]
+            )
+            if not rows:
+                return moved
+
+            StoryView.objects.bulk_create(
+                [StoryView(story_id=story_id, viewer_id=viewer_id) for _, story_id, viewer_id in rows],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            legacy.filter(id__in=[row_id for row_id, _, _ in rows]).delete()
+            refresh_viewers_count({story_id for _, story_id, _ in rows})
+        moved += len(rows)
+
+
+story_view_buffer = StoryViewBuffer.from_settings()
+atexit.register(story_view_buffer._flush_in_background)
@@ -9,6 +9,7 @@ from rest_framework.status import (
     HTTP_403_FORBIDDEN,
 )
 from rest_framework.response import Response
+from rest_framework.decorators import action
 from rest_framework.viewsets import ViewSet
 from rest_framework.permissions import (
     AllowAny,
@@ -16,9 +17,14 @@ from rest_framework.permissions import (
     IsAuthenticatedOrReadOnly,
     IsAdminUser,
 )
-from .models import Story
+from fyiona.pagination import KeysetPagination
+from fyiona.uploadhandlers import restrict_uploads
+from .models import Story, StoryFile, StoryView
 from users.models import CustomUser
-from .serializers import StorySerializer
+from users.relationships import get_relationship_context
+from .feed import get_feed
+from .serializers import StorySerializer, StoryViewerSerializer
+from .viewers import story_view_buffer
 from users.middlewares import JWTAuthentication
 from django.shortcuts import get_object_or_404
 
@@ -32,7 +38,12 @@ class StoryViewSet(ViewSet):
     serializer_class = StorySerializer
     authentication_classes = (JWTAuthentication,)
 
+    FEED_PAGE_SIZE = 20
+    FEED_MAX_PAGE_SIZE = 50
+
     def create(self, request: HttpRequest):
+        # Aborts a wrong or oversized attachment before the whole body is received
+        restrict_uploads(request, StoryFile._meta.get_field("attachment"))
         if request.FILES and request.FILES.get("attachments"):
             serializer = self.serializer_class(
                 data=request.data, context={"request": request}
@@ -56,12 +67,95 @@ class StoryViewSet(ViewSet):
 
     def retrieve(self, request: HttpRequest, pk=None):
         user = get_object_or_404(CustomUser, pk=pk)
-        stories = Story.objects.filter(author=user)
+        stories = Story.objects.live().filter(author=user)
+        serializer = self.serializer_class(stories, many=True)
+        return Response(
+            data={
+                "success": True,
+                "result": serializer.data,
+            },
+            status=HTTP_200_OK,
+        )
+
+    @action(detail=False, methods=["get"])
+    def feed(self, request: HttpRequest):
+        """
+        Stories of the accounts the user follows, newest first.
+        The next page is requested with ?before=<next>.
+        """
+        try:
+            before = int(request.query_params["before"]) if request.query_params.get("before") else None
+            limit = min(int(request.query_params.get("limit", self.FEED_PAGE_SIZE)), self.FEED_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response(
+                data={
+                    "success": False,
+                    "result": "before and limit must be integers!",
+                },
+                status=HTTP_406_NOT_ACCEPTABLE,
+            )
+
+        stories, next_before = get_feed(request.user, before=before, limit=max(limit, 1))
         serializer = self.serializer_class(stories, many=True)
         return Response(
             data={
                 "success": True,
                 "result": serializer.data,
+                "next": next_before,
+            },
+            status=HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["post"])
+    def view(self, request: HttpRequest, pk=None):
+        """
+        Marks the story as viewed by the user. Idempotent: repeated calls do not change anything.
+        The view is buffered and written in bulk with other views, so the response does not wait for the database.
+        """
+        story = get_object_or_404(
+            Story.objects.live().exclude(hidden_story_from=request.user).only("id", "author_id"),
+            pk=pk,
+        )
+
+        if story.author_id != request.user.id:
+            story_view_buffer.add(story.id, request.user.id)
+
+        return Response(
+            data={
+                "success": True,
+                "result": "Story has been viewed",
+            },
+            status=HTTP_202_ACCEPTED,
+        )
+
+    @action(detail=True, methods=["get"])
+    def viewers(self, request: HttpRequest, pk=None):
+        """People who viewed the story, newest first, visible to the author only. Next page: ?cursor=<next>."""
+        story = get_object_or_404(Story.objects.only("id", "author_id"), pk=pk)
+
+        if story.author_id != request.user.id:
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Access denied!",
+                },
+                status=HTTP_403_FORBIDDEN,
+            )
+
+        paginator = KeysetPagination(ordering=("-viewed_at", "-id"))
+        views = paginator.paginate_queryset(
+            StoryView.objects.filter(story=story).select_related("viewer__user_profile"),
+            request,
+        )
+        serializer = StoryViewerSerializer(
+            views, many=True, context=get_relationship_context(request, [view.viewer_id for view in views])
+        )
+
+        return Response(
+            data={
+                "success": True,
+                "result": serializer.data,
+                "next": paginator.next_cursor,
             },
             status=HTTP_200_OK,
         )
@@ -94,6 +188,10 @@ class StoryViewSet(ViewSet):
             permission_classes = [IsAuthenticated]
         elif self.action == "retrieve":
             permission_classes = [IsAuthenticated]
+        elif self.action == "feed":
+            permission_classes = [IsAuthenticated]
+        elif self.action in ("view", "viewers"):
+            permission_classes = [IsAuthenticated]
         elif self.action == "destroy":
             permission_classes = [IsAuthenticated]
         else:
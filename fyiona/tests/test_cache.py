@@ -0,0 +1,53 @@
+import os
+import sys
+import inspect
+
+import django
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from users.cache import LocalLRUCache
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLocalLRUCache:
+    def test_get_and_expire(self):
+        timer = FakeTimer()
+        cache = LocalLRUCache(max_size=10, ttl=30, timer=timer)
+        cache.set("user", ("values",))
+
+        assert cache.get("user") == ("values",)
+
+        timer.now = 30
+        assert cache.get("user") is None
+        assert len(cache) == 0
+
+    def test_least_recently_used_is_evicted(self):
+        cache = LocalLRUCache(max_size=2, ttl=30, timer=FakeTimer())
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") == 3
+
+    def test_delete(self):
+        cache = LocalLRUCache(max_size=2, ttl=30, timer=FakeTimer())
+        cache.set("a", 1)
+        cache.delete("a")
+        cache.delete("missing")
+
+        assert cache.get("a") is None
@@ -0,0 +1,119 @@
+import os
+import sys
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from users import models as users_models
+from users.follows import follow, unfollow, get_followed_user_ids, recount_follows, move_legacy_follows
+from users.one_time_tokens import create_token
+from users.views import CustomUserDeleteAPIView
+from rest_framework.test import APIRequestFactory
+from users.relationships import get_relationships
+from users.serializers import CustomUserListSerializer
+from stories import models as stories_models
+from stories.feed import fan_out_story, get_feed
+
+
+def create_user(email: str) -> users_models.CustomUser:
+    user = users_models.CustomUser(email=email, first_name="Azatot", last_name="Nirlatotep")
+    user.set_password("Ykt4tVFd8bbk")
+    user.save()
+    return user
+
+
+@pytest.mark.django_db
+class TestFollowGraph:
+    def test_counters_follow_the_graph(self):
+        author, fan, other = (create_user("%s@gmail.com" % name) for name in ("author", "fan", "other"))
+
+        assert follow(fan.user_profile, author.user_profile)
+        assert not follow(fan.user_profile, author.user_profile)
+        assert follow(other.user_profile, author.user_profile)
+        assert follow(fan.user_profile, other.user_profile)
+
+        author.user_profile.refresh_from_db()
+        fan.user_profile.refresh_from_db()
+        assert author.user_profile.followers_count == 2
+        assert fan.user_profile.following_count == 2
+        assert get_followed_user_ids(fan, [author.id, other.id, fan.id]) == {author.id, other.id}
+
+        assert unfollow(fan.user_profile, author.user_profile)
+        assert not unfollow(fan.user_profile, author.user_profile)
+        author.user_profile.refresh_from_db()
+        assert author.user_profile.followers_count == 1
+
+        users_models.UserProfile.objects.update(followers_count=0, following_count=0)
+        recount_follows()
+        fan.user_profile.refresh_from_db()
+        assert (fan.user_profile.followers_count, fan.user_profile.following_count) == (0, 1)
+
+    def test_deleted_account_leaves_the_counters(self):
+        leaving, fan, idol = (create_user("%s@gmail.com" % name) for name in ("leaving", "fan", "idol"))
+        follow(fan.user_profile, leaving.user_profile)
+        follow(leaving.user_profile, idol.user_profile)
+        follow(fan.user_profile, idol.user_profile)
+        token = create_token(leaving, users_models.OneTimeToken.PURPOSE_ACCOUNT_DELETION)
+
+        response = CustomUserDeleteAPIView.as_view()(APIRequestFactory().get("/", {"token": token}))
+
+        assert response.status_code == 200
+        assert not users_models.CustomUser.objects.filter(email="leaving@gmail.com").exists()
+        fan.user_profile.refresh_from_db()
+        idol.user_profile.refresh_from_db()
+        assert fan.user_profile.following_count == 1
+        assert idol.user_profile.followers_count == 1
+
+    def test_legacy_followers_are_moved(self):
+        author, fan, other = (create_user("%s@gmail.com" % name) for name in ("author", "fan", "other"))
+        follow(fan.user_profile, author.user_profile)
+        author.user_profile.followers.add(fan.user_profile, other.user_profile, author.user_profile)
+
+        assert move_legacy_follows(batch_size=2) == 3
+        assert move_legacy_follows() == 0
+        assert not author.user_profile.followers.exists()
+        assert get_followed_user_ids(other, [author.id]) == {author.id}
+        author.user_profile.refresh_from_db()
+        assert author.user_profile.followers_count == 2
+
+    def test_unfollow_purges_timeline(self):
+        author, fan = create_user("author@gmail.com"), create_user("fan@gmail.com")
+        follow(fan.user_profile, author.user_profile)
+        story = stories_models.Story.objects.create(author=author)
+        assert fan_out_story(story) == 1
+
+        unfollow(fan.user_profile, author.user_profile)
+
+        assert get_feed(fan) == ([], None)
+
+
+@pytest.mark.django_db
+class TestRelationships:
+    def test_constant_number_of_queries(self, rf, django_assert_num_queries):
+        viewer = create_user("viewer@gmail.com")
+        users = [create_user("user%s@gmail.com" % index) for index in range(20)]
+        follow(viewer.user_profile, users[0].user_profile)
+        follow(users[1].user_profile, viewer.user_profile)
+        story = stories_models.Story.objects.create(author=viewer)
+        story.hidden_story_from.add(users[2])
+
+        # following, followed by, hidden from stories
+        with django_assert_num_queries(3):
+            relationships = get_relationships(viewer, [user.id for user in users])
+
+        assert relationships[users[0].id] == {"following": True, "followed_by": False, "hidden_from_stories": False}
+        assert relationships[users[1].id]["followed_by"]
+        assert relationships[users[2].id]["hidden_from_stories"]
+
+        request = rf.get("/")
+        request.user = viewer
+        rows = users_models.CustomUser.objects.filter(id__in=[user.id for user in users]).select_related("user_profile")
+        data = CustomUserListSerializer(rows, many=True, context={"request": request}).data
+        assert sum(row["relationship"]["following"] for row in data) == 1
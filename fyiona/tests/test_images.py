@@ -0,0 +1,45 @@
+import os
+import sys
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from PIL import Image
+from django.core.files import File
+
+from users import models as users_models
+from fyiona.images import DERIVATIVES, update_derivatives, get_derivative_urls
+
+
+@pytest.mark.django_db
+class TestImageDerivatives:
+    def test_avatar_derivatives(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        user = users_models.CustomUser(email="avatar@gmail.com", first_name="Azatot", last_name="Nirlatotep")
+        user.set_password("Ykt4tVFd8bbk")
+        user.save()
+        profile = user.user_profile
+        # The default avatar is shared and never processed
+        assert get_derivative_urls(profile, "avatar") == {}
+
+        with open(os.path.join(currentdir, "test_files", "test_image.png"), "rb") as image:
+            profile.avatar.save("avatar.png", File(image))
+
+        assert update_derivatives(users_models.UserProfile, profile.pk, "avatar", profile.avatar.name)
+        profile.refresh_from_db()
+        urls = get_derivative_urls(profile, "avatar")
+
+        assert set(urls) == {"placeholder", *DERIVATIVES}
+        assert urls["placeholder"].startswith("data:image/jpeg;base64,")
+        for derivative, size in DERIVATIVES.items():
+            with Image.open(profile.avatar.storage.path(profile.derivatives[derivative])) as resized:
+                assert max(resized.size) <= size
+        # Already up to date
+        assert not update_derivatives(users_models.UserProfile, profile.pk, "avatar", profile.avatar.name)
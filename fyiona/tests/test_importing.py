@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from django.contrib.auth.hashers import make_password
+
+from users import models as users_models
+from users.importing import UserImporter, RowError, build_user, read_rows
+
+
+USERS = 2000
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("2021-10-01", "2021-10-01"),
+        ("2021-10-01 12:00:00", "2021-10-01"),
+        # Already the 2nd in UTC
+        ("2021-10-01T23:30:00-05:00", "2021-10-02"),
+    ],
+)
+def test_date_joined(settings, value, expected):
+    settings.TIME_ZONE = "UTC"
+    user = build_user({"email": "user@gmail.com", "date_joined": value})
+    assert user.date_joined.isoformat() == expected
+
+
+def test_invalid_date_joined():
+    with pytest.raises(RowError):
+        build_user({"email": "user@gmail.com", "date_joined": "2021-13-45"})
+
+
+@pytest.mark.django_db
+class TestUserImport:
+    def test_jsonl_import(self, tmp_path, django_assert_max_num_queries):
+        password = make_password("Ykt4tVFd8bbk")
+        path = tmp_path / "users.jsonl"
+        with open(path, "w") as file:
+            for index in range(USERS):
+                row = {"email": "user%s@gmail.com" % index, "first_name": "User", "password": password}
+                file.write(json.dumps(row) + "\n")
+            file.write(json.dumps({"email": "user0@gmail.com"}) + "\n")
+            file.write(json.dumps({"email": "plain@gmail.com", "password": "Ykt4tVFd8bbk"}) + "\n")
+            file.write("{broken\n")
+
+        importer = UserImporter(chunk_size=500)
+        # Per chunk: taken emails, taken ids, SAVEPOINT, users, profiles, RELEASE
+        with django_assert_max_num_queries(USERS // 500 * 6 + 5):
+            importer.run(read_rows(str(path)))
+
+        assert importer.imported == USERS
+        assert [line for line, _ in importer.errors] == [USERS + 1, USERS + 2, USERS + 3]
+        user = users_models.CustomUser.objects.get(email="user1@gmail.com")
+        assert user.check_password("Ykt4tVFd8bbk")
+        assert users_models.UserProfile.objects.count() == USERS
+
+    def test_csv_import_skips_registered_emails(self, tmp_path):
+        users_models.CustomUser.objects.create_user(email="taken@gmail.com", password="Ykt4tVFd8bbk")
+        path = tmp_path / "users.csv"
+        path.write_text(
+            "email,first_name,phone_number\n"
+            "taken@gmail.com,Taken,\n"
+            "new@gmail.com,New,+996550271098\n"
+        )
+
+        importer = UserImporter()
+        importer.run(read_rows(str(path)))
+
+        assert importer.imported == 1
+        assert importer.errors == [(2, "email taken@gmail.com is already registered")]
+        user = users_models.CustomUser.objects.get(email="new@gmail.com")
+        assert user.phone_number_digits == "996550271098"
+        assert not user.has_usable_password()
+
+    def test_legacy_ids_are_not_imported_twice(self, tmp_path):
+        user = users_models.CustomUser.objects.create_user(email="first@gmail.com", password="Ykt4tVFd8bbk")
+        path = tmp_path / "users.csv"
+        path.write_text(
+            "id,email\n"
+            "%s,other@gmail.com\n"
+            "6f1c0f2e-8d52-4c1b-9a39-4d6a0b7f1e11,new@gmail.com\n"
+            "6f1c0f2e-8d52-4c1b-9a39-4d6a0b7f1e11,again@gmail.com\n" % user.id
+        )
+
+        importer = UserImporter()
+        importer.run(read_rows(str(path)))
+
+        assert importer.imported == 1
+        assert importer.errors == [
+            (4, "duplicate id 6f1c0f2e-8d52-4c1b-9a39-4d6a0b7f1e11 in the file"),
+            (2, "id %s is already registered" % user.id),
+        ]
+        assert users_models.CustomUser.objects.filter(email="new@gmail.com").exists()
@@ -0,0 +1,123 @@
+import os
+import sys
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from django.core import mail
+from django.core.mail import get_connection
+
+from users.models import OutboundEmail, OneTimeToken
+from users.one_time_tokens import hash_token
+from users.registration import register_user
+from users.mailer import enqueue_email, send_queued_emails
+
+
+class BrokenConnection:
+    def open(self):
+        raise ConnectionRefusedError("SMTP server is down")
+
+    def send_messages(self, messages):
+        raise AssertionError("must not be called")
+
+    def close(self):
+        pass
+
+
+class CrashingConnection:
+    """Delivers the first message, then the worker dies."""
+
+    def __init__(self):
+        self.delivered = []
+
+    def open(self):
+        pass
+
+    def send_messages(self, messages):
+        if self.delivered:
+            raise SystemExit
+        self.delivered.extend(messages)
+
+    def close(self):
+        pass
+
+
+@pytest.mark.django_db
+class TestMailQueue:
+    def test_enqueue_does_not_send(self, settings):
+        settings.EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+        enqueue_email("azatot@gmail.com", "Subject", "Body")
+
+        assert len(mail.outbox) == 0
+        assert OutboundEmail.objects.filter(status=OutboundEmail.STATUS_PENDING).count() == 1
+
+    def test_batch_is_sent_over_one_connection(self, settings):
+        settings.EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+        for number in range(3):
+            enqueue_email("user%s@gmail.com" % number, "Subject", "Body")
+
+        sent, failed = send_queued_emails(connection=get_connection())
+
+        assert (sent, failed) == (3, 0)
+        assert len(mail.outbox) == 3
+        assert OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENT).count() == 3
+
+    def test_failed_email_is_retried_later(self, settings):
+        settings.MAIL_QUEUE = {"MAX_ATTEMPTS": 2, "RETRY_BACKOFF": 60}
+        email = enqueue_email("azatot@gmail.com", "Subject", "Body")
+
+        assert send_queued_emails(connection=BrokenConnection()) == (0, 1)
+        email.refresh_from_db()
+        assert email.status == OutboundEmail.STATUS_PENDING
+        assert email.attempts == 1
+        assert "SMTP server is down" in email.last_error
+
+        # Backoff: the email is not due yet
+        assert send_queued_emails(connection=BrokenConnection()) == (0, 0)
+
+        OutboundEmail.objects.update(next_attempt_at=email.created_at)
+        assert send_queued_emails(connection=BrokenConnection()) == (0, 1)
+        email.refresh_from_db()
+        assert email.status == OutboundEmail.STATUS_FAILED
+
+    def test_crashed_batch_is_resent_after_lease(self, settings):
+        settings.EMAIL_BACKEND = "django.core.mail.backends.locmem.EmailBackend"
+        for number in range(3):
+            enqueue_email("user%s@gmail.com" % number, "Subject", "Body")
+
+        connection = CrashingConnection()
+        with pytest.raises(SystemExit):
+            send_queued_emails(connection=connection)
+        assert OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENT).count() == 1
+        assert OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENDING).count() == 2
+
+        # The rest of the batch still belongs to the crashed worker
+        assert send_queued_emails(connection=get_connection()) == (0, 0)
+
+        OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENDING).update(
+            next_attempt_at=OutboundEmail.objects.get(status=OutboundEmail.STATUS_SENT).created_at
+        )
+        assert send_queued_emails(connection=get_connection()) == (2, 0)
+        assert connection.delivered[0].to not in [message.to for message in mail.outbox]
+
+
+@pytest.mark.django_db
+class TestRegistration:
+    def test_confirmation_email_is_queued_after_commit(self, django_capture_on_commit_callbacks):
+        with django_capture_on_commit_callbacks(execute=True):
+            user = register_user(email="azatot@gmail.com", password="Ykt4tVFd8bbk", first_name="Azatot")
+            assert user.user_profile.pk is not None
+            assert not OutboundEmail.objects.exists()
+
+        token = OneTimeToken.objects.get(user=user, purpose=OneTimeToken.PURPOSE_EMAIL_CONFIRMATION)
+        email = OutboundEmail.objects.get()
+        assert email.to_email == "azatot@gmail.com"
+        # Only the digest of the token in the link is stored
+        assert hash_token(email.body.strip().rsplit("/", 1)[-1]) == token.digest
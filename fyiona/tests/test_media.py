@@ -0,0 +1,123 @@
+import os
+import sys
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from django.http import Http404
+from django.test import RequestFactory
+
+from users import models as users_models
+from users.tokens import issue_token
+from umessages import models as umessages_models
+from fyiona.media import parse_range, serve
+
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def media(settings, tmp_path):
+    settings.MEDIA_ROOT = str(tmp_path)
+    settings.MEDIA_ACCEL_REDIRECT = None
+    (tmp_path / "video.mp4").write_bytes(CONTENT)
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=1000-", (1000, 1023)),
+        ("bytes=-24", (1000, 1023)),
+        ("bytes=1000-5000", (1000, 1023)),
+        ("bytes=0-1,5-6", None),
+        ("items=0-1", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, len(CONTENT)) == expected
+
+
+class TestServeMedia:
+    factory = RequestFactory()
+
+    def test_range(self, media):
+        response = serve(self.factory.get("/media/video.mp4", HTTP_RANGE="bytes=100-199"), "video.mp4")
+        assert response.status_code == 206
+        assert response["Content-Range"] == "bytes 100-199/1024"
+        assert b"".join(response.streaming_content) == CONTENT[100:200]
+
+    def test_unsatisfiable_range(self, media):
+        response = serve(self.factory.get("/media/video.mp4", HTTP_RANGE="bytes=5000-"), "video.mp4")
+        assert response.status_code == 416
+        assert response["Content-Range"] == "bytes */1024"
+
+    def test_conditional_get(self, media):
+        etag = serve(self.factory.get("/media/video.mp4"), "video.mp4")["ETag"]
+        response = serve(self.factory.get("/media/video.mp4", HTTP_IF_NONE_MATCH=etag), "video.mp4")
+        assert response.status_code == 304
+
+    def test_accel_redirect(self, media, settings):
+        settings.MEDIA_ACCEL_REDIRECT = "/protected-media/"
+        response = serve(self.factory.get("/media/video.mp4", HTTP_RANGE="bytes=0-1"), "video.mp4")
+        assert response.status_code == 200
+        assert response["X-Accel-Redirect"] == "/protected-media/video.mp4"
+        assert response.content == b""
+
+
+def create_user(email: str) -> users_models.CustomUser:
+    user = users_models.CustomUser(email=email, first_name="Azatot", last_name="Nirlatotep")
+    user.set_password("Ykt4tVFd8bbk")
+    user.save()
+    return user
+
+
+@pytest.mark.django_db
+class TestPrivateMedia:
+    factory = RequestFactory()
+    path = "messages/attachments/secret.png"
+
+    @pytest.fixture
+    def conversation(self, media):
+        (media / "messages" / "attachments").mkdir(parents=True)
+        (media / self.path).write_bytes(CONTENT)
+        sender = create_user("sender@gmail.com")
+        receiver = create_user("receiver@gmail.com")
+        session = umessages_models.MessageSession.objects.create()
+        session.participants.add(sender, receiver)
+        message = umessages_models.Message.objects.create(
+            message_session=session, sender=sender, receiver=receiver, text="Secret"
+        )
+        umessages_models.MessageFile.objects.create(msg=message, attachment=self.path)
+        return sender, receiver
+
+    def get(self, user=None):
+        headers = {"HTTP_AUTHORIZATION": "Bearer %s" % issue_token(user)} if user else {}
+        return serve(self.factory.get("/media/" + self.path, **headers), self.path)
+
+    def test_only_the_conversation_can_read_attachments(self, conversation):
+        sender, receiver = conversation
+
+        with pytest.raises(Http404):
+            self.get()
+        with pytest.raises(Http404):
+            self.get(create_user("stranger@gmail.com"))
+
+        response = self.get(receiver)
+        assert response.status_code == 200
+        assert "private" in response["Cache-Control"]
+        assert self.get(sender).status_code == 200
+
+    def test_legacy_attachment_without_a_message_is_hidden(self, conversation):
+        umessages_models.MessageFile.objects.all().delete()
+
+        with pytest.raises(Http404):
+            self.get(conversation[1])
@@ -0,0 +1,182 @@
+import os
+import sys
+import asyncio
+import inspect
+
+from types import SimpleNamespace
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from users import models as users_models
+from umessages import models as umessages_models
+from umessages.inbox import mark_read_up_to, rebuild_inbox, record_message
+from umessages.serializers import MessageSerializer
+from umessages.realtime import InMemoryBroker
+
+
+def create_user(email: str) -> users_models.CustomUser:
+    user = users_models.CustomUser(email=email, first_name="Azatot", last_name="Nirlatotep")
+    user.set_password("Ykt4tVFd8bbk")
+    user.save()
+    return user
+
+
+def create_conversation(size: int):
+    sender = create_user("sender%s@gmail.com" % size)
+    receiver = create_user("receiver%s@gmail.com" % size)
+    session = umessages_models.MessageSession.objects.create()
+    session.participants.add(sender, receiver)
+
+    messages = umessages_models.Message.objects.bulk_create(
+        [
+            umessages_models.Message(
+                message_session=session,
+                sender=sender,
+                receiver=receiver,
+                text="Message #%s" % number,
+            )
+            for number in range(size)
+        ]
+    )
+    for message in messages:
+        record_message(message)
+
+    return session, receiver, messages
+
+
+@pytest.mark.django_db
+class TestMarkAsRead:
+    def test_counters(self):
+        session, receiver, messages = create_conversation(10)
+
+        result = mark_read_up_to(receiver.pk, session.pk, messages[3].pk)
+
+        assert result == {"marked": 4, "session_unread": 6, "total_unread": 6}
+        assert umessages_models.Message.objects.filter(is_read=False).count() == 6
+
+        result = mark_read_up_to(receiver.pk, session.pk)
+        assert result == {"marked": 6, "session_unread": 0, "total_unread": 0}
+
+    def test_sender_can_not_mark_receivers_messages(self):
+        session, receiver, messages = create_conversation(5)
+        sender = messages[0].sender
+
+        result = mark_read_up_to(sender.pk, session.pk)
+
+        assert result["marked"] == 0
+        assert umessages_models.Message.objects.filter(is_read=False).count() == 5
+
+    @pytest.mark.parametrize("batch_size", [10, 100, 1000])
+    def test_round_trips_do_not_depend_on_batch_size(self, batch_size, django_assert_max_num_queries):
+        session, receiver, messages = create_conversation(batch_size)
+
+        # UPDATE messages, UPDATE inbox entry, SELECT counters + SAVEPOINT/RELEASE of the atomic block
+        with django_assert_max_num_queries(5):
+            result = mark_read_up_to(receiver.pk, session.pk, messages[-1].pk)
+
+        assert result["marked"] == batch_size
+        assert result["session_unread"] == 0
+
+
+@pytest.mark.django_db
+class TestInbox:
+    def test_record_message(self):
+        session, receiver, messages = create_conversation(3)
+        sender = messages[0].sender
+
+        receiver_entry = umessages_models.InboxEntry.objects.get(user=receiver, message_session=session)
+        sender_entry = umessages_models.InboxEntry.objects.get(user=sender, message_session=session)
+        assert receiver_entry.last_message_id == messages[-1].pk
+        assert receiver_entry.preview == "Message #2"
+        assert receiver_entry.unread_count == 3
+        assert sender_entry.last_message_id == messages[-1].pk
+        assert sender_entry.unread_count == 0
+
+    def test_out_of_order_write_keeps_the_newest_message(self):
+        session, receiver, messages = create_conversation(3)
+
+        record_message(messages[0])
+
+        entry = umessages_models.InboxEntry.objects.get(user=receiver, message_session=session)
+        assert entry.last_message_id == messages[-1].pk
+
+    def test_rebuild_inbox(self):
+        session, receiver, messages = create_conversation(4)
+        mark_read_up_to(receiver.pk, session.pk, messages[0].pk)
+        umessages_models.InboxEntry.objects.all().delete()
+
+        rebuild_inbox([session.pk])
+
+        entries = umessages_models.InboxEntry.objects.filter(message_session=session)
+        assert entries.count() == 2
+        entry = entries.get(user=receiver)
+        assert entry.last_message_id == messages[-1].pk
+        assert entry.unread_count == 3
+
+
+@pytest.mark.django_db
+class TestMessageSerializer:
+    def test_only_participants_can_write_into_a_session(self):
+        session, receiver, messages = create_conversation(1)
+        sender = messages[0].sender
+        stranger = create_user("stranger@gmail.com")
+        data = {"message_session": str(session.pk), "text": "Hello"}
+
+        serializer = MessageSerializer(
+            data={**data, "receiver": receiver.pk},
+            context={"request": SimpleNamespace(user=stranger)},
+        )
+        assert not serializer.is_valid()
+
+        # A participant can not pull somebody else into the session either
+        serializer = MessageSerializer(
+            data={**data, "receiver": stranger.pk},
+            context={"request": SimpleNamespace(user=sender)},
+        )
+        assert not serializer.is_valid()
+
+        serializer = MessageSerializer(
+            data={**data, "receiver": receiver.pk},
+            context={"request": SimpleNamespace(user=sender)},
+        )
+        assert serializer.is_valid(), serializer.errors
+
+
+class TestInMemoryBroker:
+    def test_events_reach_only_subscribers_of_the_user(self):
+        broker = InMemoryBroker()
+
+        async def scenario():
+            first = broker.subscribe("first")
+            second = broker.subscribe("second")
+            await asyncio.get_running_loop().run_in_executor(
+                None, broker.publish, "first", {"type": "message.created"}
+            )
+            event = await asyncio.wait_for(first.get(), timeout=1)
+            first.close()
+            second.close()
+            return event, second.queue.qsize()
+
+        event, second_size = asyncio.run(scenario())
+
+        assert event == {"type": "message.created"}
+        assert second_size == 0
+
+    def test_slow_client_drops_oldest_events(self):
+        broker = InMemoryBroker()
+        broker.queue_size = 2
+
+        async def scenario():
+            subscription = broker.subscribe("user")
+            for number in range(3):
+                subscription.put({"number": number})
+            return [await subscription.get(), await subscription.get()]
+
+        assert asyncio.run(scenario()) == [{"number": 1}, {"number": 2}]
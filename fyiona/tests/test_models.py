@@ -12,6 +12,8 @@ sys.path.insert(0, parentdir)
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
 django.setup()
 
+from django.contrib.auth import authenticate
+
 from users import models as users_models
 from posts import models as posts_models
 from umessages import models as umessages_models
@@ -84,3 +86,18 @@ class TestCustomUser:
         assert user_in_db.phone_number_confirmed == False
         assert user_in_db.user_profile
         assert user_in_db.user_profile.business_account == False
+
+    def test_users_without_phone_number(self):
+        for email in ("first@gmail.com", "second@gmail.com"):
+            users_models.CustomUser.objects.create(email=email, first_name="Azatot", last_name="Nirlatotep")
+
+        assert users_models.CustomUser.objects.filter(phone_number="").count() == 2
+
+    def test_login_with_phone_number(self, custom_user_object: users_models.CustomUser):
+        custom_user_object.save()
+
+        assert users_models.normalize_phone_number("+996 (550) 27-10-98") == "+996550271098"
+        user = authenticate(None, phone_number="+996 550 271 098", password="Ykt4tVFd8bbk")
+        assert user.pk == custom_user_object.pk
+        assert authenticate(None, phone_number="+996550271098", password="wrong") is None
+        assert authenticate(None, phone_number="not a number", password="Ykt4tVFd8bbk") is None
@@ -0,0 +1,69 @@
+import os
+import sys
+import inspect
+
+import django
+import pytest
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from fyiona.pagination import KeysetPagination
+from users.models import CustomUser
+
+
+class TestKeysetPagination:
+    def test_cursor_round_trip(self):
+        paginator = KeysetPagination(ordering=("-date_joined", "-id"))
+        cursor = paginator.encode_cursor(["2021-10-01", "2f246d5f-2531-41bd-a3a3-b8767001c5dd"])
+
+        assert "=" not in cursor
+        assert paginator.decode_cursor(cursor) == [
+            "2021-10-01",
+            "2f246d5f-2531-41bd-a3a3-b8767001c5dd",
+        ]
+
+    @pytest.mark.parametrize("cursor", ["not a cursor", "WzFd", "eyJhIjoxfQ"])
+    def test_invalid_cursor(self, cursor):
+        paginator = KeysetPagination(ordering=("-date_joined", "-id"))
+        with pytest.raises(NotFound):
+            paginator.decode_cursor(cursor)
+
+    @pytest.mark.parametrize(
+        "values",
+        [
+            ["2021-10-01", "not-a-uuid"],
+            ["yesterday", "2f246d5f-2531-41bd-a3a3-b8767001c5dd"],
+        ],
+    )
+    def test_cursor_with_invalid_values(self, values):
+        paginator = KeysetPagination(ordering=("-date_joined", "-id"))
+        cursor = paginator.encode_cursor(values)
+
+        with pytest.raises(NotFound):
+            paginator.decode_cursor(cursor, CustomUser)
+
+    def test_cursor_values_are_converted(self):
+        paginator = KeysetPagination(ordering=("-date_joined", "-id"))
+        cursor = paginator.encode_cursor(["2021-10-01", "2f246d5f-2531-41bd-a3a3-b8767001c5dd"])
+
+        date_joined, user_id = paginator.decode_cursor(cursor, CustomUser)
+        assert date_joined.isoformat() == "2021-10-01"
+        assert str(user_id) == "2f246d5f-2531-41bd-a3a3-b8767001c5dd"
+
+    def test_seek_filter_descending(self):
+        paginator = KeysetPagination(ordering=("-created_at", "-id"))
+        seek = paginator.get_seek_filter(["2021-10-01", "10"])
+
+        assert seek == Q(created_at__lt="2021-10-01") | Q(created_at="2021-10-01", id__lt="10")
+
+    def test_seek_filter_mixed_directions(self):
+        paginator = KeysetPagination(ordering=("score", "-id"))
+        seek = paginator.get_seek_filter(["5", "10"])
+
+        assert seek == Q(score__gt="5") | Q(score="5", id__lt="10")
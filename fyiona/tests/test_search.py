@@ -0,0 +1,66 @@
+import os
+import sys
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from users import models as users_models
+from users.search import search_users, backfill_phone_digits, get_phone_query, PHONE_FIELD
+
+
+def create_user(email: str, first_name: str, last_name: str, phone_number: str = "") -> users_models.CustomUser:
+    user = users_models.CustomUser(
+        email=email,
+        first_name=first_name,
+        last_name=last_name,
+        phone_number=phone_number,
+    )
+    user.set_password("Ykt4tVFd8bbk")
+    user.save()
+    return user
+
+
+def emails(queryset) -> list:
+    return [user.email for user in queryset]
+
+
+@pytest.mark.django_db
+class TestUsersSearch:
+    @pytest.fixture(autouse=True)
+    def users(self):
+        create_user("johnny@gmail.com", "Johnny", "Walker", "+996550271098")
+        create_user("john@gmail.com", "John", "Smith", "+996700123456")
+        create_user("jon@gmail.com", "Jon", "Snow")
+        create_user("azatot@gmail.com", "Azatot", "Nirlatotep", "+12025550173")
+
+    def test_name_prefix_goes_before_typos(self):
+        result = emails(search_users("John"))
+
+        # Prefix matches first, the closest one ahead
+        assert result[:2] == ["john@gmail.com", "johnny@gmail.com"]
+        assert "azatot@gmail.com" not in result
+
+    def test_email(self):
+        assert emails(search_users("azatot@", fields=["email"])) == ["azatot@gmail.com"]
+
+    def test_phone_number_digits(self):
+        assert emails(search_users("+996 (550) 27")) == ["johnny@gmail.com"]
+        assert emails(search_users("5550173", fields=[PHONE_FIELD])) == ["azatot@gmail.com"]
+
+    def test_mixed_query_is_not_a_phone_number(self):
+        assert get_phone_query("john2") == ""
+        assert get_phone_query("+996 (550)") == "996550"
+        assert "azatot@gmail.com" not in emails(search_users("a2"))
+
+    def test_backfill_phone_digits(self):
+        users_models.CustomUser.objects.update(phone_number_digits="")
+
+        assert backfill_phone_digits(batch_size=1) == 3
+        assert emails(search_users("700123")) == ["john@gmail.com"]
@@ -0,0 +1,167 @@
+import os
+import sys
+import uuid
+import inspect
+from datetime import timedelta
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from users import models as users_models
+from stories import models as stories_models
+from users.follows import recount_follows
+from stories.feed import fan_out_story, get_feed
+from stories.archive import archive_expired_stories
+from stories.viewers import StoryViewBuffer, move_legacy_views
+from django.utils import timezone
+
+
+FOLLOWERS = 10000
+
+
+def create_user(email: str) -> users_models.CustomUser:
+    user = users_models.CustomUser(email=email, first_name="Azatot", last_name="Nirlatotep")
+    user.set_password("Ykt4tVFd8bbk")
+    user.save()
+    return user
+
+
+def create_followers(author: users_models.CustomUser, number: int) -> list:
+    """Bulk creates followers, signals are skipped, so profiles are created by hand."""
+    users = users_models.CustomUser.objects.bulk_create(
+        [
+            users_models.CustomUser(
+                id=uuid.uuid4(),
+                email="follower%s@gmail.com" % index,
+                first_name="Follower",
+                last_name=str(index),
+                password="!",
+            )
+            for index in range(number)
+        ],
+        batch_size=2000,
+    )
+    profiles = users_models.UserProfile.objects.bulk_create(
+        [users_models.UserProfile(user=user) for user in users],
+        batch_size=2000,
+    )
+    users_models.Follow.objects.bulk_create(
+        [users_models.Follow(profile=author.user_profile, follower=profile) for profile in profiles],
+        batch_size=2000,
+    )
+    recount_follows()
+    return users
+
+
+@pytest.fixture
+def author_with_followers():
+    author = create_user("author@gmail.com")
+    followers = create_followers(author, FOLLOWERS)
+    return author, followers
+
+
+@pytest.mark.django_db
+class TestStoryFeed:
+    def test_fan_out_on_write(self, settings, author_with_followers, django_assert_max_num_queries):
+        settings.STORIES_FANOUT_THRESHOLD = FOLLOWERS + 1
+        author, followers = author_with_followers
+        story = stories_models.Story.objects.create(author=author)
+        story.hidden_story_from.add(followers[0])
+
+        # count + hidden + follower ids cursor + one INSERT per 1000 followers
+        with django_assert_max_num_queries(3 + FOLLOWERS // 1000 + 5):
+            written = fan_out_story(story)
+
+        assert written == FOLLOWERS - 1
+        feed, _ = get_feed(followers[1])
+        assert [item.id for item in feed] == [story.id]
+        hidden_feed, _ = get_feed(followers[0])
+        assert hidden_feed == []
+
+    def test_fan_out_on_read(self, settings, author_with_followers, django_assert_max_num_queries):
+        settings.STORIES_FANOUT_THRESHOLD = FOLLOWERS
+        author, followers = author_with_followers
+        stories = [stories_models.Story.objects.create(author=author) for _ in range(3)]
+
+        assert fan_out_story(stories[-1]) == 0
+        assert not stories_models.TimelineEntry.objects.exists()
+
+        with django_assert_max_num_queries(5):
+            feed, next_before = get_feed(followers[1], limit=2)
+
+        assert [item.id for item in feed] == [stories[2].id, stories[1].id]
+        feed, next_before = get_feed(followers[1], before=next_before, limit=2)
+        assert [item.id for item in feed] == [stories[0].id]
+        assert next_before is None
+
+
+@pytest.mark.django_db
+class TestStoryArchive:
+    def test_expired_stories_leave_live_table(self):
+        author = create_user("archive@gmail.com")
+        expired = timezone.now() - timedelta(minutes=1)
+        kept = stories_models.Story.objects.create(author=author, expires_at=expired)
+        stories_models.StoryFile.objects.bulk_create(
+            [stories_models.StoryFile(story=kept, attachment="accounts/stories/test_image.png")]
+        )
+        stories_models.Story.objects.create(author=author, expires_at=expired, save_story_to_archive=False)
+        live = stories_models.Story.objects.create(author=author)
+
+        assert archive_expired_stories(chunk_size=1) == (1, 2)
+
+        assert list(stories_models.Story.objects.all()) == [live]
+        archive = stories_models.StoryArchive.objects.get()
+        assert archive.original_id == kept.id
+        assert archive.attachments.get().attachment.name == "accounts/stories/test_image.png"
+        assert archive_expired_stories() == (0, 0)
+
+
+@pytest.mark.django_db
+class TestStoryViewers:
+    def test_buffered_views_are_idempotent(self, django_assert_max_num_queries):
+        author = create_user("viewed@gmail.com")
+        viewers = create_followers(author, 50)
+        story = stories_models.Story.objects.create(author=author)
+        buffer = StoryViewBuffer(max_size=1000, max_age=60)
+
+        for _ in range(2):
+            for viewer in viewers:
+                buffer.add(story.id, viewer.id)
+
+        # SELECT ... FOR UPDATE stories, SELECT known viewers, INSERT views, UPDATE per story + SAVEPOINT/RELEASE
+        with django_assert_max_num_queries(6):
+            assert buffer.flush() == 50
+
+        buffer.add(story.id, viewers[0].id)
+        buffer.flush()
+
+        story.refresh_from_db()
+        assert story.viewers_count == 50
+        assert stories_models.StoryView.objects.filter(story=story).count() == 50
+
+    def test_legacy_viewers_are_moved(self):
+        author = create_user("legacy@gmail.com")
+        viewers = create_followers(author, 3)
+        story = stories_models.Story.objects.create(author=author)
+        story.viewers.add(*viewers[:2])
+        stories_models.StoryView.objects.create(story=story, viewer=viewers[0])
+
+        assert move_legacy_views(batch_size=1) == 2
+        assert move_legacy_views() == 0
+        assert not story.viewers.exists()
+        story.refresh_from_db()
+        assert story.viewers_count == 2
+
+        # Counting goes on from the moved rows
+        buffer = StoryViewBuffer(max_size=1000, max_age=60)
+        buffer.add(story.id, viewers[1].id)
+        buffer.add(story.id, viewers[2].id)
+        buffer.flush()
+        story.refresh_from_db()
+        assert story.viewers_count == 3
@@ -0,0 +1,89 @@
+import os
+import sys
+import inspect
+
+import django
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from rest_framework.test import APIRequestFactory
+
+from users import throttling
+from users.throttling import LocalCounterBackend, LoginAccountThrottle, LoginIPThrottle, parse_rate
+from users.views import LoginAPIView
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 6000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_throttle(throttle_class, timer):
+    throttle = throttle_class()
+    throttle.backend = LocalCounterBackend(max_keys=100)
+    throttle.timer = timer
+    return throttle
+
+
+class TestSlidingWindow:
+    def test_parse_rate(self):
+        assert parse_rate("5/min") == (5, 60)
+        assert parse_rate("3/hour") == (3, 3600)
+
+    def test_previous_window_is_weighted(self, settings):
+        settings.THROTTLING = {"RATES": {"login_account": "4/min"}}
+        timer = FakeTimer()
+        throttle = make_throttle(LoginAccountThrottle, timer)
+        request = APIRequestFactory().post("/", {"email": "Azatot@gmail.com"}, format="json")
+        request = LoginAPIView().initialize_request(request)
+
+        for _ in range(4):
+            assert throttle.allow_request(request, None)
+        assert not throttle.allow_request(request, None)
+        assert 0 < throttle.wait() <= 60
+
+        # Half of the previous window still counts: 4 * 0.5 = 2 of 4
+        timer.now += 90
+        assert throttle.allow_request(request, None)
+        assert throttle.allow_request(request, None)
+        assert not throttle.allow_request(request, None)
+
+        timer.now += 120
+        assert throttle.allow_request(request, None)
+
+    def test_ips_are_counted_separately(self, settings):
+        settings.THROTTLING = {"RATES": {"login": "1/min"}}
+        throttle = make_throttle(LoginIPThrottle, FakeTimer())
+        factory = APIRequestFactory()
+        first = factory.post("/", REMOTE_ADDR="10.0.0.1")
+        second = factory.post("/", REMOTE_ADDR="10.0.0.2")
+
+        assert throttle.allow_request(first, None)
+        assert not throttle.allow_request(first, None)
+        assert throttle.allow_request(second, None)
+
+    def test_login_is_rejected_before_authentication(self, settings, monkeypatch):
+        settings.THROTTLING = {"RATES": {"login": "100/min", "login_account": "1/hour"}}
+        monkeypatch.setattr(throttling, "_backend", LocalCounterBackend(max_keys=100))
+        view = LoginAPIView.as_view()
+        factory = APIRequestFactory()
+        data = {"email": "nobody@gmail.com", "password": "Ykt4tVFd8bbk"}
+
+        monkeypatch.setattr("users.serializers.authenticate", lambda *args, **credentials: None)
+        assert view(factory.post("/", data, format="json")).status_code == 400
+
+        def authenticate(*args, **credentials):
+            raise AssertionError("The password must not be checked")
+
+        monkeypatch.setattr("users.serializers.authenticate", authenticate)
+        response = view(factory.post("/", data, format="json"))
+        assert response.status_code == 429
+        assert response.data["success"] is False
+        assert "Retry-After" in response
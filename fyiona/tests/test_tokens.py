@@ -0,0 +1,163 @@
+import os
+import sys
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+import jwt
+from django.db import IntegrityError
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users import models as users_models
+from users.one_time_tokens import create_token, get_token, use_token, purge_expired_tokens
+from users.tokens import (
+    get_user,
+    issue_token,
+    issue_refresh_token,
+    rotate_refresh_token,
+    revoke_tokens,
+    TokenError,
+)
+from users.views import CustomUserChangeEmailConfirmationAPIView
+
+
+def create_user(email: str) -> users_models.CustomUser:
+    user = users_models.CustomUser(email=email, first_name="Azatot", last_name="Nirlatotep")
+    user.set_password("Ykt4tVFd8bbk")
+    user.save()
+    return user
+
+
+@pytest.mark.django_db
+class TestTokens:
+    def test_key_rotation(self, settings):
+        user = create_user("rotation@gmail.com")
+        settings.JWT_SIGNING_KEYS = {"old": "old-secret", "new": "new-secret"}
+        settings.JWT_ACTIVE_KID = "old"
+        old_token = issue_token(user)
+
+        settings.JWT_ACTIVE_KID = "new"
+        new_token = issue_token(user)
+        assert jwt.get_unverified_header(new_token)["kid"] == "new"
+        assert get_user(old_token).pk == user.pk
+        assert get_user(new_token).pk == user.pk
+
+        # The old key is retired
+        settings.JWT_SIGNING_KEYS = {"new": "new-secret"}
+        with pytest.raises(TokenError):
+            get_user(old_token)
+
+    def test_refresh_token_rotation(self):
+        user = create_user("rotation@gmail.com")
+        first = issue_refresh_token(user, "Android")
+        other_device = issue_refresh_token(user, "iPhone")
+
+        refreshed_user, second = rotate_refresh_token(first)
+        assert refreshed_user.pk == user.pk
+        assert users_models.RefreshToken.objects.get(used_at__isnull=True, device="Android").family == (
+            users_models.RefreshToken.objects.get(used_at__isnull=False).family
+        )
+        assert not users_models.RefreshToken.objects.filter(token_hash=second).exists()
+
+        # Replaying a used token revokes its family only
+        with pytest.raises(TokenError):
+            rotate_refresh_token(first)
+        with pytest.raises(TokenError):
+            rotate_refresh_token(second)
+        assert rotate_refresh_token(other_device)[0].pk == user.pk
+
+    def test_revoke_tokens(self, django_assert_num_queries):
+        user = create_user("revoke@gmail.com")
+        token = issue_token(user)
+        get_user(token)
+        # The watermark is checked on the cached user
+        with django_assert_num_queries(0):
+            get_user(token)
+
+        refresh_token = issue_refresh_token(user)
+        revoke_tokens(user)
+        with pytest.raises(TokenError):
+            get_user(token)
+        with pytest.raises(TokenError):
+            rotate_refresh_token(refresh_token)
+        assert get_user(issue_token(user)).pk == user.pk
+
+
+@pytest.mark.django_db
+class TestOneTimeTokens:
+    def test_single_use(self):
+        user = create_user("onetime@gmail.com")
+        first = create_token(user, users_models.OneTimeToken.PURPOSE_PASSWORD_RESET)
+        second = create_token(user, users_models.OneTimeToken.PURPOSE_PASSWORD_RESET)
+        assert first != second
+
+        # The new token replaces the previous one, and a token only works for its purpose
+        assert get_token(first, users_models.OneTimeToken.PURPOSE_PASSWORD_RESET) is None
+        assert get_token(second, users_models.OneTimeToken.PURPOSE_ACCOUNT_DELETION) is None
+        assert use_token(second, users_models.OneTimeToken.PURPOSE_PASSWORD_RESET).user == user
+        assert use_token(second, users_models.OneTimeToken.PURPOSE_PASSWORD_RESET) is None
+
+    def test_expired_tokens(self):
+        user = create_user("expired@gmail.com")
+        token = create_token(user, users_models.OneTimeToken.PURPOSE_EMAIL_CONFIRMATION)
+        create_token(user, users_models.OneTimeToken.PURPOSE_ACCOUNT_DELETION)
+        users_models.OneTimeToken.objects.filter(
+            purpose=users_models.OneTimeToken.PURPOSE_EMAIL_CONFIRMATION
+        ).update(expires_at=timezone.now())
+
+        assert get_token(token, users_models.OneTimeToken.PURPOSE_EMAIL_CONFIRMATION) is None
+        assert purge_expired_tokens() == 1
+        assert users_models.OneTimeToken.objects.count() == 1
+
+    def test_email_change_to_a_registered_address(self):
+        user = create_user("old@gmail.com")
+        token = create_token(user, users_models.OneTimeToken.PURPOSE_EMAIL_CHANGE, payload="new@gmail.com")
+        other = create_user("new@gmail.com")
+        view = CustomUserChangeEmailConfirmationAPIView.as_view()
+
+        def confirm():
+            request = APIRequestFactory().get("/")
+            force_authenticate(request, user=user)
+            return view(request, token=token)
+
+        response = confirm()
+        assert response.status_code == 409
+        assert response.data["success"] is False
+
+        # The token was not used up, it works once the address is free again
+        other.email = "other@gmail.com"
+        other.save()
+        assert confirm().status_code == 200
+        user.refresh_from_db()
+        assert user.email == "new@gmail.com"
+
+    def test_failed_email_change_keeps_the_token(self, monkeypatch):
+        user = create_user("old@gmail.com")
+        token = create_token(user, users_models.OneTimeToken.PURPOSE_EMAIL_CHANGE, payload="new@gmail.com")
+        view = CustomUserChangeEmailConfirmationAPIView.as_view()
+
+        def confirm():
+            request = APIRequestFactory().get("/")
+            force_authenticate(request, user=user)
+            return view(request, token=token)
+
+        # A concurrent registration takes the address between the check and the save
+        def save(self, *args, **kwargs):
+            raise IntegrityError("duplicate key value violates unique constraint")
+
+        with monkeypatch.context() as patch:
+            patch.setattr(users_models.CustomUser, "save", save)
+            assert confirm().status_code == 409
+        assert get_token(token, users_models.OneTimeToken.PURPOSE_EMAIL_CHANGE) is not None
+
+        assert confirm().status_code == 200
+        user.refresh_from_db()
+        assert user.email == "new@gmail.com"
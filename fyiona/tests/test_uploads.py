@@ -0,0 +1,169 @@
+import io
+import os
+import fcntl
+import sys
+import hashlib
+import inspect
+
+import django
+import pytest
+
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0, parentdir)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fyiona.settings")
+django.setup()
+
+from users import models as users_models
+from stories import models as stories_models
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from uploads.models import Blob, UploadSession
+from uploads.blobs import collect_garbage, recount_references
+from uploads.chunks import OffsetMismatch, start_upload, append_chunk, finalize_upload
+from fyiona.sniffing import sniff_content_type
+from django.core.exceptions import RequestDataTooBig
+from fyiona.uploadhandlers import RestrictedFileUploadHandler, UnsupportedUpload
+
+
+CHUNK_SIZE = 1024
+
+
+def create_user(email: str) -> users_models.CustomUser:
+    user = users_models.CustomUser(email=email, first_name="Azatot", last_name="Nirlatotep")
+    user.set_password("Ykt4tVFd8bbk")
+    user.save()
+    return user
+
+
+@pytest.mark.django_db
+class TestChunkedUpload:
+    def test_resumable_upload(self, settings, tmp_path):
+        settings.CHUNKED_UPLOAD_DIR = str(tmp_path / "partial")
+        settings.MEDIA_ROOT = str(tmp_path / "media")
+        owner = create_user("uploader@gmail.com")
+        story = stories_models.Story.objects.create(author=owner)
+        with open(os.path.join(currentdir, "test_files", "test_video.mp4"), "rb") as video:
+            content = video.read(CHUNK_SIZE * 3 + 100)
+
+        session = start_upload(
+            owner=owner,
+            target=UploadSession.TARGET_STORY,
+            filename="video.mp4",
+            content_type="video/mp4",
+            size=len(content),
+            checksum=hashlib.sha256(content).hexdigest(),
+        )
+
+        append_chunk(session.id, owner, 0, io.BytesIO(content[:CHUNK_SIZE]), CHUNK_SIZE)
+        # The client lost the response and resends the chunk from a wrong offset
+        with pytest.raises(OffsetMismatch):
+            append_chunk(session.id, owner, CHUNK_SIZE * 2, io.BytesIO(b""), CHUNK_SIZE)
+
+        offset = UploadSession.objects.get(id=session.id).received
+        while offset < len(content):
+            piece = content[offset : offset + CHUNK_SIZE]
+            offset = append_chunk(session.id, owner, offset, io.BytesIO(piece), len(piece)).received
+
+        attachment = finalize_upload(session.id, owner, story.id)
+
+        assert isinstance(attachment, stories_models.StoryFile)
+        with attachment.attachment.open("rb") as stored:
+            assert stored.read() == content
+        assert not os.path.exists(session.partial_path)
+        assert UploadSession.objects.get(id=session.id).status == UploadSession.STATUS_COMPLETE
+
+
+    def test_chunk_being_written_is_not_waited_for(self, settings, tmp_path):
+        settings.CHUNKED_UPLOAD_DIR = str(tmp_path / "partial")
+        owner = create_user("uploader@gmail.com")
+        with open(os.path.join(currentdir, "test_files", "test_video.mp4"), "rb") as video:
+            content = video.read(CHUNK_SIZE * 2)
+        session = start_upload(
+            owner=owner,
+            target=UploadSession.TARGET_STORY,
+            filename="video.mp4",
+            content_type="video/mp4",
+            size=len(content),
+            checksum=hashlib.sha256(content).hexdigest(),
+        )
+
+        # A stalled request holds the partial file, the retry gets 409 right away
+        with open(session.partial_path, "r+b") as partial:
+            fcntl.flock(partial, fcntl.LOCK_EX)
+            with pytest.raises(OffsetMismatch):
+                append_chunk(session.id, owner, 0, io.BytesIO(content[:CHUNK_SIZE]), CHUNK_SIZE)
+
+        assert append_chunk(session.id, owner, 0, io.BytesIO(content[:CHUNK_SIZE]), CHUNK_SIZE).received == CHUNK_SIZE
+
+
+@pytest.mark.parametrize(
+    "head, content_type",
+    [
+        (b"\xff\xd8\xff\xe0\x00\x10JFIF", "image/jpeg"),
+        (b"\x89PNG\r\n\x1a\n\x00\x00", "image/png"),
+        (b"\x00\x00\x00\x18ftypmp42\x00\x00", "video/mp4"),
+        (b"\x00\x00\x00\x18ftypM4A \x00\x00", None),
+        (b"OggS\x00\x02", "video/ogg"),
+        (b"MZ\x90\x00", None),
+    ],
+)
+def test_sniff_content_type(head, content_type):
+    assert sniff_content_type(head) == content_type
+
+
+class TestRestrictedFileUploadHandler:
+    def receive(self, handler, content: bytes, piece: int = 1024):
+        handler.new_file("attachments", "file", "image/png", len(content))
+        for start in range(0, len(content), piece):
+            handler.receive_data_chunk(content[start : start + piece], start)
+        handler.file_complete(len(content))
+
+    def test_real_type_is_checked(self):
+        handler = RestrictedFileUploadHandler(max_size=10000, content_types=["image/jpeg", "image/png"])
+        with open(os.path.join(currentdir, "test_files", "test_image.png"), "rb") as image:
+            self.receive(handler, image.read(8192))
+        with pytest.raises(UnsupportedUpload):
+            self.receive(handler, b"MZ" + b"\x00" * 5000)
+
+    def test_oversized_upload_is_aborted_early(self):
+        handler = RestrictedFileUploadHandler(max_size=2048, content_types=None)
+        received = []
+        with pytest.raises(RequestDataTooBig):
+            handler.new_file("attachments", "file", "image/png", None)
+            for start in range(0, 100 * 1024, 1024):
+                received.append(handler.receive_data_chunk(b"\x00" * 1024, start))
+        assert len(received) == 2
+
+
+@pytest.mark.django_db
+class TestContentAddressedStorage:
+    def test_duplicates_share_one_blob(self, settings, tmp_path):
+        settings.MEDIA_ROOT = str(tmp_path)
+        with open(os.path.join(currentdir, "test_files", "test_image.png"), "rb") as image:
+            content = image.read()
+
+        profiles = []
+        for email in ("first@gmail.com", "second@gmail.com"):
+            profile = create_user(email).user_profile
+            profile.avatar.save("avatar.png", ContentFile(content))
+            profiles.append(profile)
+
+        assert profiles[0].avatar.name == profiles[1].avatar.name
+        assert profiles[0].avatar.name.startswith("blobs/")
+        blob = Blob.objects.get()
+        assert (blob.digest, blob.refcount) == (hashlib.sha256(content).hexdigest(), 2)
+
+        for profile in profiles:
+            profile.avatar = "default_profile_image.png"
+            profile.save()
+        blob.refresh_from_db()
+        assert blob.refcount == 0
+        assert recount_references() == 0
+
+        # Still in the grace period
+        assert collect_garbage(blob.last_seen_at) == (0, 0)
+        assert collect_garbage(timezone.now()) == (1, len(content))
+        assert not Blob.objects.exists()
+        assert not os.path.exists(os.path.join(settings.MEDIA_ROOT, blob.name))
@@ -1,8 +1,9 @@
 from django.contrib import admin
 from .models import *
 
-from .models import MessageSession, Message, MessageFile
+from .models import MessageSession, Message, MessageFile, InboxEntry
 
 admin.site.register(MessageSession)
 admin.site.register(Message)
 admin.site.register(MessageFile)
+admin.site.register(InboxEntry)
@@ -0,0 +1,83 @@
+"""
+Plain ASGI WebSocket endpoint, no extra dependencies.
+    ws(s)://<host>/ws/messages/?token=<JWT>
+After the handshake the server pushes JSON events of the user:
+    {"type": "message.created", "message": {...}}
+    {"type": "message.read", "session": "...", "reader": "...", "up_to": 123}
+Clients may send {"type": "ping"} and get {"type": "pong"} back.
+"""
+
+import json
+import asyncio
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from rest_framework import exceptions
+
+from users.middlewares import JWTAuthentication
+from .realtime import get_broker
+
+
+WEBSOCKET_PATH = "/ws/messages/"
+
+CLOSE_NOT_FOUND = 4404
+CLOSE_UNAUTHORIZED = 4401
+
+
+@sync_to_async
+def authenticate(token: str):
+    try:
+        user, _ = JWTAuthentication()._authenticate_credentials(None, token)
+    except exceptions.AuthenticationFailed:
+        return None
+    return user
+
+
+def get_token(scope) -> str:
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    tokens = query.get("token")
+    return tokens[0] if tokens else ""
+
+
+async def websocket_application(scope, receive, send):
+    event = await receive()
+    if event["type"] != "websocket.connect":
+        return
+
+    if scope["path"] != WEBSOCKET_PATH:
+        await send({"type": "websocket.close", "code": CLOSE_NOT_FOUND})
+        return
+
+    token = get_token(scope)
+    user = await authenticate(token) if token else None
+    if user is None:
+        await send({"type": "websocket.close", "code": CLOSE_UNAUTHORIZED})
+        return
+
+    await send({"type": "websocket.accept"})
+
+    subscription = get_broker().subscribe(user.pk)
+    sender = asyncio.ensure_future(push_events(subscription, send))
+    try:
+        while True:
+            event = await receive()
+            if event["type"] == "websocket.disconnect":
+                break
+            if event["type"] == "websocket.receive" and is_ping(event):
+                subscription.put({"type": "pong"})
+    finally:
+        subscription.close()
+        sender.cancel()
+
+
+async def push_events(subscription, send):
+    while True:
+        event = await subscription.get()
+        await send({"type": "websocket.send", "text": json.dumps(event, default=str)})
+
+
+def is_ping(event) -> bool:
+    try:
+        return json.loads(event.get("text") or "{}").get("type") == "ping"
+    except (ValueError, AttributeError):
+        return False
@@ -0,0 +1,140 @@
+"""
+Maintenance of InboxEntry rows.
+Every function here has to be called inside the transaction that changes the messages,
+so the inbox can never disagree with the messages it summarizes.
+"""
+
+from django.db import transaction
+from django.db.models import F, Q, Count, Sum, Value
+from django.db.models.functions import Greatest
+
+from .models import InboxEntry, Message
+
+
+PREVIEW_LENGTH = InboxEntry._meta.get_field("preview").max_length
+
+
+def get_preview(message: Message) -> str:
+    return (message.text or "")[:PREVIEW_LENGTH]
+
+
+def record_message(message: Message):
+    """Moves the session to the top of the sender's and receiver's inbox and increments receiver's unread counter."""
+    users = {message.sender_id, message.receiver_id}
+
+    with transaction.atomic():
+        InboxEntry.objects.bulk_create(
+            [
+                InboxEntry(
+                    user_id=user_id,
+                    message_session_id=message.message_session_id,
+                    last_message_at=message.created_at,
+                )
+                for user_id in users
+            ],
+            ignore_conflicts=True,
+        )
+        # Out of order writes must not replace a newer last message
+        InboxEntry.objects.filter(
+            Q(last_message__isnull=True) | Q(last_message_at__lte=message.created_at),
+            message_session_id=message.message_session_id,
+            user_id__in=users,
+        ).update(
+            last_message=message,
+            last_message_at=message.created_at,
+            preview=get_preview(message),
+        )
+        if message.sender_id != message.receiver_id and not message.is_read:
+            InboxEntry.objects.filter(
+                message_session_id=message.message_session_id,
+                user_id=message.receiver_id,
+            ).update(unread_count=F("unread_count") + 1)
+
+
+def apply_read(user_id, session_id, count: int):
+    """Decrements the unread counter after "count" messages of the session have been marked as read."""
+    if count:
+        InboxEntry.objects.filter(user_id=user_id, message_session_id=session_id).update(
+            unread_count=Greatest(F("unread_count") - count, Value(0))
+        )
+
+
+def mark_message_read(message: Message) -> bool:
+    """Flips is_read of a single message, returns False if it was already read."""
+    with transaction.atomic():
+        updated = Message.objects.filter(pk=message.pk, is_read=False).update(is_read=True)
+        apply_read(message.receiver_id, message.message_session_id, updated)
+
+    message.is_read = True
+    return bool(updated)
+
+
+def mark_read_up_to(user_id, session_id, message_id=None) -> dict:
+    """
+    Marks every unread message of the session received by the user up to message_id (inclusive) as read.
+    The number of queries does not depend on how many messages are marked:
+        UPDATE message ... WHERE message_session=... AND receiver=... AND id <= ... AND NOT is_read
+        UPDATE inbox entry of the session
+        SELECT the new counters
+    """
+    messages = Message.objects.filter(message_session_id=session_id, receiver_id=user_id, is_read=False)
+    if message_id is not None:
+        messages = messages.filter(id__lte=message_id)
+
+    with transaction.atomic():
+        marked = messages.update(is_read=True)
+        apply_read(user_id, session_id, marked)
+        counters = InboxEntry.objects.filter(user_id=user_id).aggregate(
+            session_unread=Sum("unread_count", filter=Q(message_session_id=session_id)),
+            total_unread=Sum("unread_count"),
+        )
+
+    return {
+        "marked": marked,
+        "session_unread": counters["session_unread"] or 0,
+        "total_unread": counters["total_unread"] or 0,
+    }
+
+
+def refresh_session(session_id):
+    """
+    Recomputes the inbox rows of one session from its messages.
+    Used when messages disappear, e.g. a deleted last message.
+    """
+    with transaction.atomic():
+        entries = InboxEntry.objects.select_for_update().filter(message_session_id=session_id)
+        last_message = (
+            Message.objects.filter(message_session_id=session_id).order_by("-created_at", "-id").first()
+        )
+        unread = dict(
+            Message.objects.filter(message_session_id=session_id, is_read=False)
+            .order_by()
+            .values_list("receiver_id")
+            .annotate(count=Count("id"))
+        )
+
+        for entry in entries:
+            entry.last_message = last_message
+            if last_message is not None:
+                entry.last_message_at = last_message.created_at
+            entry.preview = get_preview(last_message) if last_message else ""
+            entry.unread_count = unread.get(entry.user_id, 0)
+            entry.save(update_fields=["last_message", "last_message_at", "preview", "unread_count"])
+
+
+def rebuild_inbox(session_ids):
+    """Creates or refreshes inbox rows for the given sessions, used to backfill existing data."""
+    for session_id in session_ids:
+        with transaction.atomic():
+            pairs = (
+                Message.objects.filter(message_session_id=session_id)
+                .values_list("sender_id", "receiver_id")
+                .distinct()
+            )
+            users = {user_id for pair in pairs for user_id in pair}
+
+            InboxEntry.objects.bulk_create(
+                [InboxEntry(user_id=user_id, message_session_id=session_id) for user_id in users],
+                ignore_conflicts=True,
+            )
+            refresh_session(session_id)
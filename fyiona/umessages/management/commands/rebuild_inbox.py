@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from umessages.inbox import rebuild_inbox
+from umessages.models import MessageSession
+
+
+class Command(BaseCommand):
+    """Backfills umessages.models.InboxEntry from existing messages, safe to run more than once."""
+
+    help = "Creates or refreshes inbox summaries of all message sessions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500, help="Sessions per chunk")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        session_ids = MessageSession.objects.order_by("session").values_list("session", flat=True)
+
+        done = 0
+        chunk = []
+        for session_id in session_ids.iterator(chunk_size=chunk_size):
+            chunk.append(session_id)
+            if len(chunk) >= chunk_size:
+                rebuild_inbox(chunk)
+                done += len(chunk)
+                chunk = []
+                self.stdout.write("Sessions processed: %s" % done)
+
+        rebuild_inbox(chunk)
+        done += len(chunk)
+        self.stdout.write(self.style.SUCCESS("Inbox rebuilt for %s sessions" % done))
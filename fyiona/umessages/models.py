@@ -6,6 +6,7 @@ from users.models import CustomUser
 from django.utils.translation import gettext_lazy as _
 
 from fyiona.fields import ContentTypeRestrictedFileField
+from fyiona.storage import content_addressed_storage
 
 
 class TrackableDateModel(models.Model):
@@ -98,6 +99,21 @@ class Message(TrackableDateModel):
         verbose_name=_("Has been read"),
     )
 
+    class Meta:
+        indexes = [
+            # History of a session is read newest first with keyset pagination on (created_at, id)
+            models.Index(
+                fields=["message_session", "-created_at", "-id"],
+                name="umessages_session_history_idx",
+            ),
+            # Unread counters only ever look at unread messages
+            models.Index(
+                fields=["receiver", "message_session"],
+                condition=models.Q(is_read=False),
+                name="umessages_unread_idx",
+            ),
+        ]
+
     def __str__(self) -> str:
         return "From %s to %s at %s" % (self.sender, self.receiver, self.created_at)
 
@@ -115,6 +131,9 @@ class MessageFile(TrackableDateModel):
     )
     attachment = ContentTypeRestrictedFileField(
         upload_to="messages/attachments/",
+        storage=content_addressed_storage,
+        # Looked up by name on every media request, see fyiona.media.can_read
+        db_index=True,
         verbose_name=_("Message File"),
         content_types=[
             "image/jpeg",
@@ -126,3 +145,62 @@ class MessageFile(TrackableDateModel):
 
     def __str__(self) -> str:
         return "Message ID: %s  Path: %s" % (self.msg.id, self.attachment)
+
+
+class InboxEntry(models.Model):
+    """
+    Denormalized inbox row: one per (user, session).
+    Maintained by umessages.inbox in the same transaction that creates or reads messages,
+    so rendering an inbox is a single range scan over the user's rows.
+    """
+
+    user = models.ForeignKey(
+        to=CustomUser,
+        on_delete=models.CASCADE,
+        related_name="inbox_entries",
+        verbose_name=_("Owner of the inbox"),
+    )
+    message_session = models.ForeignKey(
+        to=MessageSession,
+        on_delete=models.CASCADE,
+        related_name="inbox_entries",
+        verbose_name=_("Message Session"),
+    )
+    last_message = models.ForeignKey(
+        to=Message,
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="+",
+        verbose_name=_("Last Message"),
+    )
+    last_message_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Date of the last message"),
+    )
+    preview = models.CharField(
+        max_length=100,
+        blank=True,
+        verbose_name=_("Last message preview"),
+    )
+    unread_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Unread messages"),
+    )
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "message_session"],
+                name="umessages_inbox_entry_unique",
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-last_message_at", "-id"],
+                name="umessages_inbox_idx",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return "Inbox of %s: %s" % (self.user, self.message_session)
@@ -0,0 +1,143 @@
+"""
+Real-time delivery of messaging events to WebSocket clients (see umessages.consumers).
+
+A broker fans out events published by request handlers to the sockets of a user.
+    * InMemoryBroker - single node, events never leave the process
+    * For several nodes subclass LocalBroker: send events to a shared broker (Redis, NATS, ...) in publish()
+      and call deliver() on every node when an event comes back from it.
+The broker class is configured with settings.MESSAGES_REALTIME_BROKER.
+"""
+
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """Queue of events of one WebSocket connection."""
+
+    def __init__(self, broker, user_id, max_size: int):
+        self.broker = broker
+        self.user_id = str(user_id)
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_size)
+
+    def put(self, event: dict):
+        """Runs in the event loop thread. A slow client loses its oldest events instead of growing the queue."""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker(ABC):
+    """
+    Keeps the subscriptions of the current process and delivers events to them from any thread.
+    Subclasses define how a published event reaches deliver() on every node.
+    """
+
+    queue_size = 100
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id) -> Subscription:
+        """Must be called from a coroutine, the subscription is bound to the running event loop."""
+        subscription = Subscription(self, user_id, max_size=self.queue_size)
+        with self._lock:
+            self._subscriptions[subscription.user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def deliver(self, user_id, event: dict):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(str(user_id), ()))
+
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # The event loop of a disconnected client has already been closed
+                subscription.close()
+
+    @abstractmethod
+    def publish(self, user_id, event: dict):
+        pass
+
+
+class InMemoryBroker(LocalBroker):
+    """Single node broker: publishing is delivering."""
+
+    def publish(self, user_id, event: dict):
+        self.deliver(user_id, event)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> LocalBroker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = getattr(
+                    settings, "MESSAGES_REALTIME_BROKER", "umessages.realtime.InMemoryBroker"
+                )
+                _broker = import_string(broker_class)()
+    return _broker
+
+
+def publish(user_ids, event: dict):
+    """Sends the event to every user once the current transaction is committed."""
+
+    def send():
+        broker = get_broker()
+        for user_id in set(user_ids):
+            try:
+                broker.publish(user_id, event)
+            except Exception:
+                logger.exception("Could not publish %s to %s", event.get("type"), user_id)
+
+    transaction.on_commit(send)
+
+
+def publish_message_created(message, data: dict):
+    publish(
+        (message.sender_id, message.receiver_id),
+        {"type": "message.created", "message": data},
+    )
+
+
+def publish_messages_read(session_id, reader_id, up_to, participant_ids):
+    publish(
+        participant_ids,
+        {
+            "type": "message.read",
+            "session": str(session_id),
+            "reader": str(reader_id),
+            "up_to": up_to,
+        },
+    )
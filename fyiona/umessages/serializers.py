@@ -1,7 +1,9 @@
 from uuid import UUID, uuid4
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
+from django.db import transaction
 from rest_framework.fields import CharField, UUIDField
+from rest_framework.relations import PrimaryKeyRelatedField
 
 from rest_framework.serializers import (
     ModelSerializer,
@@ -9,7 +11,9 @@ from rest_framework.serializers import (
 
 from users.models import CustomUser
 
-from .models import Message, MessageFile, MessageSession
+from .inbox import record_message
+from .realtime import publish_message_created
+from .models import InboxEntry, Message, MessageFile, MessageSession
 
 #########################################################
 ###################### Message ##########################
@@ -36,10 +40,9 @@ class MessageSerializer(ModelSerializer):
             session=attrs.get("message_session")
         ).first()
         if session:
-            if (
-                CustomUser.objects.get(pk=user) not in session.participants.all()
-                and len(session.participants.all()) >= 2
-            ):
+            # A session belongs to exactly the two people talking in it
+            participants = set(session.participants.values_list("id", flat=True))
+            if participants != {user, attrs["receiver"].pk}:
                 raise ValidationError("You are not a member of this session.")
         return super().validate(attrs)
 
@@ -49,27 +52,36 @@ class MessageSerializer(ModelSerializer):
         user_id = self.context.get("request").user.id
         validated_data.update({"sender_id": user_id})
         mss = validated_data.pop("message_session", uuid4())
-        session = MessageSession.objects.filter(session=mss).first()
-        if session:
-            message_session = session
-        else:
-            message_session = MessageSession(session=mss)
-            message_session.save()
 
-        user = CustomUser.objects.get(pk=user_id)
+        with transaction.atomic():
+            session = MessageSession.objects.filter(session=mss).first()
+            if session:
+                message_session = session
+            else:
+                message_session = MessageSession(session=mss)
+                message_session.save()
+
+                # Both sides of the conversation have to see the session in their inbox
+                message_session.participants.add(user_id, validated_data["receiver"])
 
-        if user not in message_session.participants.all():
-            message_session.participants.add(user)
+            message = Message(**validated_data)
+            message.message_session = message_session
+            message.save()
 
-        message = Message(**validated_data)
-        message.message_session = message_session
-        message.save()
+            # Keeps the session on top of the inbox
+            MessageSession.objects.filter(session=message_session.session).update(
+                updated_at=message.created_at
+            )
+            record_message(message)
 
-        attachments = self.context.get("request").FILES.getlist("attachments")
+            attachments = self.context.get("request").FILES.getlist("attachments")
 
-        for attachment in attachments:
-            sf = MessageFile(msg=message, attachment=attachment)
-            sf.save()
+            for attachment in attachments:
+                sf = MessageFile(msg=message, attachment=attachment)
+                sf.save()
+
+            # The event goes out on commit, with the attachments saved above
+            publish_message_created(message, MessageSerializer(message).data)
 
         return message
 
@@ -97,3 +109,23 @@ class MessageSessionSerializer(ModelSerializer):
             "participants",
             "session_messages",
         )
+
+
+class MessageSessionListSerializer(ModelSerializer):
+    """
+    Inbox entry: a session with the preview of its last message and the number of unread messages.
+    """
+
+    session = UUIDField(source="message_session_id", read_only=True)
+    participants = PrimaryKeyRelatedField(source="message_session.participants", many=True, read_only=True)
+
+    class Meta:
+        model = InboxEntry
+        fields = (
+            "session",
+            "participants",
+            "last_message_id",
+            "last_message_at",
+            "preview",
+            "unread_count",
+        )
@@ -24,8 +24,18 @@ from rest_framework.permissions import (
     IsAuthenticated,
     IsAdminUser,
 )
-from .models import Message, MessageSession
-from .serializers import MessageSerializer, MessageSessionSerializer
+from django.db import transaction
+
+from fyiona.pagination import KeysetPagination
+from fyiona.uploadhandlers import restrict_uploads
+from .inbox import mark_read_up_to, refresh_session
+from .realtime import publish_messages_read
+from .models import InboxEntry, Message, MessageFile, MessageSession
+from .serializers import (
+    MessageSerializer,
+    MessageSessionSerializer,
+    MessageSessionListSerializer,
+)
 from users.middlewares import JWTAuthentication
 from django.shortcuts import get_object_or_404
 
@@ -40,6 +50,8 @@ class MessageViewSet(ViewSet):
     authentication_classes = (BasicAuthentication,)
 
     def create(self, request: HttpRequest):
+        # Aborts a wrong or oversized attachment before the whole body is received
+        restrict_uploads(request, MessageFile._meta.get_field("attachment"))
         if (
             request.FILES
             and request.FILES.get("attachments")
@@ -71,7 +83,9 @@ class MessageViewSet(ViewSet):
         message = get_object_or_404(Message, pk=pk)
 
         if message.sender == request.user:
-            message.delete()
+            with transaction.atomic():
+                message.delete()
+                refresh_session(message.message_session_id)
 
             return Response(
                 data={
@@ -113,18 +127,102 @@ class MessageSessionViewSet(ViewSet):
         JWTAuthentication,
     )
 
+    list_serializer_class = MessageSessionListSerializer
+    history_serializer_class = MessageSerializer
+
     def list(self, request: HttpRequest):
-        requester = request.user
-        message_session = MessageSession.objects.filter(participants__in=[requester])
+        """Inbox page, ordered by the last message. The next page is requested with ?cursor=<next>."""
+        paginator = KeysetPagination(ordering=("-last_message_at", "-id"))
+        entries = paginator.paginate_queryset(
+            InboxEntry.objects.filter(user=request.user).prefetch_related("message_session__participants"),
+            request,
+        )
 
-        serializer = self.serializer_class(message_session, many=True)
+        serializer = self.list_serializer_class(entries, many=True)
 
-        serializer.is_valid(raise_exception=True)
+        return Response(
+            data={
+                "success": True,
+                "result": serializer.data,
+                "next": paginator.next_cursor,
+            },
+            status=HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["get"])
+    def messages(self, request: HttpRequest, pk=None):
+        """Message history of one session, newest first. The next page is requested with ?cursor=<next>."""
+        message_session = get_object_or_404(MessageSession, session=pk)
+
+        if not message_session.participants.filter(pk=request.user.pk).exists():
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Access denied!",
+                },
+                status=HTTP_403_FORBIDDEN,
+            )
+
+        paginator = KeysetPagination(ordering=("-created_at", "-id"))
+        messages = paginator.paginate_queryset(
+            Message.objects.filter(message_session=message_session).select_related("attachments"),
+            request,
+        )
+        serializer = self.history_serializer_class(messages, many=True)
 
         return Response(
             data={
                 "success": True,
                 "result": serializer.data,
+                "next": paginator.next_cursor,
+            },
+            status=HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["post"])
+    def read(self, request: HttpRequest, pk=None):
+        """
+        Marks received messages of the session as read in one statement.
+        "up_to" - id of the last read message, everything received before it is marked too.
+        Without "up_to" the whole session is marked as read.
+        """
+        message_session = get_object_or_404(MessageSession, session=pk)
+
+        if not message_session.participants.filter(pk=request.user.pk).exists():
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Access denied!",
+                },
+                status=HTTP_403_FORBIDDEN,
+            )
+
+        up_to = request.data.get("up_to")
+        if up_to is not None:
+            try:
+                up_to = int(up_to)
+            except (TypeError, ValueError):
+                return Response(
+                    data={
+                        "success": False,
+                        "result": "up_to must be a message id!",
+                    },
+                    status=HTTP_406_NOT_ACCEPTABLE,
+                )
+
+        counters = mark_read_up_to(request.user.pk, message_session.session, up_to)
+        if counters["marked"]:
+            publish_messages_read(
+                message_session.session,
+                request.user.pk,
+                up_to,
+                list(message_session.participants.values_list("pk", flat=True)),
+            )
+
+        return Response(
+            data={
+                "success": True,
+                "result": counters,
             },
             status=HTTP_200_OK,
         )
@@ -156,6 +254,10 @@ class MessageSessionViewSet(ViewSet):
         """
         if self.action == "list":
             permission_classes = (IsAuthenticated,)
+        elif self.action == "messages":
+            permission_classes = (IsAuthenticated,)
+        elif self.action == "read":
+            permission_classes = (IsAuthenticated,)
         elif self.action == "destroy":
             permission_classes = (IsAuthenticated,)
         else:
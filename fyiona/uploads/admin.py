@@ -0,0 +1,6 @@
+from django.contrib import admin
+
+from .models import Blob, UploadSession
+
+admin.site.register(Blob)
+admin.site.register(UploadSession)
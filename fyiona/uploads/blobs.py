@@ -0,0 +1,151 @@
+"""
+Reference counting of fyiona.storage.ContentAddressedStorage blobs.
+
+Every row of the models below referencing a blob holds one reference. Saves and deletes of single
+rows are tracked by signals, bulk operations (bulk_create, queryset update/delete) have to call
+add_references() / remove_references() themselves. recount_references() rebuilds the counters
+from the tables if they ever drift.
+"""
+
+from collections import Counter
+from itertools import groupby
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_init, pre_save, post_save, post_delete
+from django.utils import timezone
+
+from fyiona.images import DERIVATIVES, get_derivative_name
+from fyiona.storage import content_addressed_storage, is_blob_name, BLOB_PREFIX
+from .models import Blob
+
+
+# model label -> file field
+REFERENCES = {
+    "users.UserProfile": "avatar",
+    "stories.StoryFile": "attachment",
+    "stories.StoryFileArchive": "attachment",
+    "umessages.MessageFile": "attachment",
+}
+
+GC_BATCH_SIZE = 500
+
+
+def register_blob(name: str, digest: str, size: int):
+    Blob.objects.update_or_create(
+        name=name,
+        defaults={"digest": digest, "size": size, "last_seen_at": timezone.now()},
+    )
+
+
+def change_references(names, sign: int):
+    counts = Counter(name for name in names if is_blob_name(name))
+    # One UPDATE per distinct number of references
+    by_count = sorted(counts.items(), key=lambda item: item[1])
+    for count, group in groupby(by_count, key=lambda item: item[1]):
+        Blob.objects.filter(name__in=[name for name, _ in group]).update(refcount=F("refcount") + sign * count)
+
+
+def add_references(names):
+    change_references(names, 1)
+
+
+def remove_references(names):
+    change_references(names, -1)
+
+
+def get_file_name(instance, field_name: str):
+    value = instance.__dict__.get(field_name)
+    return getattr(value, "name", value)
+
+
+def track_references(model, field_name: str):
+    """Connects the signals keeping the refcount of the blobs referenced by "model"."""
+
+    def remember(sender, instance, **kwargs):
+        if field_name in instance.__dict__:
+            instance._blob_name = get_file_name(instance, field_name)
+
+    def load_previous(sender, instance, **kwargs):
+        # The field was deferred when the row was loaded
+        if not instance._state.adding and not hasattr(instance, "_blob_name"):
+            instance._blob_name = sender.objects.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+
+    def saved(sender, instance, created, update_fields=None, **kwargs):
+        if update_fields is not None and field_name not in update_fields:
+            return
+        previous = None if created else instance._blob_name
+        current = get_file_name(instance, field_name)
+        if previous != current:
+            add_references([current])
+            remove_references([previous])
+        instance._blob_name = current
+
+    def deleted(sender, instance, **kwargs):
+        remove_references([get_file_name(instance, field_name)])
+
+    uid = "blobs:%s" % model._meta.label
+    post_init.connect(remember, sender=model, weak=False, dispatch_uid=uid)
+    pre_save.connect(load_previous, sender=model, weak=False, dispatch_uid=uid)
+    post_save.connect(saved, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(deleted, sender=model, weak=False, dispatch_uid=uid)
+
+
+def get_referencing_models():
+    for label, field_name in REFERENCES.items():
+        try:
+            yield apps.get_model(label), field_name
+        except LookupError:
+            # The app is not installed
+            continue
+
+
+def connect_signals():
+    for model, field_name in get_referencing_models():
+        track_references(model, field_name)
+
+
+def recount_references() -> int:
+    """Recomputes every refcount from the referencing tables, returns the number of corrected blobs."""
+    counts = Counter()
+    for model, field_name in get_referencing_models():
+        names = model.objects.filter(**{"%s__startswith" % field_name: BLOB_PREFIX}).values_list(field_name, flat=True)
+        counts.update(names.iterator(chunk_size=2000))
+
+    changed = []
+    for blob in Blob.objects.only("id", "name", "refcount").iterator(chunk_size=2000):
+        if blob.refcount != counts[blob.name]:
+            blob.refcount = counts[blob.name]
+            changed.append(blob)
+    Blob.objects.bulk_update(changed, ["refcount"], batch_size=1000)
+    return len(changed)
+
+
+def collect_garbage(older_than, batch_size: int = GC_BATCH_SIZE) -> tuple:
+    """
+    Deletes blobs without references that were not stored again after "older_than",
+    together with their image derivatives. Returns the number of deleted blobs and freed bytes.
+    The files are deleted while the rows are still locked: ContentAddressedStorage storing the same
+    content waits in register_blob() until the rows are gone and then writes the file again.
+    A crash before the commit leaves rows without a file, the next run deletes them.
+    """
+    deleted, freed = 0, 0
+    while True:
+        with transaction.atomic():
+            blobs = list(
+                Blob.objects.select_for_update(skip_locked=True)
+                .filter(refcount__lte=0, last_seen_at__lt=older_than)
+                .only("id", "name", "size")[:batch_size]
+            )
+            if not blobs:
+                return deleted, freed
+
+            for blob in blobs:
+                content_addressed_storage.delete(blob.name)
+                for derivative in DERIVATIVES:
+                    default_storage.delete(get_derivative_name(blob.name, derivative))
+                deleted += 1
+                freed += blob.size
+            Blob.objects.filter(id__in=[blob.id for blob in blobs]).delete()
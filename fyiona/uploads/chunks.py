@@ -0,0 +1,238 @@
+import os
+import fcntl
+import hashlib
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.template.defaultfilters import filesizeformat
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from fyiona.sniffing import SNIFF_SIZE, sniff_file, is_allowed
+from .models import UploadSession
+
+
+READ_SIZE = 64 * 1024
+
+# target -> (model of the attachment, model it is attached to); the apps are optional
+TARGET_MODELS = {
+    UploadSession.TARGET_STORY: ("stories.StoryFile", "stories.Story"),
+    UploadSession.TARGET_MESSAGE: ("umessages.MessageFile", "umessages.Message"),
+}
+
+
+class OffsetMismatch(APIException):
+    """The chunk does not continue the received data, the client has to resume from "received"."""
+
+    status_code = status.HTTP_409_CONFLICT
+    default_code = "offset_mismatch"
+
+    def __init__(self, received: int):
+        super().__init__(
+            detail={
+                "success": False,
+                "result": "Chunk offset does not match the received size",
+                "received": received,
+            }
+        )
+
+
+class PartialUploadFile(File):
+    """
+    Assembled upload on the local disk.
+    temporary_file_path() lets FileSystemStorage move the file into place instead of copying it.
+    """
+
+    def __init__(self, path: str, name: str):
+        super().__init__(open(path, "rb"), name=name)
+        self.path = path
+
+    def temporary_file_path(self) -> str:
+        return self.path
+
+
+def error(message: str) -> ValidationError:
+    return ValidationError(detail={"success": False, "result": message})
+
+
+def get_target_models(target: str) -> tuple:
+    try:
+        return tuple(apps.get_model(label) for label in TARGET_MODELS[target])
+    except LookupError:
+        # The app of the target is not installed
+        raise error("Uploads to %s are not available." % target)
+
+
+def get_target_field(target: str):
+    """Model field the finished upload is attached to, it defines allowed types and the size limit."""
+    attachment_model, _ = get_target_models(target)
+    return attachment_model._meta.get_field("attachment")
+
+
+def start_upload(owner, target: str, filename: str, content_type: str, size: int, checksum: str) -> UploadSession:
+    field = get_target_field(target)
+
+    if content_type not in field.content_types:
+        raise error("Filetype not supported.")
+    if size <= 0 or size > field.max_upload_size:
+        raise error("Please keep filesize under %s." % filesizeformat(field.max_upload_size))
+
+    # The content is always sent: a declared checksum proves nothing about who owns the file,
+    # duplicates are merged by fyiona.storage after the received bytes are hashed
+    session = UploadSession.objects.create(
+        owner=owner,
+        target=target,
+        filename=os.path.basename(filename),
+        content_type=content_type,
+        size=size,
+        checksum=checksum.lower(),
+    )
+
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    open(session.partial_path, "wb").close()
+    return session
+
+
+def append_chunk(session_id, owner, offset: int, stream, length: int) -> UploadSession:
+    """
+    Appends "length" bytes read from "stream" at "offset".
+    The body is copied in small pieces, memory usage does not depend on the chunk size.
+    A chunk interrupted by the client is kept, the client resumes from session.received.
+
+    No transaction is open while the body arrives: chunks of the same upload are serialized by a lock
+    on the partial file, and "received" only moves forward if nobody else has moved it meanwhile.
+    """
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise error("Chunk is larger than %s." % filesizeformat(settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE))
+
+    session = UploadSession.objects.get(id=session_id, owner=owner)
+    check_offset(session, offset, length)
+
+    with open(session.partial_path, "r+b") as partial:
+        try:
+            fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # Another request is still writing this upload, e.g. the retry of a stalled chunk
+            raise OffsetMismatch(session.received)
+
+        # The previous writer may have finished between the check above and the lock
+        session.refresh_from_db(fields=["status", "received"])
+        check_offset(session, offset, length)
+
+        written = 0
+        partial.seek(offset)
+        partial.truncate()
+        while written < length:
+            piece = stream.read(min(READ_SIZE, length - written))
+            if not piece:
+                break
+            partial.write(piece)
+            written += len(piece)
+        partial.flush()
+
+        received = offset + written
+        # The first bytes decide the real type, a wrong file is rejected before the rest is sent
+        if offset < SNIFF_SIZE <= received or offset < received == session.size:
+            check_type(session, offset)
+
+        updated = UploadSession.objects.filter(
+            id=session.id, status=UploadSession.STATUS_UPLOADING, received=offset
+        ).update(received=received)
+        if not updated:
+            session.refresh_from_db(fields=["status", "received"])
+            raise OffsetMismatch(session.received)
+
+    session.received = received
+    return session
+
+
+def check_offset(session: UploadSession, offset: int, length: int):
+    if session.status != UploadSession.STATUS_UPLOADING:
+        raise error("Upload is already finalized.")
+    if offset != session.received:
+        raise OffsetMismatch(session.received)
+    if offset + length > session.size:
+        raise error("Chunk exceeds the declared file size.")
+
+
+def check_type(session: UploadSession, offset: int):
+    """Sniffs the partial file, a rejected chunk is cut off again before "received" is moved."""
+    with open(session.partial_path, "r+b") as partial:
+        if not is_allowed(sniff_file(partial), get_target_field(session.target).content_types):
+            partial.truncate(offset)
+            raise error("Filetype not supported.")
+
+
+def get_checksum(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as partial:
+        for piece in iter(lambda: partial.read(READ_SIZE), b""):
+            sha256.update(piece)
+    return sha256.hexdigest()
+
+
+def finalize_upload(session_id, owner, attach_to):
+    """
+    Verifies the assembled file and attaches it to the story or the message "attach_to" (id) of the owner.
+    Returns the created StoryFile or MessageFile.
+    """
+    with transaction.atomic():
+        session = UploadSession.objects.select_for_update().get(id=session_id, owner=owner)
+
+        if session.status != UploadSession.STATUS_UPLOADING:
+            raise error("Upload is already finalized.")
+        if session.received != session.size:
+            raise error("Upload is incomplete: %s of %s bytes received." % (session.received, session.size))
+        if get_checksum(session.partial_path) != session.checksum:
+            raise error("Checksum does not match, the upload has to be started again.")
+
+        attachment_model, parent_model = get_target_models(session.target)
+        if session.target == UploadSession.TARGET_STORY:
+            story = parent_model.objects.filter(id=attach_to, author=owner).first()
+            if story is None:
+                raise error("There is no such story.")
+            attachment = attachment_model(story=story)
+        else:
+            message = parent_model.objects.filter(id=attach_to, sender=owner, attachments__isnull=True).first()
+            if message is None:
+                raise error("There is no such message or it already has an attachment.")
+            attachment = attachment_model(msg=message)
+
+        upload = PartialUploadFile(session.partial_path, session.filename)
+        try:
+            attachment.attachment.save(session.filename, upload, save=True)
+        finally:
+            upload.close()
+        # Left behind when the content turned out to be stored already
+        remove_partial(session)
+
+        session.status = UploadSession.STATUS_COMPLETE
+        session.save(update_fields=["status"])
+
+    return attachment
+
+
+def remove_partial(session: UploadSession):
+    try:
+        os.remove(session.partial_path)
+    except FileNotFoundError:
+        pass
+
+
+def discard_upload(session: UploadSession):
+    remove_partial(session)
+    session.delete()
+
+
+def purge_stale_uploads(older_than) -> int:
+    """Removes unfinished sessions started before "older_than" and finished ones, returns the number removed."""
+    stale = UploadSession.objects.filter(created_at__lt=older_than) | UploadSession.objects.filter(
+        status=UploadSession.STATUS_COMPLETE
+    )
+    removed = 0
+    for session in stale.iterator():
+        discard_upload(session)
+        removed += 1
+    return removed
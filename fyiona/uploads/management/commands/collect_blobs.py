@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from uploads.blobs import collect_garbage, recount_references
+
+
+class Command(BaseCommand):
+    """
+    Deletes content-addressed blobs (see fyiona.storage) that no row references anymore,
+    meant to be run periodically by cron. The grace period protects blobs that are being reused
+    by an upload in progress.
+    """
+
+    help = "Deletes unreferenced media blobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24, help="Grace period since the blob was last stored")
+        parser.add_argument("--recount", action="store_true", help="Rebuild reference counters from the tables first")
+
+    def handle(self, *args, **options):
+        if options["recount"]:
+            self.stdout.write("Corrected reference counters: %s" % recount_references())
+
+        deleted, freed = collect_garbage(timezone.now() - timedelta(hours=options["hours"]))
+        self.stdout.write(self.style.SUCCESS("Done. Deleted blobs: %s, freed %s" % (deleted, filesizeformat(freed))))
@@ -0,0 +1,21 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from uploads.chunks import purge_stale_uploads
+
+
+class Command(BaseCommand):
+    """
+    Removes abandoned upload sessions and their partial files, meant to be run periodically by cron.
+    """
+
+    help = "Removes abandoned chunked uploads"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--hours", type=int, default=24, help="Age of an unfinished upload to be removed")
+
+    def handle(self, *args, **options):
+        removed = purge_stale_uploads(timezone.now() - timedelta(hours=options["hours"]))
+        self.stdout.write(self.style.SUCCESS("Done. Removed uploads: %s" % removed))
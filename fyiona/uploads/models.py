@@ -0,0 +1,135 @@
+import os
+import uuid
+
+from django.db import models
+from django.conf import settings
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from users.models import CustomUser
+
+
+class Blob(models.Model):
+    """
+    A file of fyiona.storage.ContentAddressedStorage, stored once however many rows use it.
+    refcount is the number of referencing rows, see uploads.blobs.
+    """
+
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name=_("Storage Name"),
+    )
+    digest = models.CharField(
+        max_length=64,
+        db_index=True,
+        verbose_name=_("SHA-256"),
+    )
+    size = models.BigIntegerField(
+        verbose_name=_("Size"),
+    )
+    refcount = models.IntegerField(
+        default=0,
+        verbose_name=_("References"),
+    )
+    # Saving the same content again refreshes it, so a blob reused right now is not collected
+    last_seen_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Last Stored"),
+    )
+
+    class Meta:
+        verbose_name = "Blob"
+        verbose_name_plural = "Blobs"
+        indexes = [
+            models.Index(
+                fields=["last_seen_at"],
+                name="uploads_blob_unused_idx",
+                condition=models.Q(refcount__lte=0),
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return "%s (%s references)" % (self.name, self.refcount)
+
+
+class UploadSession(models.Model):
+    """
+    Resumable upload of one large file.
+    The client declares the file (name, type, size, SHA-256), sends it chunk by chunk
+    and finalizes the session, which attaches the assembled file to a StoryFile or a MessageFile.
+    Chunks are appended to a partial file on disk, see uploads.chunks.
+    """
+
+    TARGET_STORY = "story"
+    TARGET_MESSAGE = "message"
+    TARGETS = (
+        (TARGET_STORY, "Story"),
+        (TARGET_MESSAGE, "Message"),
+    )
+
+    STATUS_UPLOADING = "uploading"
+    STATUS_COMPLETE = "complete"
+    STATUSES = (
+        (STATUS_UPLOADING, "Uploading"),
+        (STATUS_COMPLETE, "Complete"),
+    )
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid.uuid4,
+        editable=False,
+        verbose_name=_("Upload ID"),
+    )
+    owner = models.ForeignKey(
+        to=CustomUser,
+        on_delete=models.CASCADE,
+        related_name="upload_sessions",
+        verbose_name=_("Owner"),
+    )
+    target = models.CharField(
+        max_length=16,
+        choices=TARGETS,
+        verbose_name=_("Attach to"),
+    )
+    filename = models.CharField(
+        max_length=255,
+        verbose_name=_("File Name"),
+    )
+    content_type = models.CharField(
+        max_length=100,
+        verbose_name=_("Content Type"),
+    )
+    size = models.BigIntegerField(
+        verbose_name=_("Declared Size"),
+    )
+    checksum = models.CharField(
+        max_length=64,
+        verbose_name=_("Declared SHA-256"),
+    )
+    received = models.BigIntegerField(
+        default=0,
+        verbose_name=_("Received Bytes"),
+    )
+    status = models.CharField(
+        max_length=16,
+        choices=STATUSES,
+        default=STATUS_UPLOADING,
+        verbose_name=_("Status"),
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name=_("Date Created"),
+    )
+
+    class Meta:
+        verbose_name = "Upload Session"
+        verbose_name_plural = "Upload Sessions"
+
+    @property
+    def partial_path(self) -> str:
+        return os.path.join(settings.CHUNKED_UPLOAD_DIR, "%s.part" % self.id)
+
+    def __str__(self) -> str:
+        return "%s (%s/%s bytes)" % (self.filename, self.received, self.size)
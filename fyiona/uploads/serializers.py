@@ -0,0 +1,44 @@
+from rest_framework.serializers import (
+    ModelSerializer,
+    Serializer,
+    CharField,
+    IntegerField,
+    RegexField,
+)
+
+from .models import UploadSession
+
+
+class UploadSessionSerializer(ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = (
+            "id",
+            "target",
+            "filename",
+            "content_type",
+            "size",
+            "checksum",
+            "received",
+            "status",
+            "created_at",
+        )
+        read_only_fields = (
+            "id",
+            "received",
+            "status",
+            "created_at",
+        )
+
+
+class UploadSessionCreateSerializer(Serializer):
+    target = CharField(max_length=16)
+    filename = CharField(max_length=255)
+    content_type = CharField(max_length=100)
+    size = IntegerField(min_value=1)
+    checksum = RegexField(r"^[0-9a-fA-F]{64}$", help_text="SHA-256 of the whole file, hex")
+
+    def validate_target(self, value):
+        if value not in dict(UploadSession.TARGETS):
+            self.fail("invalid")
+        return value
@@ -0,0 +1,6 @@
+from rest_framework.routers import DefaultRouter
+from .views import UploadViewSet
+
+router = DefaultRouter()
+router.register(r"", UploadViewSet, basename="upload")
+urlpatterns = router.urls
@@ -0,0 +1,116 @@
+from django.http.request import HttpRequest
+from django.shortcuts import get_object_or_404
+
+from rest_framework.status import (
+    HTTP_200_OK,
+    HTTP_201_CREATED,
+    HTTP_406_NOT_ACCEPTABLE,
+)
+from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.viewsets import ViewSet
+from rest_framework.permissions import IsAuthenticated
+
+from users.middlewares import JWTAuthentication
+from .models import UploadSession
+from .serializers import UploadSessionSerializer, UploadSessionCreateSerializer
+from .chunks import start_upload, append_chunk, finalize_upload, discard_upload
+
+
+class UploadViewSet(ViewSet):
+    """
+    Resumable chunked upload of story and message attachments:
+        POST   uploads/                 - declare the file: target, filename, content_type, size, checksum (SHA-256)
+        PUT    uploads/<id>/chunk/      - raw bytes of the next chunk, "Upload-Offset" header = bytes already sent
+        GET    uploads/<id>/            - how many bytes were received, to resume after a failure
+        POST   uploads/<id>/finalize/   - verify and attach to "attach_to" (story id or message id)
+        DELETE uploads/<id>/            - abort the upload
+    """
+
+    serializer_class = UploadSessionSerializer
+    authentication_classes = (JWTAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def create(self, request: HttpRequest):
+        serializer = UploadSessionCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        session = start_upload(owner=request.user, **serializer.validated_data)
+        return Response(
+            data={
+                "success": True,
+                "result": self.serializer_class(session).data,
+            },
+            status=HTTP_201_CREATED,
+        )
+
+    def retrieve(self, request: HttpRequest, pk=None):
+        session = get_object_or_404(UploadSession, id=pk, owner=request.user)
+        return Response(
+            data={
+                "success": True,
+                "result": self.serializer_class(session).data,
+            },
+            status=HTTP_200_OK,
+        )
+
+    def destroy(self, request: HttpRequest, pk=None):
+        session = get_object_or_404(UploadSession, id=pk, owner=request.user)
+        discard_upload(session)
+        return Response(
+            data={
+                "success": True,
+                "result": "Upload was removed!",
+            },
+            status=HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["put"])
+    def chunk(self, request: HttpRequest, pk=None):
+        get_object_or_404(UploadSession, id=pk, owner=request.user)
+        try:
+            offset = int(request.headers["Upload-Offset"])
+            length = int(request.META["CONTENT_LENGTH"])
+        except (KeyError, ValueError):
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Upload-Offset and Content-Length headers are required!",
+                },
+                status=HTTP_406_NOT_ACCEPTABLE,
+            )
+
+        # request.data is never touched, the body is streamed straight into the partial file
+        session = append_chunk(pk, request.user, offset, request.stream, length)
+        return Response(
+            data={
+                "success": True,
+                "result": self.serializer_class(session).data,
+            },
+            status=HTTP_200_OK,
+        )
+
+    @action(detail=True, methods=["post"])
+    def finalize(self, request: HttpRequest, pk=None):
+        get_object_or_404(UploadSession, id=pk, owner=request.user)
+        attach_to = request.data.get("attach_to")
+        if not attach_to:
+            return Response(
+                data={
+                    "success": False,
+                    "result": "attach_to field was not provided!",
+                },
+                status=HTTP_406_NOT_ACCEPTABLE,
+            )
+
+        attachment = finalize_upload(pk, request.user, attach_to)
+        return Response(
+            data={
+                "success": True,
+                "result": {
+                    "id": attachment.id,
+                    "attachment": attachment.attachment.url,
+                },
+            },
+            status=HTTP_201_CREATED,
+        )
@@ -4,8 +4,10 @@ from django.contrib.auth.models import Group
 from .models import (
     CustomUser, 
     UserProfile, 
-    CustomUserEmailConfirmationToken,
-    AccessTokenToUpdateCustomUserFields, 
+    OneTimeToken,
+    OutboundEmail,
+    Follow,
+    RefreshToken,
 )
 
 
@@ -13,5 +15,7 @@ admin.site.unregister(Group)
 
 admin.site.register(CustomUser)
 admin.site.register(UserProfile)
-admin.site.register(CustomUserEmailConfirmationToken)
-admin.site.register(AccessTokenToUpdateCustomUserFields)
\ No newline at end of file
+admin.site.register(OneTimeToken)
+admin.site.register(OutboundEmail)
+admin.site.register(Follow)
+admin.site.register(RefreshToken)
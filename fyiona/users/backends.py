@@ -0,0 +1,31 @@
+from django.contrib.auth.backends import ModelBackend
+
+from .models import CustomUser, normalize_phone_number
+
+
+class PhoneNumberBackend(ModelBackend):
+    """
+    authenticate(request, phone_number=..., password=...): the number is normalized to E.164 and
+    the user is found with one lookup on the unique phone number index.
+    """
+
+    def authenticate(self, request, phone_number=None, password=None, **kwargs):
+        if phone_number is None or password is None:
+            return None
+        try:
+            phone_number = normalize_phone_number(phone_number)
+        except ValueError:
+            return None
+        if not phone_number:
+            return None
+
+        try:
+            user = CustomUser._default_manager.get(phone_number=phone_number)
+        except CustomUser.DoesNotExist:
+            # Hash anyway, so the response time does not tell which numbers are registered
+            CustomUser().set_password(password)
+            return None
+
+        if user.check_password(password) and self.user_can_authenticate(user):
+            return user
+        return None
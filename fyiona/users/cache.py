@@ -0,0 +1,183 @@
+"""
+Cache of CustomUser rows used by JWTAuthentication, so authenticated requests do not pay a DB round trip.
+There are two levels:
+    1. LocalLRUCache - per process, bounded in size, every entry lives TTL seconds
+    2. Django cache backend (optional) - shared between processes, settings.USER_CACHE["SHARED_CACHE_ALIAS"]
+Entries are dropped from both levels on post_save/post_delete of CustomUser (see users.signals).
+Other processes can only drop their local copy by TTL, so keep it short.
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import CustomUser
+
+
+DEFAULT_SETTINGS = {
+    "MAX_SIZE": 10000,
+    "TTL": 30,
+    "SHARED_CACHE_ALIAS": None,
+    "SHARED_CACHE_TTL": 300,
+    "KEY_PREFIX": "users:user:",
+}
+
+
+class LocalLRUCache:
+    """Thread safe LRU cache with a fixed time to live for every entry."""
+
+    def __init__(self, max_size: int, ttl: float, timer=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.timer = timer
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+
+            expires_at, value = item
+            if expires_at <= self.timer():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (self.timer() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class UserCache:
+    """
+    Returns CustomUser instances by id.
+    The row is cached as a tuple of its column values, so every call builds a fresh instance
+    and a request can never change a user object that is shared with other requests.
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        ttl: float,
+        shared_cache_alias=None,
+        shared_cache_ttl: float = 300,
+        key_prefix: str = "users:user:",
+    ):
+        self.local = LocalLRUCache(max_size=max_size, ttl=ttl)
+        self.shared_cache_alias = shared_cache_alias
+        self.shared_cache_ttl = shared_cache_ttl
+        self.key_prefix = key_prefix
+
+        self._counters_lock = threading.Lock()
+        self.reset_stats()
+
+    @classmethod
+    def from_settings(cls):
+        options = {**DEFAULT_SETTINGS, **getattr(settings, "USER_CACHE", {})}
+        return cls(
+            max_size=options["MAX_SIZE"],
+            ttl=options["TTL"],
+            shared_cache_alias=options["SHARED_CACHE_ALIAS"],
+            shared_cache_ttl=options["SHARED_CACHE_TTL"],
+            key_prefix=options["KEY_PREFIX"],
+        )
+
+    @property
+    def shared(self):
+        if self.shared_cache_alias:
+            return caches[self.shared_cache_alias]
+        return None
+
+    def _key(self, user_id) -> str:
+        return "%s%s" % (self.key_prefix, user_id)
+
+    def _count(self, counter: str):
+        with self._counters_lock:
+            self.counters[counter] += 1
+
+    @staticmethod
+    def _dump(user: CustomUser) -> tuple:
+        return tuple(getattr(user, field.attname) for field in CustomUser._meta.concrete_fields)
+
+    @staticmethod
+    def _load(values: tuple) -> CustomUser:
+        field_names = [field.attname for field in CustomUser._meta.concrete_fields]
+        return CustomUser.from_db(DEFAULT_DB_ALIAS, field_names, values)
+
+    def get_user(self, user_id) -> CustomUser:
+        """Raises CustomUser.DoesNotExist exactly like CustomUser.objects.get(id=user_id)"""
+        key = self._key(user_id)
+
+        values = self.local.get(key)
+        if values is not None:
+            self._count("local_hits")
+            return self._load(values)
+
+        shared = self.shared
+        if shared is not None:
+            values = shared.get(key)
+            if values is not None:
+                self._count("shared_hits")
+                self.local.set(key, values)
+                return self._load(values)
+
+        self._count("misses")
+        user = CustomUser.objects.get(id=user_id)
+        values = self._dump(user)
+
+        self.local.set(key, values)
+        if shared is not None:
+            shared.set(key, values, self.shared_cache_ttl)
+
+        return user
+
+    def invalidate(self, user_id):
+        key = self._key(user_id)
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def reset_stats(self):
+        with self._counters_lock:
+            self.counters = {"local_hits": 0, "shared_hits": 0, "misses": 0}
+
+    def stats(self) -> dict:
+        with self._counters_lock:
+            counters = dict(self.counters)
+
+        lookups = sum(counters.values())
+        hits = counters["local_hits"] + counters["shared_hits"]
+        counters.update(
+            {
+                "lookups": lookups,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "miss_rate": counters["misses"] / lookups if lookups else 0.0,
+                "local_size": len(self.local),
+            }
+        )
+        return counters
+
+
+user_cache = UserCache.from_settings()
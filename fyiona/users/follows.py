@@ -0,0 +1,135 @@
+"""
+Follow graph. Every change goes through follow() / unfollow(), which keep
+UserProfile.followers_count and following_count in the same transaction,
+so counts are read from the profile row instead of COUNT(*) over the followers of a celebrity.
+"""
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Follow, UserProfile
+from .signals import follow_removed
+
+
+MAX_CHECK_IDS = 100
+
+
+def follow(follower: UserProfile, profile: UserProfile) -> bool:
+    """Returns False if the follower already followed the profile."""
+    try:
+        with transaction.atomic():
+            _, created = Follow.objects.get_or_create(profile=profile, follower=follower)
+            if created:
+                UserProfile.objects.filter(pk=profile.pk).update(followers_count=F("followers_count") + 1)
+                UserProfile.objects.filter(pk=follower.pk).update(following_count=F("following_count") + 1)
+    except IntegrityError:
+        # A concurrent request created the same row
+        return False
+    return created
+
+
+def unfollow(follower: UserProfile, profile: UserProfile) -> bool:
+    """Returns False if the follower did not follow the profile."""
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(profile=profile, follower=follower).delete()
+        if deleted:
+            UserProfile.objects.filter(pk=profile.pk).update(followers_count=F("followers_count") - 1)
+            UserProfile.objects.filter(pk=follower.pk).update(following_count=F("following_count") - 1)
+
+    if deleted:
+        follow_removed.send(sender=Follow, follower=follower, profile=profile)
+    return bool(deleted)
+
+
+def remove_follows(profile: UserProfile) -> int:
+    """
+    Deletes the Follow rows of a profile that is about to be deleted, the cascade would leave
+    the counters of the people on the other side too high. Returns the number of removed rows.
+    """
+    with transaction.atomic():
+        # Locked, so a concurrent unfollow() of the same rows does not lower the counters again
+        follows = list(
+            Follow.objects.select_for_update()
+            .filter(Q(profile=profile) | Q(follower=profile))
+            .values_list("profile_id", "follower_id")
+        )
+        follower_ids = [follower_id for profile_id, follower_id in follows if profile_id == profile.pk]
+        followed_ids = [profile_id for profile_id, follower_id in follows if follower_id == profile.pk]
+
+        UserProfile.objects.filter(pk__in=follower_ids).update(following_count=F("following_count") - 1)
+        UserProfile.objects.filter(pk__in=followed_ids).update(followers_count=F("followers_count") - 1)
+        Follow.objects.filter(Q(profile=profile) | Q(follower=profile)).delete()
+
+    return len(follows)
+
+
+def get_followers(profile: UserProfile):
+    """Follow rows of the people following the profile, to be paginated by ("-created_at", "-id")."""
+    return Follow.objects.filter(profile=profile).select_related("follower__user")
+
+
+def get_following(profile: UserProfile):
+    """Follow rows of the accounts the profile follows, to be paginated by ("-created_at", "-id")."""
+    return Follow.objects.filter(follower=profile).select_related("profile__user")
+
+
+def get_followed_user_ids(user, user_ids) -> set:
+    """Which of "user_ids" the user follows, one index lookup per id in a single query."""
+    return set(
+        Follow.objects.filter(follower__user_id=user.pk, profile__user_id__in=user_ids).values_list(
+            "profile__user_id", flat=True
+        )
+    )
+
+
+def recount_follows() -> int:
+    """Recomputes both counters of every profile from the Follow table, returns the number of updated rows."""
+
+    def count(field: str):
+        return Coalesce(
+            Subquery(
+                Follow.objects.filter(**{field: OuterRef("pk")})
+                .order_by()
+                .values(field)
+                .annotate(count=Count("id"))
+                .values("count")
+            ),
+            0,
+        )
+
+    return UserProfile.objects.update(followers_count=count("profile"), following_count=count("follower"))
+
+
+def move_legacy_follows(batch_size: int = 10000) -> int:
+    """
+    Copies the rows of the legacy UserProfile.followers table into Follow and deletes them,
+    returns the number of moved rows. Safe to run more than once, called after every migrate.
+    """
+    # from_userprofile is the followed profile, to_userprofile the follower
+    legacy = UserProfile.followers.through.objects
+
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                legacy.order_by("id").values_list("id", "from_userprofile_id", "to_userprofile_id")[:batch_size]
+            )
+            if not rows:
+                break
+
+            Follow.objects.bulk_create(
+                [
+                    Follow(profile_id=profile_id, follower_id=follower_id)
+                    for _, profile_id, follower_id in rows
+                    if profile_id != follower_id
+                ],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            legacy.filter(id__in=[row_id for row_id, _, _ in rows]).delete()
+        moved += len(rows)
+
+    if moved:
+        recount_follows()
+    return moved
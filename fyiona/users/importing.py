@@ -0,0 +1,243 @@
+"""
+Bulk import of users from a legacy system.
+
+Rows are streamed from a CSV file (header row) or a JSONL file (one object per line) with the columns
+    email (required), first_name, last_name, phone_number, password, id, date_joined,
+    active, email_confirmed
+"password" has to be hashed already in a format of PASSWORD_HASHERS (e.g. "pbkdf2_sha256$...",
+"bcrypt_sha256$..."), hashing plain passwords would cost more than the whole import; rows without one
+get an unusable password and have to reset it.
+
+Every chunk is validated at once (one query each for the emails, phone numbers and ids already taken)
+and written with two bulk INSERTs (users and profiles) in one transaction. Signals are not sent:
+imported users get no confirmation email.
+"""
+
+import os
+import csv
+import json
+import uuid
+import time
+from datetime import date, datetime
+from datetime import time as day_time
+
+from django.contrib.auth.hashers import identify_hasher, make_password
+from django.contrib.auth.models import BaseUserManager
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .models import CustomUser, UserProfile, phone_digits, normalize_phone_number
+
+
+DEFAULT_CHUNK_SIZE = 5000
+# Rows per INSERT statement inside a chunk
+INSERT_BATCH_SIZE = 1000
+
+TRUE_VALUES = ("1", "true", "True", "yes", "y", True, 1)
+
+
+class RowError(ValueError):
+    pass
+
+
+def read_rows(path: str, file_format: str = None):
+    """Yields (line number, row dict), the file is read lazily."""
+    file_format = file_format or os.path.splitext(path)[1].lstrip(".").lower()
+
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            reader = csv.DictReader(file)
+            for row in reader:
+                # Values of columns missing in the header
+                row.pop(None, None)
+                yield reader.line_num, row
+            return
+
+        if file_format in ("jsonl", "ndjson"):
+            for line_number, line in enumerate(file, start=1):
+                if line.strip():
+                    try:
+                        yield line_number, json.loads(line)
+                    except ValueError as error:
+                        yield line_number, error
+            return
+
+    raise ValueError("Unsupported format %r, use csv or jsonl" % file_format)
+
+
+def get_boolean(row: dict, column: str, default: bool) -> bool:
+    value = row.get(column)
+    if value in (None, ""):
+        return default
+    return value in TRUE_VALUES
+
+
+def build_user(row: dict) -> CustomUser:
+    if not isinstance(row, dict):
+        raise RowError("not an object: %s" % row)
+
+    email = BaseUserManager.normalize_email(str(row.get("email") or "").strip())
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise RowError("invalid email %r" % email)
+
+    try:
+        phone_number = normalize_phone_number(row.get("phone_number"))
+    except ValueError:
+        raise RowError("invalid phone number %r" % row.get("phone_number"))
+
+    password = row.get("password") or ""
+    if password:
+        try:
+            identify_hasher(password)
+        except ValueError:
+            raise RowError("password is not hashed with a known hasher")
+    else:
+        password = make_password(None)
+
+    try:
+        user_id = uuid.UUID(str(row["id"])) if row.get("id") else uuid.uuid4()
+    except ValueError:
+        raise RowError("invalid id %r" % row.get("id"))
+
+    user = CustomUser(
+        id=user_id,
+        email=email,
+        first_name=str(row.get("first_name") or "")[:32],
+        last_name=str(row.get("last_name") or "")[:32],
+        phone_number=phone_number,
+        # save() is skipped by bulk_create
+        phone_number_digits=phone_digits(phone_number),
+        password=password,
+        active=get_boolean(row, "active", True),
+        email_confirmed=get_boolean(row, "email_confirmed", False),
+    )
+    if row.get("date_joined"):
+        user.date_joined = get_date_joined(str(row["date_joined"]))
+    return user
+
+
+def get_date_joined(value: str) -> date:
+    """
+    Local date of a "date_joined" value, a full timestamp ("2021-10-01T23:30:00-05:00") or a date.
+    Timestamps without an offset and plain dates are taken in the current time zone.
+    """
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = datetime.combine(day, day_time.min) if day is not None else None
+    except ValueError:
+        moment = None
+    if moment is None:
+        raise RowError("invalid date_joined %r" % value)
+
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return timezone.localdate(moment)
+
+
+class UserImporter:
+    """
+    Imports rows chunk by chunk, "report" is called after every chunk with the importer itself.
+    Invalid rows and emails, phone numbers or ids that are taken (earlier in the file or in the database) are skipped
+    and collected in "errors".
+    """
+
+    def __init__(self, chunk_size: int = DEFAULT_CHUNK_SIZE, dry_run: bool = False, report=None):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.report = report
+        self.imported = 0
+        self.errors = []  # (line number, message)
+        self.seen_emails = set()
+        self.seen_phone_numbers = set()
+        self.seen_ids = set()
+        self.started = None
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self) -> float:
+        """Imported users per minute."""
+        return self.imported / self.elapsed * 60 if self.elapsed else 0.0
+
+    def run(self, rows) -> int:
+        self.started = time.perf_counter()
+        chunk = []
+        for line_number, row in rows:
+            if isinstance(row, Exception):
+                self.errors.append((line_number, "invalid JSON: %s" % row))
+                continue
+            try:
+                user = build_user(row)
+            except RowError as error:
+                self.errors.append((line_number, str(error)))
+                continue
+
+            if user.email in self.seen_emails:
+                self.errors.append((line_number, "duplicate email %s in the file" % user.email))
+                continue
+            phone_number = str(user.phone_number or "")
+            if phone_number in self.seen_phone_numbers:
+                self.errors.append((line_number, "duplicate phone number %s in the file" % phone_number))
+                continue
+            if user.id in self.seen_ids:
+                self.errors.append((line_number, "duplicate id %s in the file" % user.id))
+                continue
+            self.seen_emails.add(user.email)
+            if phone_number:
+                self.seen_phone_numbers.add(phone_number)
+            self.seen_ids.add(user.id)
+
+            chunk.append((line_number, user))
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            self.import_chunk(chunk)
+        return self.imported
+
+    def import_chunk(self, chunk: list):
+        taken = set(
+            CustomUser.objects.filter(email__in=[user.email for _, user in chunk]).values_list("email", flat=True)
+        )
+        phone_numbers = [str(user.phone_number) for _, user in chunk if user.phone_number]
+        taken_phone_numbers = {
+            str(phone_number)
+            for phone_number in CustomUser.objects.filter(phone_number__in=phone_numbers).values_list(
+                "phone_number", flat=True
+            )
+        }
+        taken_ids = set(
+            CustomUser.objects.filter(id__in=[user.id for _, user in chunk]).values_list("id", flat=True)
+        )
+        users = []
+        for line_number, user in chunk:
+            if user.email in taken:
+                self.errors.append((line_number, "email %s is already registered" % user.email))
+            elif user.id in taken_ids:
+                # bulk_create would fail the whole chunk on the primary key
+                self.errors.append((line_number, "id %s is already registered" % user.id))
+            elif user.phone_number and str(user.phone_number) in taken_phone_numbers:
+                self.errors.append((line_number, "phone number %s is already registered" % user.phone_number))
+            else:
+                users.append(user)
+
+        if users and not self.dry_run:
+            with transaction.atomic():
+                CustomUser.objects.bulk_create(users, batch_size=INSERT_BATCH_SIZE)
+                UserProfile.objects.bulk_create(
+                    [UserProfile(user_id=user.id) for user in users],
+                    batch_size=INSERT_BATCH_SIZE,
+                )
+
+        self.imported += len(users)
+        if self.report is not None:
+            self.report(self)
@@ -0,0 +1,114 @@
+import logging
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.core.mail import EmailMessage, get_connection
+
+from .models import OutboundEmail
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SETTINGS = {
+    "BATCH_SIZE": 50,
+    "MAX_ATTEMPTS": 5,
+    "RETRY_BACKOFF": 30,  # seconds before the 2nd attempt, doubled after every failure
+    "MAX_BACKOFF": 3600,
+    "LEASE": 1800,  # seconds a claimed batch belongs to its worker, longer than BATCH_SIZE * EMAIL_TIMEOUT
+}
+
+
+def get_queue_settings() -> dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, "MAIL_QUEUE", {})}
+
+
+def enqueue_email(to_email: str, subject: str, body: str, from_email: Optional[str] = None) -> OutboundEmail:
+    """Puts an email into the queue, costs one INSERT and never talks to the SMTP server."""
+    return OutboundEmail.objects.create(
+        to_email=to_email,
+        from_email=from_email or settings.DEFAULT_FROM_EMAIL,
+        subject=subject,
+        body=body,
+    )
+
+
+def get_retry_delay(attempts: int) -> timedelta:
+    options = get_queue_settings()
+    seconds = options["RETRY_BACKOFF"] * 2 ** max(attempts - 1, 0)
+    return timedelta(seconds=min(seconds, options["MAX_BACKOFF"]))
+
+
+def claim_emails(batch_size: int) -> list:
+    """
+    Takes a batch of due emails for this worker and commits right away, so no lock is held while
+    talking to the SMTP server. Claimed rows are "sending" until their lease (next_attempt_at) runs out,
+    after that another worker picks up the ones a crashed worker has left behind.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(
+                status__in=[OutboundEmail.STATUS_PENDING, OutboundEmail.STATUS_SENDING],
+                next_attempt_at__lte=now,
+            )
+            .order_by("next_attempt_at")[:batch_size]
+        )
+        lease_until = now + timedelta(seconds=get_queue_settings()["LEASE"])
+        OutboundEmail.objects.filter(pk__in=[email.pk for email in emails]).update(
+            status=OutboundEmail.STATUS_SENDING,
+            next_attempt_at=lease_until,
+        )
+    return emails
+
+
+def send_queued_emails(connection=None, batch_size: Optional[int] = None) -> tuple:
+    """
+    Delivers one batch of due emails and returns (sent, failed) counters.
+    Pass an opened connection to reuse the same SMTP session between batches.
+    Every email is marked with its own UPDATE right after the SMTP server has answered,
+    so a crash in the middle of a batch resends at most the email that was in flight.
+    """
+    options = get_queue_settings()
+    batch_size = batch_size or options["BATCH_SIZE"]
+    connection = connection or get_connection()
+
+    sent = failed = 0
+    for email in claim_emails(batch_size):
+        message = EmailMessage(
+            subject=email.subject,
+            body=email.body,
+            from_email=email.from_email,
+            to=[email.to_email],
+            connection=connection,
+        )
+        email.attempts += 1
+
+        try:
+            # No-op while the session is alive, reconnects after a failure
+            connection.open()
+            connection.send_messages([message])
+        except Exception as error:
+            logger.warning("Could not send email #%s to %s: %s", email.pk, email.to_email, error)
+            email.last_error = str(error)
+            if email.attempts >= options["MAX_ATTEMPTS"]:
+                email.status = OutboundEmail.STATUS_FAILED
+            else:
+                email.status = OutboundEmail.STATUS_PENDING
+                email.next_attempt_at = timezone.now() + get_retry_delay(email.attempts)
+            failed += 1
+
+            # The session is most likely broken, the next message opens a new one
+            connection.close()
+        else:
+            email.status = OutboundEmail.STATUS_SENT
+            email.sent_at = timezone.now()
+            email.last_error = ""
+            sent += 1
+
+        email.save(update_fields=["status", "attempts", "next_attempt_at", "last_error", "sent_at"])
+
+    return sent, failed
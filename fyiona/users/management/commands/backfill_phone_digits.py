@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from users.search import backfill_phone_digits
+
+
+class Command(BaseCommand):
+    """Fills CustomUser.phone_number_digits of existing users for the phone search, safe to run more than once."""
+
+    help = "Backfills the phone number digits used by the users search"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=10000, help="Users updated per UPDATE")
+
+    def handle(self, *args, **options):
+        updated = backfill_phone_digits(options["batch_size"])
+        self.stdout.write(self.style.SUCCESS("Done. Updated users: %s" % updated))
@@ -0,0 +1,50 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from fyiona.images import needs_derivatives, update_derivatives
+
+
+# model label -> image field
+IMAGE_FIELDS = {
+    "users.UserProfile": "avatar",
+    "stories.StoryFile": "attachment",
+}
+
+
+class Command(BaseCommand):
+    """
+    Generates missing or outdated image derivatives (see fyiona.images) of rows saved before
+    the pipeline existed or whose background job was lost, e.g. by a restart.
+    """
+
+    help = "Backfills resized copies of avatars and story images"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--model", choices=sorted(IMAGE_FIELDS), help="Only this model")
+
+    def handle(self, *args, **options):
+        labels = [options["model"]] if options["model"] else sorted(IMAGE_FIELDS)
+
+        for label in labels:
+            try:
+                model = apps.get_model(label)
+            except LookupError:
+                if options["model"]:
+                    raise CommandError("%s is not installed" % label)
+                continue
+
+            field_name = IMAGE_FIELDS[label]
+            pending = [
+                (instance.pk, getattr(instance, field_name).name)
+                for instance in model.objects.only("pk", field_name, "derivatives").iterator(chunk_size=2000)
+                if needs_derivatives(instance, field_name)
+            ]
+
+            generated = 0
+            for pk, source in pending:
+                try:
+                    generated += update_derivatives(model, pk, field_name, source)
+                except Exception as error:
+                    self.stderr.write("%s %s: %s" % (label, pk, error))
+
+            self.stdout.write(self.style.SUCCESS("%s: generated derivatives of %s images" % (label, generated)))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importing import DEFAULT_CHUNK_SIZE, UserImporter, read_rows
+
+
+class Command(BaseCommand):
+    """
+    Provisions accounts from a legacy export without going through registration, see users.importing
+    for the columns. Example:
+        python manage.py import_users legacy_users.jsonl --chunk-size 10000
+    """
+
+    help = "Imports users from a CSV or JSONL file with bulk inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="CSV (with a header row) or JSONL file")
+        parser.add_argument("--format", choices=("csv", "jsonl"), help="Default: taken from the file extension")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per transaction")
+        parser.add_argument("--dry-run", action="store_true", help="Only validate the file")
+        parser.add_argument("--max-errors", type=int, default=20, help="Skipped rows printed at the end")
+
+    def handle(self, *args, **options):
+        def report(importer):
+            self.stdout.write(
+                "Imported: %s, skipped: %s, %.0f users/min" % (importer.imported, len(importer.errors), importer.rate)
+            )
+
+        importer = UserImporter(chunk_size=options["chunk_size"], dry_run=options["dry_run"], report=report)
+        try:
+            importer.run(read_rows(options["path"], options["format"]))
+        except (OSError, ValueError) as error:
+            raise CommandError(error)
+
+        for line_number, message in importer.errors[: options["max_errors"]]:
+            self.stderr.write("line %s: %s" % (line_number, message))
+        if len(importer.errors) > options["max_errors"]:
+            self.stderr.write("... %s more" % (len(importer.errors) - options["max_errors"]))
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Done%s. Imported %s users in %.1f s (%.0f users/min), skipped %s rows"
+                % (
+                    " (dry run)" if options["dry_run"] else "",
+                    importer.imported,
+                    importer.elapsed,
+                    importer.rate,
+                    len(importer.errors),
+                )
+            )
+        )
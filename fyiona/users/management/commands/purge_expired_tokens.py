@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from users.one_time_tokens import purge_expired_tokens
+from users.tokens import purge_refresh_tokens
+
+
+class Command(BaseCommand):
+    """
+    Deletes expired one time tokens (email links) and refresh tokens, meant to be run periodically by cron.
+    """
+
+    help = "Deletes expired one time and refresh tokens"
+
+    def handle(self, *args, **options):
+        one_time = purge_expired_tokens()
+        refresh = purge_refresh_tokens()
+        self.stdout.write(
+            self.style.SUCCESS("Done. Deleted one time tokens: %s, refresh tokens: %s" % (one_time, refresh))
+        )
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from users.follows import recount_follows
+
+
+class Command(BaseCommand):
+    """Backfills UserProfile.followers_count / following_count from users.models.Follow, safe to run more than once."""
+
+    help = "Recomputes follower and following counters of all profiles"
+
+    def handle(self, *args, **options):
+        updated = recount_follows()
+        self.stdout.write(self.style.SUCCESS("Counters recomputed for %s profiles" % updated))
@@ -0,0 +1,42 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from users.mailer import send_queued_emails
+
+
+class Command(BaseCommand):
+    """
+    Worker that delivers users.models.OutboundEmail rows.
+    The SMTP session is opened once and reused for every batch until the worker stops.
+
+    To try it locally start a debugging SMTP server that prints every message:
+        pip install aiosmtpd && python -m aiosmtpd -n -l localhost:1025
+    and run the worker with EMAIL_HOST=localhost EMAIL_PORT=1025 EMAIL_USE_TLS=False
+    """
+
+    help = "Sends queued emails in batches over a reused SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None, help="Emails per batch")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument("--once", action="store_true", help="Send one batch and exit")
+
+    def handle(self, *args, **options):
+        connection = get_connection()
+
+        try:
+            while True:
+                sent, failed = send_queued_emails(connection=connection, batch_size=options["batch_size"])
+                if sent or failed:
+                    self.stdout.write("Sent: %s, failed: %s" % (sent, failed))
+
+                if options["once"]:
+                    break
+                if not sent and not failed:
+                    time.sleep(options["interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            connection.close()
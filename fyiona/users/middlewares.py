@@ -1,8 +1,6 @@
-import jwt
-from django.conf import settings
 from rest_framework import authentication, exceptions
 
-from users.models import CustomUser, UserProfile
+from users.tokens import get_user, TokenError, ACCESS
 
 
 class JWTAuthentication(authentication.BaseAuthentication):
@@ -48,30 +46,10 @@ class JWTAuthentication(authentication.BaseAuthentication):
     def _authenticate_credentials(self, request, token):
         """Sub function that does the logic to check if recieved token is valid."""
         try:
-            payload = jwt.decode(token, settings.SECRET_KEY, algorithms="HS256")
-        except jwt.exceptions.DecodeError:
-            msg = {
-                "success": False,
-                "error": "Invalid authentication. Could not decode token.",
-            }
-            raise exceptions.AuthenticationFailed(msg)
-        except jwt.exceptions.ExpiredSignatureError:
-            raise exceptions.AuthenticationFailed(
-                {
-                    "success": False,
-                    "message": "Session has expired, please login again!",
-                }
-            )
-
-        try:
-            user = CustomUser.objects.get(id=payload["id"])
-
-        except CustomUser.DoesNotExist:
-            msg = {
-                "success": False,
-                "error": "No user matching this token was found...",
-            }
-            raise exceptions.AuthenticationFailed(msg)
+            user = get_user(token, ACCESS)
+        except TokenError as error:
+            key = "message" if error.expired else "error"
+            raise exceptions.AuthenticationFailed({"success": False, key: error.message})
 
         if not user.is_active:
             msg = {
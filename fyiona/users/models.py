@@ -1,18 +1,37 @@
+import re
 import uuid
-import secrets
-from datetime import datetime, timedelta
 
-import jwt
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from django.contrib.postgres.indexes import GinIndex
 from phonenumber_field.modelfields import PhoneNumberField
+from phonenumber_field.phonenumber import to_python as to_phone_number
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 
+from fyiona.storage import content_addressed_storage
 from . import managers
 
 
+def phone_digits(value) -> str:
+    """Leaves only digits: "+996 (550) 27-10-98" --> "996550271098"."""
+    return re.sub(r"\D", "", str(value or ""))
+
+
+def normalize_phone_number(value) -> str:
+    """
+    E.164 form, the one stored in CustomUser.phone_number: "+996 (550) 27-10-98" --> "+996550271098".
+    Empty for an empty value, raises ValueError for an invalid number.
+    """
+    if not str(value or "").strip():
+        return ""
+    phone_number = to_phone_number(str(value).strip())
+    if phone_number is None or not phone_number.is_valid():
+        raise ValueError("Invalid phone number %r" % value)
+    return phone_number.as_e164
+
+
 class CustomUser(AbstractBaseUser, PermissionsMixin):
     id = models.UUIDField(
         primary_key=True,
@@ -40,13 +59,20 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         verbose_name=_("Last Name"),
     )
 
+    # Unique among non empty numbers, see users_phone_number_unique
     phone_number = PhoneNumberField(
-        db_index=True,
-        # unique=True, TODO: [FYION-34] If the phone_number is unique then there are cannot be 2 users with empty phone numbers, otherwise, 2 users can have the same phone number
         blank=True,
         verbose_name=_("Phone Number"),
     )
 
+    phone_number_digits = models.CharField(
+        max_length=20,
+        blank=True,
+        editable=False,
+        verbose_name=_("Phone Number Digits"),
+        help_text=_("Digits of the phone number, kept in sync on save and used by search"),
+    )
+
     phone_number_confirmed = models.BooleanField(
         default=False,
         verbose_name=_("Phone Number confirmed"),
@@ -62,6 +88,14 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         verbose_name=_("Balance"),
     )
 
+    tokens_valid_after = models.DateTimeField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name=_("Tokens Valid After"),
+        help_text=_("Tokens issued before this moment are revoked, see users.tokens"),
+    )
+
     date_joined = models.DateField(verbose_name=_("Date Joined"), default=timezone.now)
     active = models.BooleanField(verbose_name=_("Is_Active"), default=True)
     staff = models.BooleanField(verbose_name=_("Is_Staff"), default=False)
@@ -79,6 +113,50 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
     class Meta:
         verbose_name = _("User")
         verbose_name_plural = _("Users")
+        constraints = [
+            # Many users have no phone number, so the blank one is left out of the index. Also serves
+            # the phone number login (users.backends.PhoneNumberBackend)
+            models.UniqueConstraint(
+                fields=["phone_number"],
+                condition=~models.Q(phone_number=""),
+                name="users_phone_number_unique",
+            ),
+        ]
+        indexes = [
+            # Supports keyset pagination of the users directory
+            models.Index(
+                fields=["-date_joined", "-id"],
+                name="users_date_joined_id_idx",
+            ),
+            # Trigram indexes used by users.search, require the pg_trgm extension
+            GinIndex(
+                fields=["email"],
+                opclasses=["gin_trgm_ops"],
+                name="users_email_trgm_idx",
+            ),
+            GinIndex(
+                fields=["first_name"],
+                opclasses=["gin_trgm_ops"],
+                name="users_first_name_trgm_idx",
+            ),
+            GinIndex(
+                fields=["last_name"],
+                opclasses=["gin_trgm_ops"],
+                name="users_last_name_trgm_idx",
+            ),
+            GinIndex(
+                fields=["phone_number_digits"],
+                opclasses=["gin_trgm_ops"],
+                name="users_phone_digits_trgm_idx",
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.phone_number_digits = phone_digits(self.phone_number)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "phone_number" in update_fields:
+            kwargs["update_fields"] = set(update_fields) | {"phone_number_digits"}
+        super().save(*args, **kwargs)
 
     def has_perm(self, perm, obj=None):
         return True
@@ -107,14 +185,9 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         """
         This private method is responsible for generating unique JWT every time this method called.
         """
-        dt = datetime.now() + timedelta(minutes=settings.TOKEN_LIFETIME)
-        token = jwt.encode(
-            {"id": f"{self.pk}", "exp": dt.utcfromtimestamp(dt.timestamp())},
-            settings.SECRET_KEY,
-            algorithm="HS256",
-        )
+        from .tokens import issue_token, ACCESS
 
-        return token
+        return issue_token(self, ACCESS)
 
     def __str__(self):
         return self.email
@@ -138,7 +211,10 @@ class UserProfile(models.Model):
     avatar = models.ImageField(
         verbose_name=_("User Profile Photo"),
         upload_to="accounts/profiles/",
+        storage=content_addressed_storage,
         default="default_profile_image.png",
+        # Looked up by name when a blob is requested, see fyiona.media.is_public
+        db_index=True,
     )
 
     biography = models.TextField(
@@ -151,8 +227,27 @@ class UserProfile(models.Model):
         default=False,
     )
 
+    # Legacy table, users.follows.move_legacy_follows moves its rows into Follow after every migrate
     followers = models.ManyToManyField('self', symmetrical=False, blank=True)
 
+    # Maintained by users.follows together with the Follow rows
+    followers_count = models.PositiveIntegerField(
+        verbose_name=_("Followers"),
+        default=0,
+    )
+    following_count = models.PositiveIntegerField(
+        verbose_name=_("Following"),
+        default=0,
+    )
+
+    # Resized copies of the avatar, see fyiona.images
+    derivatives = models.JSONField(
+        verbose_name=_("Avatar Derivatives"),
+        default=dict,
+        blank=True,
+        editable=False,
+    )
+
 
     class Meta:
         verbose_name = _("User Profile")
@@ -162,85 +257,243 @@ class UserProfile(models.Model):
         return "%s %s" % (self.user.first_name, self.user.last_name)
 
 
-class CustomUserEmailConfirmationToken(models.Model):
+class Follow(models.Model):
     """
-    This model has 2 fields:
-    user --> user email
-    token --> the confirmation token that was sent to the email
+    "follower" follows "profile". Written and deleted by users.follows only,
+    so the counters of UserProfile stay in sync.
     """
 
-    # def __init__(self, *args, **kwargs):
-    #     super(EmailConfirmationToken, self).__init__(*args, **kwargs)
+    profile = models.ForeignKey(
+        UserProfile,
+        on_delete=models.CASCADE,
+        related_name="follower_links",
+    )
+    follower = models.ForeignKey(
+        UserProfile,
+        on_delete=models.CASCADE,
+        related_name="following_links",
+    )
+    created_at = models.DateTimeField(
+        verbose_name=_("Followed At"),
+        default=timezone.now,
+    )
+
+    class Meta:
+        verbose_name = _("Follow")
+        verbose_name_plural = _("Follows")
+        constraints = [
+            models.UniqueConstraint(fields=["profile", "follower"], name="users_follow_unique"),
+            models.CheckConstraint(check=~models.Q(profile=models.F("follower")), name="users_follow_not_self"),
+        ]
+        indexes = [
+            # Followers and following lists, newest first
+            models.Index(fields=["profile", "-created_at", "-id"], name="users_follow_followers_idx"),
+            models.Index(fields=["follower", "-created_at", "-id"], name="users_follow_following_idx"),
+        ]
+
+    def __str__(self) -> str:
+        return "%s -> %s" % (self.follower_id, self.profile_id)
+
+
+class RefreshToken(models.Model):
+    """
+    Refresh token of one device, see users.tokens. Only the SHA-256 of the token is stored.
+    Every refresh uses the token up and issues the next one in the same family;
+    a used token coming back means it leaked and revokes the whole family.
+    """
 
     user = models.ForeignKey(
-        to=CustomUser,
+        CustomUser,
         on_delete=models.CASCADE,
-        related_name="confirmation_token",
+        related_name="refresh_tokens",
     )
-
-    token = models.CharField(
-        verbose_name=_("Confirmation Token"),
+    token_hash = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name=_("Token Hash"),
+    )
+    family = models.UUIDField(
+        db_index=True,
+        verbose_name=_("Family"),
+        help_text=_("Shared by all tokens rotated from one login"),
+    )
+    device = models.CharField(
         max_length=128,
-        default=secrets.token_hex(64)
+        blank=True,
+        verbose_name=_("Device"),
+    )
+    created_at = models.DateTimeField(
+        verbose_name=_("Created At"),
+        default=timezone.now,
+    )
+    expires_at = models.DateTimeField(
+        db_index=True,
+        verbose_name=_("Expires At"),
+    )
+    used_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Used At"),
+    )
+    revoked_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Revoked At"),
     )
 
     class Meta:
-        verbose_name = "Account Confirmation Token"
-        verbose_name_plural = "Account Confirmation Tokens"
+        verbose_name = _("Refresh Token")
+        verbose_name_plural = _("Refresh Tokens")
 
-    def __str__(self):
-        return self.token
+    def __str__(self) -> str:
+        return "%s %s" % (self.user_id, self.device or self.family)
 
 
-class AccessTokenToUpdateCustomUserFields(models.Model):
-    user = models.OneToOneField(
+class OneTimeToken(models.Model):
+    """
+    Single use token sent by email: registration confirmation, password reset, email change and
+    account deletion links. Only the SHA-256 of the token is stored, see users.one_time_tokens.
+    """
+
+    PURPOSE_EMAIL_CONFIRMATION = "email_confirmation"
+    PURPOSE_PASSWORD_RESET = "password_reset"
+    PURPOSE_EMAIL_CHANGE = "email_change"
+    PURPOSE_ACCOUNT_DELETION = "account_deletion"
+    PURPOSES = (
+        (PURPOSE_EMAIL_CONFIRMATION, "Email Confirmation"),
+        (PURPOSE_PASSWORD_RESET, "Password Reset"),
+        (PURPOSE_EMAIL_CHANGE, "Email Change"),
+        (PURPOSE_ACCOUNT_DELETION, "Account Deletion"),
+    )
+
+    user = models.ForeignKey(
         to=CustomUser,
         on_delete=models.CASCADE,
-        verbose_name=_("Client Email"),
+        related_name="one_time_tokens",
     )
 
-    token = models.CharField(
-        max_length=128,
-        default=secrets.token_hex(64),
-        verbose_name=_("Client Password Reset Token"),
+    purpose = models.CharField(
+        max_length=32,
+        choices=PURPOSES,
+        verbose_name=_("Purpose"),
+    )
+
+    digest = models.CharField(
+        max_length=64,
+        unique=True,
+        verbose_name=_("Token Digest"),
+    )
+
+    payload = models.CharField(
+        max_length=254,
+        blank=True,
+        verbose_name=_("Payload"),
+        help_text=_("Data confirmed by the token, e.g. the new email address"),
     )
 
-    date = models.DateTimeField(
-        verbose_name=_("Password Reset Token Lifetime"),
-        auto_now=True,
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Date Created"),
+    )
+
+    expires_at = models.DateTimeField(
         db_index=True,
+        verbose_name=_("Expires At"),
     )
 
     class Meta:
-        verbose_name = "Reset Password Token"
-        verbose_name_plural = "Reset Password Tokens"
+        verbose_name = "One Time Token"
+        verbose_name_plural = "One Time Tokens"
+        indexes = [
+            # A new token replaces the previous one of the same purpose
+            models.Index(fields=["user", "purpose"], name="users_one_time_token_user_idx"),
+        ]
 
     def __str__(self):
-        return self.token
+        return "%s: %s" % (self.user_id, self.purpose)
 
 
-class AccessTokenToDeleteCustomUser(models.Model):
-    user = models.OneToOneField(
-        to=CustomUser,
-        on_delete=models.CASCADE,
-        verbose_name=_("Account Email"),
+class OutboundEmail(models.Model):
+    """
+    Durable queue of outgoing emails.
+    Requests only insert a row here, the "send_queued_mail" management command delivers them
+    in batches over one reused SMTP connection and retries failures with exponential backoff.
+    """
+
+    STATUS_PENDING = "pending"
+    STATUS_SENDING = "sending"
+    STATUS_SENT = "sent"
+    STATUS_FAILED = "failed"
+    STATUSES = (
+        (STATUS_PENDING, "Pending"),
+        (STATUS_SENDING, "Sending"),
+        (STATUS_SENT, "Sent"),
+        (STATUS_FAILED, "Failed"),
     )
 
-    token = models.CharField(
-        max_length=128,
-        default=secrets.token_hex(64),
-        verbose_name=_("Delete Account Access Token"),
+    to_email = models.EmailField(
+        max_length=254,
+        verbose_name=_("Recipient"),
+    )
+
+    from_email = models.CharField(
+        max_length=255,
+        verbose_name=_("Sender"),
+    )
+
+    subject = models.CharField(
+        max_length=255,
+        verbose_name=_("Subject"),
+    )
+
+    body = models.TextField(
+        verbose_name=_("Body"),
+    )
+
+    status = models.CharField(
+        max_length=16,
+        choices=STATUSES,
+        default=STATUS_PENDING,
+        verbose_name=_("Status"),
     )
 
-    date = models.DateTimeField(
+    attempts = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name=_("Delivery Attempts"),
+    )
+
+    next_attempt_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name=_("Next Attempt"),
+    )
+
+    last_error = models.TextField(
+        blank=True,
+        verbose_name=_("Last Error"),
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
         verbose_name=_("Date Created"),
-        auto_now=True,
-        db_index=True,
+    )
+
+    sent_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Date Sent"),
     )
 
     class Meta:
-        verbose_name = "Reset Password Token"
-        verbose_name_plural = "Reset Password Tokens"
+        verbose_name = "Outbound Email"
+        verbose_name_plural = "Outbound Emails"
+        indexes = [
+            # The worker only ever looks for pending emails that are due and for expired leases
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=models.Q(status__in=["pending", "sending"]),
+                name="users_outbound_email_due_idx",
+            ),
+        ]
 
     def __str__(self):
-        return self.token
\ No newline at end of file
+        return "%s: %s (%s)" % (self.to_email, self.subject, self.status)
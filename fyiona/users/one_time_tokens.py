@@ -0,0 +1,71 @@
+"""
+Single use tokens of the links sent by email.
+
+The token is a random string returned once by create_token() and put into the link; the database
+keeps only its SHA-256 (OneTimeToken.digest, unique), so checking a link is one indexed lookup and a
+leaked table does not contain usable links. Every token expires after the lifetime of its purpose
+(settings.ONE_TIME_TOKEN_LIFETIMES, minutes) and a new token replaces the previous one of the same
+user and purpose. "manage.py purge_expired_tokens" deletes expired rows.
+"""
+
+import hashlib
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OneTimeToken
+
+
+def hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def create_token(user, purpose: str, payload: str = "") -> str:
+    """Returns the token for the link, only its digest is stored."""
+    token = secrets.token_urlsafe(32)
+    now = timezone.now()
+    with transaction.atomic():
+        OneTimeToken.objects.filter(user=user, purpose=purpose).delete()
+        OneTimeToken.objects.create(
+            user=user,
+            purpose=purpose,
+            digest=hash_token(token),
+            payload=payload,
+            created_at=now,
+            expires_at=now + timedelta(minutes=settings.ONE_TIME_TOKEN_LIFETIMES[purpose]),
+        )
+    return token
+
+
+def get_token(token: str, purpose: str):
+    """The valid OneTimeToken (with its user) or None, the token is not used up."""
+    if not token:
+        return None
+    return (
+        OneTimeToken.objects.select_related("user")
+        .filter(digest=hash_token(token), purpose=purpose, expires_at__gt=timezone.now())
+        .first()
+    )
+
+
+def consume_token(one_time_token: OneTimeToken) -> bool:
+    """False when a concurrent request has used the token first."""
+    deleted, _ = OneTimeToken.objects.filter(pk=one_time_token.pk).delete()
+    return bool(deleted)
+
+
+def use_token(token: str, purpose: str):
+    """The OneTimeToken if it was valid and is used up by this call, None otherwise."""
+    one_time_token = get_token(token, purpose)
+    if one_time_token is None or not consume_token(one_time_token):
+        return None
+    return one_time_token
+
+
+def purge_expired_tokens() -> int:
+    """Returns the number of deleted tokens."""
+    deleted, _ = OneTimeToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
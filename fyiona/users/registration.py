@@ -0,0 +1,33 @@
+"""
+Registration as one transactional unit: the user, its profile (users.signals.create_profile)
+and the confirmation token are written in a single atomic block. The confirmation email is queued
+only after the commit and delivered by the "send_queued_mail" worker, so the request does no SMTP work
+and a rolled back registration never emails anybody.
+"""
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import CustomUser, OneTimeToken
+from .one_time_tokens import create_token
+from .utilities import send_token_to_email
+
+
+def send_confirmation_email(user: CustomUser, token: str):
+    token_url = f"{settings.DOMAIN_NAME}/api/v1/accounts/registration/confirmation/{token}"
+    message_text = f"Follow the link below to confirm your Email address:\n{token_url}"
+
+    send_token_to_email(
+        user=user,
+        subject="Confirmation Email Token",
+        body=message_text,
+    )
+
+
+def register_user(**fields) -> CustomUser:
+    with transaction.atomic():
+        user = CustomUser.objects.create_user(**fields)
+        token = create_token(user, OneTimeToken.PURPOSE_EMAIL_CONFIRMATION)
+        transaction.on_commit(lambda: send_confirmation_email(user, token))
+
+    return user
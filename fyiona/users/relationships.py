@@ -0,0 +1,58 @@
+"""
+Relationship of the requesting user to a list of users, resolved in a constant number of queries
+(one per relationship) however long the list is:
+    following            - the viewer follows the user
+    followed_by          - the user follows the viewer
+    hidden_from_stories  - the user is in hidden_story_from of a live story of the viewer
+"""
+
+from django.apps import apps
+
+from .models import Follow
+
+
+def get_hidden_from_stories(viewer, user_ids) -> set:
+    if not apps.is_installed("stories"):
+        return set()
+    Story = apps.get_model("stories", "Story")
+    return set(
+        Story.objects.live().filter(author_id=viewer.pk, hidden_story_from__in=user_ids)
+        .values_list("hidden_story_from", flat=True)
+        .distinct()
+    )
+
+
+def get_relationships(viewer, user_ids) -> dict:
+    """Returns {user_id: {"following": bool, "followed_by": bool, "hidden_from_stories": bool}}."""
+    user_ids = list(set(user_ids))
+    if not user_ids or viewer is None or not viewer.is_authenticated:
+        return {}
+
+    following = set(
+        Follow.objects.filter(follower__user_id=viewer.pk, profile__user_id__in=user_ids).values_list(
+            "profile__user_id", flat=True
+        )
+    )
+    followed_by = set(
+        Follow.objects.filter(profile__user_id=viewer.pk, follower__user_id__in=user_ids).values_list(
+            "follower__user_id", flat=True
+        )
+    )
+    hidden = get_hidden_from_stories(viewer, user_ids)
+
+    return {
+        user_id: {
+            "following": user_id in following,
+            "followed_by": user_id in followed_by,
+            "hidden_from_stories": user_id in hidden,
+        }
+        for user_id in user_ids
+    }
+
+
+def get_relationship_context(request, user_ids) -> dict:
+    """Serializer context for views rendering CustomUserListSerializer nested in other rows."""
+    return {
+        "request": request,
+        "relationships": get_relationships(getattr(request, "user", None), user_ids),
+    }
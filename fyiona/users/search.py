@@ -0,0 +1,131 @@
+"""
+Users search engine.
+Every text column that takes part in the search is covered by a GIN index with "gin_trgm_ops" (see CustomUser.Meta),
+so all the filters below are answered from the index instead of a sequential scan:
+    * field ~* '^query'   --> prefix match
+    * field % 'query'     --> trigram similarity (typos, partial words)
+    * field LIKE '%digits%' --> phone number digits, only for queries that look like a phone number
+Results are ranked: prefix matches always go first, then the best trigram similarity among the fields.
+"""
+
+import re
+from typing import Iterable, Optional
+
+from django.db.models import F, Func, Q, Case, When, Value, FloatField
+from django.db.models.functions import Greatest
+from django.contrib.postgres.search import TrigramSimilarity
+
+from .models import CustomUser, phone_digits
+
+
+TEXT_FIELDS = ("email", "first_name", "last_name")
+PHONE_FIELD = "phone_number_digits"
+SEARCH_FIELDS = TEXT_FIELDS + (PHONE_FIELD,)
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 50
+MAX_OFFSET = 1000
+
+# Digits and the usual phone punctuation, "john2" is a name and not a phone number
+PHONE_QUERY_RE = re.compile(r"^\+?[\d\s().-]+$")
+MIN_PHONE_DIGITS = 3
+
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.split()).lower()
+
+
+def get_phone_query(query: str) -> str:
+    """Digits of a query that looks like a phone number, otherwise empty."""
+    if not PHONE_QUERY_RE.match(query):
+        return ""
+    digits = phone_digits(query)
+    return digits if len(digits) >= MIN_PHONE_DIGITS else ""
+
+
+def search_users(query: str, fields: Optional[Iterable[str]] = None):
+    """
+    Returns a ranked QuerySet of users matching the query.
+    fields - restricts the search to some of SEARCH_FIELDS, all of them are used by default.
+    """
+    query = normalize_query(query)
+    fields = tuple(fields or SEARCH_FIELDS)
+
+    condition = Q()
+    prefix = Q()
+    similarities = []
+
+    for field in fields:
+        if field == PHONE_FIELD:
+            digits = get_phone_query(query)
+            if not digits:
+                continue
+            condition |= Q(**{"%s__contains" % field: digits})
+            prefix |= Q(**{"%s__startswith" % field: digits})
+        else:
+            condition |= Q(**{"%s__iregex" % field: "^" + re.escape(query)})
+            condition |= Q(**{"%s__trigram_similar" % field: query})
+            prefix |= Q(**{"%s__iregex" % field: "^" + re.escape(query)})
+            similarities.append(TrigramSimilarity(field, query))
+
+    if not condition:
+        return CustomUser.objects.none()
+
+    if not similarities:
+        similarity = Value(0.0, output_field=FloatField())
+    elif len(similarities) == 1:
+        similarity = similarities[0]
+    else:
+        similarity = Greatest(*similarities)
+
+    return (
+        CustomUser.objects.select_related("user_profile")
+        .filter(condition)
+        .annotate(
+            prefix_rank=Case(
+                When(prefix, then=Value(1.0)),
+                default=Value(0.0),
+                output_field=FloatField(),
+            ),
+            similarity_rank=similarity,
+        )
+        .order_by("-prefix_rank", "-similarity_rank", "id")
+    )
+
+
+def paginate_search(queryset, limit=None, offset=None):
+    """
+    Slices ranked results. Ranked results can not be keyset paginated, so the depth is capped instead.
+    Returns (users, next_offset), next_offset is None on the last page.
+    """
+    try:
+        limit = min(max(int(limit), 1), MAX_LIMIT)
+    except (TypeError, ValueError):
+        limit = DEFAULT_LIMIT
+    try:
+        offset = min(max(int(offset), 0), MAX_OFFSET)
+    except (TypeError, ValueError):
+        offset = 0
+
+    users = list(queryset[offset : offset + limit + 1])
+    if len(users) > limit and offset + limit <= MAX_OFFSET:
+        return users[:limit], offset + limit
+    return users[:limit], None
+
+
+def backfill_phone_digits(batch_size: int = 10000) -> int:
+    """
+    Fills phone_number_digits of users saved before the column existed, it is only kept in sync by
+    CustomUser.save(). Batches of "batch_size" rows keep the UPDATEs short, returns the number of updated users.
+    """
+    digits = Func(F("phone_number"), Value(r"\D"), Value(""), Value("g"), function="REGEXP_REPLACE")
+    pending = CustomUser.objects.filter(phone_number_digits="").exclude(phone_number="").order_by("id")
+    updated = 0
+    last_id = None
+    while True:
+        batch = pending if last_id is None else pending.filter(id__gt=last_id)
+        ids = list(batch.values_list("id", flat=True)[:batch_size])
+        if not ids:
+            return updated
+        updated += CustomUser.objects.filter(id__in=ids).update(phone_number_digits=digits)
+        last_id = ids[-1]
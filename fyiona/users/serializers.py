@@ -1,24 +1,31 @@
-import datetime as dt
-
 from django.contrib.auth import authenticate
 from django.contrib.auth.hashers import make_password
 from django.utils.translation import gettext_lazy as _
+from django.db import transaction
+from django.db.models import Manager
 
 from rest_framework.serializers import (
     ModelSerializer,
     CharField,
     Serializer,
     ValidationError,
-    UUIDField,
-    FileField
+    FileField,
+    SerializerMethodField,
+    DateTimeField,
+    ListSerializer,
 )
 
+from fyiona.images import get_derivative_urls
+from .relationships import get_relationships
+from .registration import register_user
+from .tokens import rotate_refresh_token, TokenError
+
 from .signals import change_email_signal
 from .models import (
+    Follow,
     UserProfile,
     CustomUser,
-    CustomUserEmailConfirmationToken,
-    AccessTokenToUpdateCustomUserFields
+    normalize_phone_number,
 )
 
 ####################################################################################################
@@ -31,14 +38,22 @@ from .models import (
 class UserProfileSerializer(ModelSerializer):
     """Serializer for list all UserProfiles from DB"""
 
+    avatar_derivatives = SerializerMethodField()
+
     class Meta:
         model = UserProfile
         fields = (
             "avatar",
+            "avatar_derivatives",
             "biography",
             "business_account",
+            "followers_count",
+            "following_count",
         )
 
+    def get_avatar_derivatives(self, profile: UserProfile) -> dict:
+        return get_derivative_urls(profile, "avatar", self.context.get("request"))
+
 
 ####################################################################################################
 ####################################### CustomUser #################################################
@@ -61,19 +76,56 @@ class CustomUserDetailSerializer(ModelSerializer):
         read_only_fields = ("id",)
 
 
+class RelationshipListSerializer(ListSerializer):
+    """Resolves the relationships of the whole page at once and shares them with the rows via context."""
+
+    def to_representation(self, data):
+        users = list(data.all() if isinstance(data, Manager) else data)
+        request = self.context.get("request")
+        self.context["relationships"] = get_relationships(
+            getattr(request, "user", None), [user.pk for user in users]
+        )
+        return super().to_representation(users)
+
+
 class CustomUserListSerializer(ModelSerializer):
     user_profile = UserProfileSerializer(read_only=True)
+    relationship = SerializerMethodField()
+
     class Meta:
         model = CustomUser
+        list_serializer_class = RelationshipListSerializer
         fields = (
             "user_profile",
             "email",
             "first_name",
             "last_name",
             "phone_number",
-            "token_balance"
+            "token_balance",
+            "relationship",
         )
 
+    def get_relationship(self, user: CustomUser):
+        """None when the view did not resolve relationships (see users.relationships)."""
+        return self.context.get("relationships", {}).get(user.pk)
+
+
+
+class FollowerSerializer(ModelSerializer):
+    """A row of a followers list."""
+
+    user = CustomUserListSerializer(source="follower.user", read_only=True)
+    followed_at = DateTimeField(source="created_at", read_only=True)
+
+    class Meta:
+        model = Follow
+        fields = ("user", "followed_at")
+
+
+class FollowingSerializer(FollowerSerializer):
+    """A row of a following list."""
+
+    user = CustomUserListSerializer(source="profile.user", read_only=True)
 
 
 class CustomUserCreateSerializer(ModelSerializer):
@@ -81,8 +133,17 @@ class CustomUserCreateSerializer(ModelSerializer):
     Serializer made of UserProfile model and responsible for UserProfile creation.
     """
 
+    def validate_phone_number(self, value):
+        try:
+            phone_number = normalize_phone_number(value)
+        except ValueError:
+            raise ValidationError("Enter a valid phone number.")
+        if phone_number and CustomUser.objects.filter(phone_number=phone_number).exists():
+            raise ValidationError("This phone number is already registered.")
+        return phone_number
+
     def create(self, validated_data):
-        return CustomUser.objects.create_user(**validated_data)
+        return register_user(**validated_data)
 
 
     class Meta:
@@ -121,13 +182,15 @@ class CustomUserUpdateSerializer(ModelSerializer):
             "last_name",
             instance.last_name,
         )
-        instance.user_profile.avatar = validated_data.get(
-            "avatar", instance.user_profile.avatar
-        )
-        instance.user_profile.biography = validated_data.get(
-            "biography", instance.user_profile.biography
-        )
-        instance.save()
+        profile_fields = [field for field in ("avatar", "biography") if field in validated_data]
+        for field in profile_fields:
+            setattr(instance.user_profile, field, validated_data[field])
+
+        with transaction.atomic():
+            instance.save()
+            # Only the changed columns, a full save would overwrite the follow counters
+            if profile_fields:
+                instance.user_profile.save(update_fields=profile_fields)
 
         return instance
 
@@ -143,7 +206,9 @@ class CustomUserUpdateSerializer(ModelSerializer):
 
 
 class CustomUserResetPasswordSerializer(ModelSerializer):
-    id = UUIDField()
+    """
+    Sets the new password, the reset token is checked and used up by CustomUserResetPasswordAPIView.
+    """
     password = CharField(min_length=8, write_only=True)
 
 
@@ -151,31 +216,8 @@ class CustomUserResetPasswordSerializer(ModelSerializer):
         """
             Make sure this method return instance and nothing except that!
         """
-        token = AccessTokenToUpdateCustomUserFields.objects.filter(user=instance).first()
-
-        if not token:
-            raise ValidationError(
-                detail={
-                    "success": False,
-                    "result": f"Access token for {instance.email} does not exist!",
-                }
-            )
-
-
-        token_created = dt.datetime.now().minute - token.date.minute
-        
-        if token_created > 10:
-            token.delete()
-            raise ValidationError(
-                detail={
-                    "success": False,
-                    "result": f"Access token for {instance.email} has expired!",
-                }
-            )
-        password = validated_data.get("password")
-        instance.set_password(password)
-        instance.save()
-        token.delete()
+        instance.set_password(validated_data.get("password"))
+        instance.save(update_fields=["password"])
 
         return instance
 
@@ -183,10 +225,8 @@ class CustomUserResetPasswordSerializer(ModelSerializer):
     class Meta:
         model = CustomUser
         fields = (
-            "id",
-            "password"
+            "password",
         )
-        read_only_fields = ("id",)
         extra_kwargs = {'password': {'write_only': True}}
 
 
@@ -259,17 +299,17 @@ class LoginSerializer(Serializer):
     )
 
     def validate(self, data):
-        username = data.get("email", data.get("phone_number", None))
+        email = data.get("email")
+        phone_number = data.get("phone_number")
         password = data.get("password")
-        if not username:
-            username = UserProfile.objects.get(
-                phone_number=data.get('phone_number', None)).email
-
-        if username and password:
-            user = authenticate(
-                username=username,
-                password=password,
-            )
+        request = self.context.get("request")
+
+        if (email or phone_number) and password:
+            if email:
+                user = authenticate(request, username=email, password=password)
+            else:
+                # users.backends.PhoneNumberBackend
+                user = authenticate(request, phone_number=phone_number, password=password)
             if not user:
                 msg = "Wrong username or password..."
                 raise ValidationError(
@@ -297,6 +337,41 @@ class LoginSerializer(Serializer):
         }
 
 
+class TokenRefreshSerializer(Serializer):
+    """
+    Exchanges a refresh token for a new access token and the next refresh token,
+    the password is not checked again.
+    """
+    refresh_token = CharField(max_length=100, write_only=True)
+
+    def validate(self, data):
+        try:
+            user, refresh_token = rotate_refresh_token(data["refresh_token"])
+        except TokenError as error:
+            raise ValidationError(
+                {
+                    "success": False,
+                    "result": error.message,
+                }
+            )
+
+        if not user.is_active:
+            raise ValidationError(
+                {
+                    "success": False,
+                    "result": "User has been deactivated",
+                }
+            )
+
+        return {
+            "success": True,
+            "result": {
+                "token": user.token,
+                "refresh_token": refresh_token,
+            },
+        }
+
+
 class LoginAfterRegistrationSerializer(Serializer):
     """
     Serializer for user authorization immediately after registration.
@@ -370,9 +445,6 @@ class EmailConfirmationSerializer(Serializer):
             )
         return instance
 
-    class Meta:
-        model = CustomUserEmailConfirmationToken
-
     confirmation_code = CharField(max_length=5, write_only=True)
 
     def confirmate(self, data):
@@ -381,7 +453,6 @@ class EmailConfirmationSerializer(Serializer):
         if code is None:
             raise ValidationError("Confirmation code field is empty.")
 
-        db_code = CustomUserEmailConfirmationToken.objects.get(user=data.user.username)
         db_code = code.get("code", "000000")
 
         if code != db_code:
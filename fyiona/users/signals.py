@@ -1,21 +1,53 @@
-import string
-import random
-import smtplib
-import datetime
-from email.mime.text import MIMEText
-
-
 from django.conf import settings
+from django.db import connections, transaction
 from django.dispatch import receiver, Signal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_migrate, post_migrate
 from django_rest_passwordreset.signals import reset_password_token_created
 
+from fyiona.images import schedule_derivatives
+
+from .cache import user_cache
 from .utilities import send_token_to_email
-from .models import UserProfile, AccessTokenToUpdateCustomUserFields, CustomUser, CustomUserEmailConfirmationToken
+from .one_time_tokens import create_token
+from .models import UserProfile, OneTimeToken, CustomUser
 
 
 login_signal = Signal()
 change_email_signal = Signal()
+# Sent by users.follows.unfollow with "follower" and "profile" (UserProfile)
+follow_removed = Signal()
+
+
+####################################################################################################
+########################################### DATABASE ###############################################
+####################################################################################################
+@receiver(pre_migrate)
+def create_trigram_extension(sender, using="default", **kwargs):
+    """Trigram indexes of CustomUser (see users.search) need the pg_trgm extension before the tables are migrated."""
+    if sender.label != "users":
+        return
+
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+
+@receiver(post_migrate)
+def move_legacy_followers(sender, **kwargs):
+    """UserProfile.followers was a plain many-to-many table before Follow, its leftover rows are moved once."""
+    if sender.label != "users":
+        return
+
+    # users.follows imports the signals of this module
+    from .follows import move_legacy_follows
+
+    move_legacy_follows()
+
+####################################################################################################
+####################################################################################################
+####################################################################################################
+
 
 
 ####################################################################################################
@@ -23,23 +55,29 @@ change_email_signal = Signal()
 ####################################################################################################
 @receiver(post_save, sender=CustomUser)
 def create_profile(sender, instance, created, **kwargs):
+    """
+    Every user has a profile, created in the transaction of the user.
+    The confirmation email of the registration is sent by users.registration.
+    """
     if created:
         UserProfile.objects.create(user=instance)
 
-        token = CustomUserEmailConfirmationToken.objects.create(user=instance)
-        token_url = f"{settings.DOMAIN_NAME}/api/v1/accounts/registration/confirmation/{token}"
-        message_text = f"Follow the link below to confirm your Email address:\n{token_url}"
 
-        send_token_to_email(
-            user=instance, 
-            subject="Confirmation Email Token",
-            body=message_text
-        )
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """
+    Drops the cached user right away and once more after commit,
+    so a concurrent request can not put the old row back into the cache.
+    """
+    user_id = instance.pk
+    user_cache.invalidate(user_id)
+    transaction.on_commit(lambda: user_cache.invalidate(user_id))
 
 
-@receiver(post_save, sender=CustomUser)
-def save_profile(sender, instance, **kwargs):
-    instance.user_profile.save()
+@receiver(post_save, sender=UserProfile)
+def generate_avatar_derivatives(sender, instance, **kwargs):
+    schedule_derivatives(instance, "avatar")
 
 ####################################################################################################
 ####################################################################################################
@@ -57,94 +95,23 @@ def password_reset_token_created(
 ):
     """
     Signal for send token on email after password reset.
-    First, it tries to retrieve the token from the database,
-    if the token does not exist or its age is more than 1 hour,
-    then it generates a new token.
+    A new one time token replaces the previous one of the user, see users.one_time_tokens.
     """
-    
-    user_password_reset_token = None
-    try:
-        user_password_reset_token = AccessTokenToUpdateCustomUserFields.objects.get(
-            user=reset_password_token.user.email
-        )
-    except:
-        pass
-    characters = string.ascii_letters + string.digits
-    if user_password_reset_token:
-        age = datetime.datetime.now().replace(
-            tzinfo=None
-        ) - user_password_reset_token.date.replace(tzinfo=None)
-        if bool(age.seconds // 3600):
-            delete_password_reset_token = AccessTokenToUpdateCustomUserFields.objects.get(
-                user=reset_password_token.user.email
-            )
-            delete_password_reset_token.delete()
-            random_token = "".join(random.choice(characters) for i in range(120))
-            save_password_reset_token = AccessTokenToUpdateCustomUserFields(
-                user=reset_password_token.user.email, token=random_token
-            )
-            save_password_reset_token.save()
-
-    else:
-        random_token = "".join(random.choice(characters) for i in range(120))
-        save_password_reset_token = AccessTokenToUpdateCustomUserFields(
-            user=reset_password_token.user.email, token=random_token
-        )
-        save_password_reset_token.save()
-
-    user_password_reset_token = None
-
-    try:
-        user_password_reset_token = AccessTokenToUpdateCustomUserFields.objects.get(
-            user=reset_password_token.user.email
-        )
-    except:
-        pass
-
-    characters = string.ascii_letters + string.digits
-
-    if user_password_reset_token:
-        age = datetime.datetime.now().replace(
-            tzinfo=None
-        ) - user_password_reset_token.date.replace(tzinfo=None)
-
-        if bool(age.seconds // 3600):
-            delete_password_reset_token = AccessTokenToUpdateCustomUserFields.objects.get(
-                user=reset_password_token.user.email
-            )
-
-            delete_password_reset_token.delete()
-            random_token = "".join(random.choice(characters) for i in range(120))
-            save_password_reset_token = AccessTokenToUpdateCustomUserFields(
-                user=reset_password_token.user.email, token=random_token
-            )
-            save_password_reset_token.save()
-
-    else:
-        random_token = "".join(random.choice(characters) for i in range(120))
-        save_password_reset_token = AccessTokenToUpdateCustomUserFields(
-            user=reset_password_token.user.email, token=random_token
-        )
-        save_password_reset_token.save()
-
-    email_plaintext_message = "%s/api/v1/accounts/password_reset/confirmation/%s" % (
+    user = reset_password_token.user
+    token = create_token(user, OneTimeToken.PURPOSE_PASSWORD_RESET)
+
+    email_plaintext_message = "%s/api/v1/accounts/password/reset/confirmation?token=%s" % (
         settings.DOMAIN_NAME,
-        AccessTokenToUpdateCustomUserFields.objects.get(user=reset_password_token.user.email).token,
+        token,
     )
 
-    msg = MIMEText(
-        "Please follow the link to reset your password.\nThis link is active for 1 hour only!\n\n%s"
+    send_token_to_email(
+        user=user,
+        subject="Reset Password Request",
+        body="Please follow the link to reset your password.\nThis link is active for 1 hour only!\n\n%s"
         % email_plaintext_message,
-        _charset="UTF-8",
+        email=user.email,
     )
-    server = smtplib.SMTP("smtp.gmail.com")
-    server.starttls()
-    server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-    msg["Subject"] = "Reset Password Request"
-    msg["From"] = settings.DEFAULT_FROM_EMAIL
-    msg["To"] = reset_password_token.user.email
-    server.sendmail(msg.get("From"), msg["To"], msg.as_string())
-    server.quit()
 
 ####################################################################################################
 ####################################################################################################
@@ -160,64 +127,22 @@ def password_reset_token_created(
 def send_email_for_change_email(data, instance, *args, **kwargs):
     """
     A signal to send an email with a URL to a new email if the user wants to change the email address.
-    I have nothing more to add, but there should be 2 sentences, so I wrote this.
+    The new address is kept in the payload of the one time token until the link is followed.
     """
+    token = create_token(instance, OneTimeToken.PURPOSE_EMAIL_CHANGE, payload=data.get("email"))
 
-    user_email_confirmation_token = None
-    try:
-        user_email_confirmation_token = AccessTokenToUpdateCustomUserFields.objects.get(user=instance.email)
-    except:
-        pass
-
-    characters = string.ascii_letters + string.digits
-
-    if user_email_confirmation_token:
-        age = datetime.datetime.now().replace(
-            tzinfo=None
-        ) - user_email_confirmation_token.date.replace(tzinfo=None)
-
-        if bool(age.seconds // 3600):
-            delete_email_token = AccessTokenToUpdateCustomUserFields.objects.get(user=instance.email)
-            delete_email_token.delete()
-            random_token = (
-                "".join(random.choice(characters) for i in range(120))
-                + "~"
-                + data.get("email")
-            )
-
-            save_email_confirmation_token = AccessTokenToUpdateCustomUserFields(
-                user=instance.email, token=random_token
-            )
-            save_email_confirmation_token.save()
-    else:
-        random_token = (
-            "".join(random.choice(characters) for i in range(120))
-            + "~"
-            + data.get("email")
-        )
-        save_email_confirmation_token = AccessTokenToUpdateCustomUserFields(
-            user=instance.email, token=random_token
-        )
-        save_email_confirmation_token.save()
-
-    email_plaintext_message = "%s/api/v1/users/email_reset/confirmation/%s" % (
+    email_plaintext_message = "%s/api/v1/accounts/email_reset/confirmation/%s/" % (
         settings.DOMAIN_NAME,
-        AccessTokenToUpdateCustomUserFields.objects.get(user=instance.email).token,
+        token,
     )
 
-    msg = MIMEText(
-        "Please follow the link to reset your email.\nThis link is active for 1 hour only!\n\n%s"
+    send_token_to_email(
+        user=instance,
+        subject="Confirmation New Email",
+        body="Please follow the link to reset your email.\nThis link is active for 1 hour only!\n\n%s"
         % email_plaintext_message,
-        _charset="UTF-8",
+        email=data.get("email"),
     )
-    server = smtplib.SMTP("smtp.gmail.com")
-    server.starttls()
-    server.login(settings.EMAIL_HOST_USER, settings.EMAIL_HOST_PASSWORD)
-    msg["Subject"] = "Confirmation New Email"
-    msg["From"] = settings.DEFAULT_FROM_EMAIL
-    msg["To"] = data.get("email")
-    server.sendmail(msg.get("From"), msg["To"], msg.as_string())
-    server.quit()
 
 ####################################################################################################
 ####################################################################################################
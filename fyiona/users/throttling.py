@@ -0,0 +1,231 @@
+"""
+Throttling of the endpoints that hash passwords or send emails, checked by DRF before the view
+(and the password hash) runs.
+
+Every scope has a rate in settings.THROTTLING["RATES"], e.g. "5/min". Requests are counted with
+a sliding window counter: the counts of the current and the previous fixed window, the previous one
+weighted by how much of it still overlaps the sliding window. Two integers per key, no timestamps.
+
+Counters are kept per process (LocalCounterBackend) unless THROTTLING["CACHE_ALIAS"] names a CACHES
+entry shared by all processes (e.g. redis).
+"""
+
+import time
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.throttling import BaseThrottle
+
+from .models import phone_digits
+
+
+DEFAULT_SETTINGS = {
+    "CACHE_ALIAS": None,
+    "MAX_KEYS": 100000,
+    "KEY_PREFIX": "users:throttle:",
+    "RATES": {},
+}
+
+PERIODS = {"s": 1, "sec": 1, "m": 60, "min": 60, "h": 3600, "hour": 3600, "d": 86400, "day": 86400}
+
+
+def get_settings() -> dict:
+    return {**DEFAULT_SETTINGS, **getattr(settings, "THROTTLING", {})}
+
+
+def parse_rate(rate: str):
+    """ "5/min" --> (5, 60)"""
+    count, period = rate.split("/")
+    return int(count), PERIODS[period]
+
+
+class RequestThrottled(APIException):
+    status_code = status.HTTP_429_TOO_MANY_REQUESTS
+    default_code = "throttled"
+
+    def __init__(self, wait: float):
+        # DRF's exception handler turns "wait" into a Retry-After header
+        self.wait = wait
+        super().__init__(
+            detail={
+                "success": False,
+                "result": "Too many attempts, try again in %d seconds" % wait,
+            }
+        )
+
+
+class LocalCounterBackend:
+    """Per process counters {key: (window number, count, count of the previous window)}, LRU bounded."""
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str, window: int):
+        with self._lock:
+            number, count, previous = self._data.get(key, (window, 0, 0))
+            return self._shift(number, count, previous, window)
+
+    def incr(self, key: str, window: int, window_length: int):
+        with self._lock:
+            number, count, previous = self._data.get(key, (window, 0, 0))
+            count, previous = self._shift(number, count, previous, window)
+            self._data[key] = (window, count + 1, previous)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+
+    @staticmethod
+    def _shift(number: int, count: int, previous: int, window: int):
+        if number == window:
+            return count, previous
+        if number == window - 1:
+            return 0, count
+        return 0, 0
+
+
+class CacheCounterBackend:
+    """One cache key per window, shared by every process using the cache."""
+
+    def __init__(self, alias: str, prefix: str):
+        self.cache = caches[alias]
+        self.prefix = prefix
+
+    def _key(self, key: str, window: int) -> str:
+        return "%s%s:%s" % (self.prefix, key, window)
+
+    def get(self, key: str, window: int):
+        current, previous = self._key(key, window), self._key(key, window - 1)
+        values = self.cache.get_many([current, previous])
+        return values.get(current, 0), values.get(previous, 0)
+
+    def incr(self, key: str, window: int, window_length: int):
+        current = self._key(key, window)
+        # Kept until it stops being the previous window
+        self.cache.add(current, 0, timeout=window_length * 2)
+        try:
+            self.cache.incr(current)
+        except ValueError:
+            # Expired between add() and incr()
+            self.cache.set(current, 1, timeout=window_length * 2)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                options = get_settings()
+                if options["CACHE_ALIAS"]:
+                    _backend = CacheCounterBackend(options["CACHE_ALIAS"], options["KEY_PREFIX"])
+                else:
+                    _backend = LocalCounterBackend(options["MAX_KEYS"])
+    return _backend
+
+
+class SlidingWindowThrottle(BaseThrottle, ABC):
+    """
+    Subclasses set "scope" and return the identifiers to count in get_idents(),
+    a request is rejected when any of them is over the rate.
+    """
+
+    scope = None
+    timer = time.time
+
+    def __init__(self):
+        self.limit, self.window_length = parse_rate(get_settings()["RATES"][self.scope])
+        self.backend = get_backend()
+        self.retry_after = None
+
+    @abstractmethod
+    def get_idents(self, request) -> list:
+        pass
+
+    def allow_request(self, request, view) -> bool:
+        idents = [ident for ident in self.get_idents(request) if ident]
+        if not idents:
+            return True
+
+        now = self.timer()
+        window, elapsed = divmod(now, self.window_length)
+        window = int(window)
+        # Share of the previous window still inside the sliding one
+        overlap = 1 - elapsed / self.window_length
+
+        keys = ["%s:%s" % (self.scope, ident) for ident in idents]
+        for key in keys:
+            count, previous = self.backend.get(key, window)
+            if count + previous * overlap >= self.limit:
+                self.retry_after = self.window_length - elapsed
+                return False
+
+        for key in keys:
+            self.backend.incr(key, window, self.window_length)
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+
+class IPThrottle(SlidingWindowThrottle):
+    def get_idents(self, request) -> list:
+        # Honors NUM_PROXIES of REST_FRAMEWORK for X-Forwarded-For
+        return [self.get_ident(request)]
+
+
+class AccountThrottle(SlidingWindowThrottle):
+    """Counts attempts against the account named in the body, however many IPs they come from."""
+
+    def get_idents(self, request) -> list:
+        try:
+            data = request.data
+        except Exception:
+            # Unparsable bodies are rejected by the view
+            return []
+        if not hasattr(data, "get"):
+            return []
+
+        email = str(data.get("email") or "").strip().lower()
+        if email:
+            return ["email:%s" % email]
+        digits = phone_digits(data.get("phone_number"))
+        if digits:
+            return ["phone:%s" % digits]
+        return []
+
+
+class LoginIPThrottle(IPThrottle):
+    scope = "login"
+
+
+class LoginAccountThrottle(AccountThrottle):
+    scope = "login_account"
+
+
+class PasswordResetIPThrottle(IPThrottle):
+    scope = "password_reset"
+
+
+class PasswordResetAccountThrottle(AccountThrottle):
+    scope = "password_reset_account"
+
+
+class RegistrationIPThrottle(IPThrottle):
+    scope = "registration"
+
+
+class ThrottledMixin:
+    """Answers throttled requests with the {"success": False, "result": ...} body of the API."""
+
+    def throttled(self, request, wait):
+        raise RequestThrottled(wait or 0)
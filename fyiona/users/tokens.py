@@ -0,0 +1,181 @@
+"""
+Short lived stateless JWT access tokens and long lived refresh tokens stored in the database.
+
+Signing keys are looked up by the "kid" header in settings.JWT_SIGNING_KEYS, new tokens are signed
+with settings.JWT_ACTIVE_KID. To rotate a key: add the new one, make it active, and remove the old one
+once ACCESS_TOKEN_LIFETIME has passed.
+
+Revocation is a per user watermark, CustomUser.tokens_valid_after: tokens issued before it are rejected.
+The watermark travels with the cached user (users.cache), so checking it costs nothing per request.
+Other processes see a new watermark once their local copy expires (USER_CACHE["TTL"] seconds).
+
+Refresh tokens are random strings, only their SHA-256 is stored (RefreshToken). A refresh costs one
+indexed lookup instead of a password hash: the token is used up and the next one of the same family
+(one login on one device) is issued. A used token presented again revokes the family.
+"""
+
+import time
+import uuid
+import hashlib
+import secrets
+from datetime import timedelta
+
+import jwt
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import user_cache
+from .models import CustomUser, RefreshToken
+
+
+ALGORITHM = "HS256"
+ACCESS = "access"
+
+
+class TokenError(Exception):
+    def __init__(self, message: str, expired: bool = False):
+        super().__init__(message)
+        self.message = message
+        self.expired = expired
+
+
+def get_signing_key(kid: str) -> str:
+    try:
+        return settings.JWT_SIGNING_KEYS[kid]
+    except KeyError:
+        raise TokenError("Invalid authentication. Unknown signing key.")
+
+
+def issue_token(user, token_type: str = ACCESS) -> str:
+    kid = settings.JWT_ACTIVE_KID
+    # Sub-second "iat", a token issued right after a logout must not fall before the watermark
+    issued_at = time.time()
+    payload = {
+        "id": str(user.pk),
+        "type": token_type,
+        "jti": uuid.uuid4().hex,
+        "iat": issued_at,
+        "exp": int(issued_at) + settings.ACCESS_TOKEN_LIFETIME * 60,
+    }
+    return jwt.encode(payload, get_signing_key(kid), algorithm=ALGORITHM, headers={"kid": kid})
+
+
+def decode_token(token: str, token_type: str = ACCESS) -> dict:
+    try:
+        header = jwt.get_unverified_header(token)
+    except jwt.exceptions.DecodeError:
+        raise TokenError("Invalid authentication. Could not decode token.")
+
+    kid = header.get("kid")
+    if kid is None:
+        # Issued before key ids, signed with SECRET_KEY and valid until it expires
+        key = settings.SECRET_KEY
+    else:
+        key = get_signing_key(kid)
+
+    try:
+        payload = jwt.decode(token, key, algorithms=[ALGORITHM])
+    except jwt.exceptions.ExpiredSignatureError:
+        raise TokenError("Session has expired, please login again!", expired=True)
+    except jwt.exceptions.InvalidTokenError:
+        raise TokenError("Invalid authentication. Could not decode token.")
+
+    # Tokens without "type" predate it and are access tokens
+    if payload.get("type", ACCESS) != token_type or "id" not in payload:
+        raise TokenError("Invalid authentication. Wrong token type.")
+    return payload
+
+
+def is_revoked(user, payload: dict) -> bool:
+    valid_after = user.tokens_valid_after
+    if valid_after is None:
+        return False
+    # Tokens without "iat" predate the watermark
+    return payload.get("iat", 0) < valid_after.timestamp()
+
+
+def get_user(token: str, token_type: str = ACCESS):
+    """Returns the (cached) user of a valid token, raises TokenError."""
+    payload = decode_token(token, token_type)
+    try:
+        user = user_cache.get_user(payload["id"])
+    except (CustomUser.DoesNotExist, ValueError):
+        raise TokenError("No user matching this token was found...")
+
+    if is_revoked(user, payload):
+        raise TokenError("Session has been closed, please login again!", expired=True)
+    return user
+
+
+def revoke_tokens(user):
+    """Every token of the user issued until now stops working, e.g. "log out everywhere"."""
+    now = timezone.now()
+    with transaction.atomic():
+        user.tokens_valid_after = now
+        # post_save drops the cached copy (users.signals.invalidate_cached_user)
+        user.save(update_fields=["tokens_valid_after"])
+        RefreshToken.objects.filter(user=user, revoked_at__isnull=True).update(revoked_at=now)
+
+
+def hash_refresh_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_refresh_token(user, device: str = "", family=None) -> str:
+    """Starts a new family (a login) unless "family" is given."""
+    token = secrets.token_urlsafe(32)
+    RefreshToken.objects.create(
+        user=user,
+        token_hash=hash_refresh_token(token),
+        family=family or uuid.uuid4(),
+        device=device[:128],
+        expires_at=timezone.now() + timedelta(days=settings.REFRESH_TOKEN_LIFETIME),
+    )
+    return token
+
+
+def revoke_family(family):
+    RefreshToken.objects.filter(family=family, revoked_at__isnull=True).update(revoked_at=timezone.now())
+
+
+def rotate_refresh_token(token: str):
+    """Uses the refresh token up, returns (user, next refresh token), raises TokenError."""
+    now = timezone.now()
+    with transaction.atomic():
+        refresh = (
+            RefreshToken.objects.select_for_update(of=("self",))
+            .select_related("user")
+            .filter(token_hash=hash_refresh_token(token))
+            .first()
+        )
+        reused = refresh is not None and refresh.used_at is not None and refresh.revoked_at is None
+        if refresh is not None and not reused and refresh.revoked_at is None and refresh.expires_at > now:
+            refresh.used_at = now
+            refresh.save(update_fields=["used_at"])
+            return refresh.user, issue_refresh_token(refresh.user, refresh.device, refresh.family)
+
+    if reused:
+        # Replayed: the client or whoever copied the token holds a stolen one, both have to login again
+        revoke_family(refresh.family)
+        raise TokenError("Refresh token has already been used, please login again!")
+    if refresh is None or refresh.revoked_at is not None:
+        raise TokenError("Invalid refresh token, please login again!")
+    raise TokenError("Session has expired, please login again!", expired=True)
+
+
+def revoke_refresh_token(token: str) -> bool:
+    """Logs one device out: revokes the family of the token."""
+    family = (
+        RefreshToken.objects.filter(token_hash=hash_refresh_token(token)).values_list("family", flat=True).first()
+    )
+    if family is None:
+        return False
+    revoke_family(family)
+    return True
+
+
+def purge_refresh_tokens() -> int:
+    """Deletes expired tokens, returns their number."""
+    deleted, _ = RefreshToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
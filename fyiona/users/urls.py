@@ -16,6 +16,11 @@ urlpatterns = [
         users_views.CustomUserDetailAPIView.as_view(),
         name="current-user",
     ),
+    path(
+        "search/",
+        users_views.CustomUserSearchAPIView.as_view(),
+        name="search_accounts",
+    ),
     path(
         "search/by/phone/",
         users_views.CustomUserSearchByPhoneNumberAPIView.as_view(),
@@ -41,9 +46,24 @@ urlpatterns = [
         users_views.LoginAPIView.as_view(),
         name="login",
     ),
-    # re_path(
-    #     r"^email_reset/confirmation/.*",
-    #     users_views.ChangeEmailConfirmationAPIView.as_view(),
+    path(
+        "token/refresh/",
+        users_views.TokenRefreshAPIView.as_view(),
+        name="token_refresh",
+    ),
+    path(
+        "logout/",
+        users_views.LogoutAPIView.as_view(),
+        name="logout",
+    ),
+    path(
+        "logout/all/",
+        users_views.LogoutEverywhereAPIView.as_view(),
+        name="logout_everywhere",
+    ),
+    # path(
+    #     "email_reset/confirmation/<str:token>/",
+    #     users_views.CustomUserChangeEmailConfirmationAPIView.as_view(),
     #     name="email_confirmation",
     # ),
     path(
@@ -81,11 +101,26 @@ urlpatterns = [
     #     users_views.UserProfileDetailAPIView.as_view(),
     #     name="details",
     # ),
-    # path(
-    #     "follow/<uuid>/",
-    #     users_views.FollowAPIView.as_view(),
-    #     name="follow",
-    # ),
+    path(
+        "follow/<uuid:uuid>/",
+        users_views.FollowAPIView.as_view(),
+        name="follow",
+    ),
+    path(
+        "<uuid:uuid>/followers/",
+        users_views.FollowersAPIView.as_view(),
+        name="followers",
+    ),
+    path(
+        "<uuid:uuid>/following/",
+        users_views.FollowingAPIView.as_view(),
+        name="following",
+    ),
+    path(
+        "following/check/",
+        users_views.FollowingCheckAPIView.as_view(),
+        name="following_check",
+    ),
     path(
         "password/update/",
         users_views.CustomUserChangePasswordAPIView.as_view(),
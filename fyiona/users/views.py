@@ -1,50 +1,75 @@
 import random
 import string
 import datetime
+from uuid import UUID
 
-from django.db.models import Q
 from django.conf import settings
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import update_last_login
+from django.db import IntegrityError, transaction
 
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import generics, status, views
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.exceptions import NotFound, ValidationError
+
+from fyiona.pagination import KeysetPagination
+from fyiona.streaming import streaming_json_response
 
 from .signals import login_signal
 
 from .utilities import send_token_to_email
+from .search import search_users, paginate_search, SEARCH_FIELDS, PHONE_FIELD
+from .follows import (
+    follow,
+    unfollow,
+    remove_follows,
+    get_followers,
+    get_following,
+    get_followed_user_ids,
+    MAX_CHECK_IDS,
+)
+from .relationships import get_relationship_context
 from .middlewares import JWTAuthentication
+from .throttling import (
+    ThrottledMixin,
+    LoginIPThrottle,
+    LoginAccountThrottle,
+    PasswordResetIPThrottle,
+    PasswordResetAccountThrottle,
+    RegistrationIPThrottle,
+)
+from .tokens import revoke_tokens, issue_refresh_token, revoke_refresh_token
+from .one_time_tokens import create_token, get_token, consume_token, use_token
 
 from .serializers import (
     CustomUserDetailSerializer,
     CustomUserListSerializer,
     CustomUserCreateSerializer,
+    FollowerSerializer,
+    FollowingSerializer,
     CustomUserUpdateSerializer,
     CustomUserResetPasswordSerializer,
     CustomUserChangePasswordSerializer,
 
     LoginSerializer,
-    CustomUserEmailConfirmationToken,
+    TokenRefreshSerializer,
 )
 
 
 from .models import (
     CustomUser,
     UserProfile,
-    AccessTokenToDeleteCustomUser,
-    CustomUserEmailConfirmationToken,
-    AccessTokenToUpdateCustomUserFields,
-    UserProfile,
+    OneTimeToken,
 )
 
 ####################################################################################################
 ###################################### CUSTOM USER CRUD ############################################
 ####################################################################################################
 
-class CustomUserCreateAPIView(generics.CreateAPIView):
+class CustomUserCreateAPIView(ThrottledMixin, generics.CreateAPIView):
     """
     This View is only responsible for creation of TWO models: CustomUser and UserProfile
     We create CustomUser through UserProfile model.
@@ -52,6 +77,7 @@ class CustomUserCreateAPIView(generics.CreateAPIView):
     """
 
     permission_classes = (AllowAny,)
+    throttle_classes = (RegistrationIPThrottle,)
     serializer_class = CustomUserCreateSerializer
 
     def post(self, request, *args, **kwargs):
@@ -128,30 +154,33 @@ class CustomUserDeleteAPIView(generics.DestroyAPIView):
     serializer_class = CustomUserDetailSerializer
 
     def get(self, request):
-        token = request.GET.get("token")
-        user_in_db = AccessTokenToDeleteCustomUser.objects.filter(token=token).first()
+        deletion = use_token(request.GET.get("token"), OneTimeToken.PURPOSE_ACCOUNT_DELETION)
+        if deletion is None:
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Delete token is invalid or has expired",
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
 
-        if user_in_db:
-            user_in_db.user.user_profile.delete()
-            user_in_db.user.delete()
-            user_in_db.delete()
+        user = deletion.user
+        with transaction.atomic():
+            remove_follows(user.user_profile)
+            user.user_profile.delete()
+            user.delete()
 
         return Response(
             data={
                 "success": True,
-                "result": f"User {user_in_db.user.email} has been deleted successfully"
+                "result": f"User {user.email} has been deleted successfully"
             },
             status=status.HTTP_200_OK
         )
 
 
     def delete(self, request):
-        token_in_db = AccessTokenToDeleteCustomUser.objects.filter(user=request.user).first()
-
-        if token_in_db:
-            token = token_in_db
-        else:
-            token = AccessTokenToDeleteCustomUser.objects.create(user=request.user)
+        token = create_token(request.user, OneTimeToken.PURPOSE_ACCOUNT_DELETION)
 
         token_url = f"{settings.DOMAIN_NAME}/api/v1/accounts/delete?token={token}"
 
@@ -186,14 +215,35 @@ class CustomUserListAPIView(generics.ListAPIView):
     authentication_classes = (JWTAuthentication,)
     serializer_class = CustomUserListSerializer
 
+    ordering = ("-date_joined", "-id")
+
+    def get_queryset(self):
+        # user_profile is serialized for every row, fetch it in the same query
+        return CustomUser.objects.select_related("user_profile")
+
     def get(self, request, *args, **kwargs):
-        users = CustomUser.objects.all()
-        serializer = self.serializer_class(users, many=True)
+        """
+        By default returns one page of users, the next page is requested with ?cursor=<next>.
+        ?stream=true renders the whole directory as a streaming response with flat memory usage.
+        """
+        users = self.get_queryset()
+
+        if request.query_params.get("stream") in ("1", "true", "True"):
+            return streaming_json_response(
+                users.order_by(*self.ordering),
+                self.serializer_class,
+                context=self.get_serializer_context(),
+            )
+
+        paginator = KeysetPagination(ordering=self.ordering)
+        page = paginator.paginate_queryset(users, request)
+        serializer = self.serializer_class(page, many=True, context=self.get_serializer_context())
 
         return Response(
             data={
                 "success": True,
                 "result": serializer.data,
+                "next": paginator.next_cursor,
             },
             status=status.HTTP_200_OK,
         )
@@ -222,65 +272,56 @@ class CustomUserDetailAPIView(generics.RetrieveAPIView):
 
 
 
-class CustomUserSearchByEmailAPIView(generics.ListAPIView):
+class CustomUserSearchAPIView(generics.ListAPIView):
+    """
+    Ranked search of users by email, first name, last name and phone number at once.
+    Query parameters: q - search query, limit - page size (max 50), offset - value of "next" from the previous page.
+    """
     permission_classes = (IsAuthenticated,)
     authentication_classes = (JWTAuthentication,)
     serializer_class = CustomUserListSerializer
 
-    queryset = CustomUser.objects.all()
+    query_param = "q"
+    search_fields = SEARCH_FIELDS
 
     def get(self, request, *args, **kwargs):
-        email = request.GET.get("email")
-        if email:
-            found = self.queryset.filter(Q(email__icontains=email) | Q(email__search=email))
-            serializer = self.serializer_class(found, many=True)
+        query = request.GET.get(self.query_param, "").strip()
+        if query:
+            found = search_users(query, fields=self.search_fields)
+            users, next_offset = paginate_search(
+                found,
+                limit=request.GET.get("limit"),
+                offset=request.GET.get("offset"),
+            )
+            serializer = self.serializer_class(users, many=True, context=self.get_serializer_context())
 
             return Response(
                 data={
                     "success": True,
-                    "result": serializer.data
+                    "result": serializer.data,
+                    "next": next_offset,
                 },
                 status=status.HTTP_200_OK,
             )
         return Response(
             data={
                 "success": False,
-                "result": "The \"email\" query parameter was not provided!"
+                "result": f"The \"{self.query_param}\" query parameter was not provided!"
             },
             status=status.HTTP_400_BAD_REQUEST,
         )
 
 
 
-class CustomUserSearchByPhoneNumberAPIView(generics.ListAPIView):
-    permission_classes = (IsAuthenticated,)
-    authentication_classes = (JWTAuthentication,)
-    serializer_class = CustomUserListSerializer
+class CustomUserSearchByEmailAPIView(CustomUserSearchAPIView):
+    query_param = "email"
+    search_fields = ("email",)
 
-    queryset = CustomUser.objects.all()
 
-    def get(self, request, *args, **kwargs):
-        phone_number = request.GET.get("phone_number")
-        if phone_number:
-            found = self.queryset.filter(
-                Q(phone_number__icontains=phone_number) | Q(phone_number__search=phone_number)
-            )
-            serializer = self.serializer_class(found, many=True)
 
-            return Response(
-                data={
-                    "success": True,
-                    "result": serializer.data
-                },
-                status=status.HTTP_200_OK,
-            )
-        return Response(
-            data={
-                "success": False,
-                "result": "The \"phone_number\" query parameter was not provided!"
-            },
-            status=status.HTTP_400_BAD_REQUEST,
-        )
+class CustomUserSearchByPhoneNumberAPIView(CustomUserSearchAPIView):
+    query_param = "phone_number"
+    search_fields = (PHONE_FIELD,)
 
 ####################################################################################################
 ####################################################################################################
@@ -292,11 +333,13 @@ class CustomUserSearchByPhoneNumberAPIView(generics.ListAPIView):
 #################################### AUTHORIZATION VIEWS ###########################################
 ####################################################################################################
 
-class LoginAPIView(APIView):
+class LoginAPIView(ThrottledMixin, APIView):
     """
     The logic of this class is not to authenticate a user from the beginning but update the login state instead.
     """
     permission_classes = (AllowAny,)
+    # Checked before the serializer hashes the password
+    throttle_classes = (LoginIPThrottle, LoginAccountThrottle)
     serializer_class = LoginSerializer
     
     def post(self, request, *args, **kwargs):
@@ -308,7 +351,13 @@ class LoginAPIView(APIView):
 
         user = serializer.validated_data.get("result").get("email")
         if user.email_confirmed:
-            serializer.validated_data.get("result").update({"email": user.email})
+            serializer.validated_data.get("result").update(
+                {
+                    "email": user.email,
+                    # One refresh token family per login, see users.tokens
+                    "refresh_token": issue_refresh_token(user, request.headers.get("User-Agent", "")),
+                }
+            )
 
             update_last_login(None, user)
             return Response(
@@ -325,6 +374,61 @@ class LoginAPIView(APIView):
             )
 
 
+class TokenRefreshAPIView(APIView):
+    """
+    Returns a new short lived access token for a refresh token.
+    """
+    permission_classes = (AllowAny,)
+    serializer_class = TokenRefreshSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(data=serializer.validated_data, status=status.HTTP_200_OK)
+
+
+class LogoutAPIView(APIView):
+    """
+    Logs one device out: its refresh token and the ones rotated from the same login stop working.
+    Access tokens already issued expire on their own within ACCESS_TOKEN_LIFETIME.
+    """
+    permission_classes = (AllowAny,)
+
+    def post(self, request, *args, **kwargs):
+        if not revoke_refresh_token(str(request.data.get("refresh_token", ""))):
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Invalid refresh token",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        return Response(
+            data={
+                "success": True,
+                "result": "Logged out",
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class LogoutEverywhereAPIView(APIView):
+    """
+    Revokes every access and refresh token of the user, including the one of this request.
+    """
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,)
+
+    def post(self, request, *args, **kwargs):
+        revoke_tokens(request.user)
+        return Response(
+            data={
+                "success": True,
+                "result": "Logged out on all devices",
+            },
+            status=status.HTTP_200_OK,
+        )
+
 
 # class LoginAfterRegistrationAPIView(APIView):
 #     permission_classes = (AllowAny,)
@@ -346,8 +450,9 @@ class LoginAPIView(APIView):
 ################################## ACCOUNT RECOVERY VIEWS ##########################################
 ####################################################################################################
 
-class SendRequestToResetCustomUserPasswordAPIView(views.APIView):
+class SendRequestToResetCustomUserPasswordAPIView(ThrottledMixin, views.APIView):
     permission_classes = (AllowAny,)
+    throttle_classes = (PasswordResetIPThrottle, PasswordResetAccountThrottle)
 
     def post(self, request, *args, **kwargs):
         user_email = request.data.get("email")
@@ -356,11 +461,7 @@ class SendRequestToResetCustomUserPasswordAPIView(views.APIView):
             user = CustomUser.objects.filter(email=user_email).first()
 
             if user:
-                token_in_db = AccessTokenToUpdateCustomUserFields.objects.filter(user=user).first()
-                if token_in_db:
-                    token = token_in_db
-                else:
-                    token = AccessTokenToUpdateCustomUserFields.objects.create(user=user)
+                token = create_token(user, OneTimeToken.PURPOSE_PASSWORD_RESET)
 
                 token_url = f"{settings.DOMAIN_NAME}/api/v1/accounts/password/reset/confirmation?token={token}"
 
@@ -410,13 +511,12 @@ class CustomUserResetPasswordAPIView(views.APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        This function is concerned with checking the correctness of the data and setting a new password.
+        Checks the reset token of the link and returns its user, the token stays valid for patch().
         """
-        token = request.GET.get("token")
-        user_in_db = AccessTokenToUpdateCustomUserFields.objects.filter(token=token).first()
+        reset = get_token(request.GET.get("token"), OneTimeToken.PURPOSE_PASSWORD_RESET)
 
-        if user_in_db:
-            user_data = CustomUserDetailSerializer(user_in_db.user)
+        if reset:
+            user_data = CustomUserDetailSerializer(reset.user)
             return Response(
                 data={
                     "success": True,
@@ -435,24 +535,31 @@ class CustomUserResetPasswordAPIView(views.APIView):
             
 
     def patch(self, request, *args, **kwargs):
-        user = CustomUser.objects.filter(id=request.data.get("id")).first()
+        """
+        Sets the new password of the user of the reset token and uses the token up.
+        """
+        token = request.GET.get("token") or request.data.get("token")
+        reset = get_token(token, OneTimeToken.PURPOSE_PASSWORD_RESET)
 
-        if user:
-            serializer = self.serializer_class(user, request.data)
+        if reset:
+            serializer = self.serializer_class(reset.user, request.data)
             serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(
-                data={
-                    "success": True,
-                    "result": "Password updated successfully",
-                },
-                status=status.HTTP_200_OK,
-            )
+            if consume_token(reset):
+                serializer.save()
+                # Sessions opened with the old password are closed
+                revoke_tokens(reset.user)
+                return Response(
+                    data={
+                        "success": True,
+                        "result": "Password updated successfully",
+                    },
+                    status=status.HTTP_200_OK,
+                )
 
         return Response(
             data={
                 "success": False,
-                "result": "Invalid UUID, such user does not exist",
+                "result": "Reset token is invalid or has expired",
             },
             status=status.HTTP_404_NOT_FOUND,
         )
@@ -525,31 +632,133 @@ class ChangeUserProfileAPIView(APIView):
 
 class FollowAPIView(APIView):
     """
-    Serializer for following.
+    POST follows the user with this UUID, DELETE unfollows.
     """
 
     permission_classes = (IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,)
+
+    def get_profile(self, request, uuid):
+        profile = UserProfile.objects.filter(user_id=uuid).only("id", "user_id").first()
+        if profile is None:
+            raise NotFound({"success": False, "result": "User with this UUID does not exist."})
+        if profile.user_id == request.user.id:
+            raise ValidationError({"success": False, "result": "You can not follow yourself."})
+        return profile
+
+    def post(self, request, uuid, *args, **kwargs):
+        created = follow(request.user.user_profile, self.get_profile(request, uuid))
+        return Response(
+            {
+                "success": True,
+                "result": "Success" if created else "Already following",
+            },
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    def delete(self, request, uuid, *args, **kwargs):
+        deleted = unfollow(request.user.user_profile, self.get_profile(request, uuid))
+        return Response(
+            {
+                "success": True,
+                "result": "Success" if deleted else "Not following",
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class FollowersAPIView(APIView):
+    """
+    People following the user with this UUID, newest first. Next page: ?cursor=<next>.
+    """
+
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,)
+    serializer_class = FollowerSerializer
+    # The profile of the listed user in a Follow row
+    listed_profile = "follower"
+
+    def get_queryset(self, profile):
+        return get_followers(profile)
 
     def get(self, request, uuid, *args, **kwargs):
-        
-        follow = CustomUser.objects.filter(id=uuid).first()
-        if follow:
-            follow.user_profile.followers.add(request.user.user_profile)
-            follow.save()
+        profile = UserProfile.objects.filter(user_id=uuid).only("id").first()
+        if profile is None:
+            return Response(
+                {
+                    "success": False,
+                    "result": "User with this UUID does not exist.",
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        paginator = KeysetPagination(ordering=("-created_at", "-id"))
+        page = paginator.paginate_queryset(self.get_queryset(profile), request)
+        context = get_relationship_context(
+            request, [getattr(row, self.listed_profile).user_id for row in page]
+        )
+        serializer = self.serializer_class(page, many=True, context=context)
+
+        return Response(
+            data={
+                "success": True,
+                "result": serializer.data,
+                "next": paginator.next_cursor,
+            },
+            status=status.HTTP_200_OK,
+        )
+
 
+class FollowingAPIView(FollowersAPIView):
+    """
+    Accounts the user with this UUID follows, newest first. Next page: ?cursor=<next>.
+    """
+
+    serializer_class = FollowingSerializer
+    listed_profile = "profile"
+
+    def get_queryset(self, profile):
+        return get_following(profile)
+
+
+class FollowingCheckAPIView(APIView):
+    """
+    Which of the posted user ids ({"ids": [...]}) the current user follows, in one query:
+    {"success": true, "result": {"<id>": true, "<id>": false}}
+    """
+
+    permission_classes = (IsAuthenticated,)
+    authentication_classes = (JWTAuthentication,)
+
+    def post(self, request, *args, **kwargs):
+        ids = request.data.get("ids")
+        if not isinstance(ids, list) or not ids or len(ids) > MAX_CHECK_IDS:
             return Response(
                 {
-                    "success": True,
-                    "result": "Success",
+                    "success": False,
+                    "result": "Please provide a list of 1 to %s user ids" % MAX_CHECK_IDS,
                 },
-                status=status.HTTP_200_OK,
+                status=status.HTTP_400_BAD_REQUEST,
             )
+
+        try:
+            ids = [str(UUID(str(user_id))) for user_id in ids]
+        except ValueError:
+            return Response(
+                {
+                    "success": False,
+                    "result": "Wrong user id",
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        followed = {str(user_id) for user_id in get_followed_user_ids(request.user, ids)}
         return Response(
             {
-                "success": False,
-                "result": "User with this UUID does not exist.",
+                "success": True,
+                "result": {user_id: user_id in followed for user_id in ids},
             },
-            status=status.HTTP_404_NOT_FOUND,
+            status=status.HTTP_200_OK,
         )
 
 ####################################################################################################
@@ -560,18 +769,16 @@ class CustomUserEmailConfirmationAPIViev(views.APIView):
     """
     When navigating to this API, a token is retrieved from the link. 
     Then, the record in the database that owns this token,
-    the email_confirmed attribute is changed to True, and the EmailConfirmationToken entry is removed.
+    the email_confirmed attribute is changed to True, and the one time token is used up.
     """
     permission_classes = (AllowAny,)
-    serializer_class = CustomUserEmailConfirmationToken
 
     def get(self, request, token):
-        confirmation_token = CustomUserEmailConfirmationToken.objects.filter(token=token).first()
-        if confirmation_token:
-            confirmation_token.user.email_confirmed = True
-            confirmation_token.user.active = True
-            confirmation_token.user.save()
-            confirmation_token.delete()
+        confirmation = use_token(token, OneTimeToken.PURPOSE_EMAIL_CONFIRMATION)
+        if confirmation:
+            confirmation.user.email_confirmed = True
+            confirmation.user.active = True
+            confirmation.user.save(update_fields=["email_confirmed", "active"])
             return Response(
                 data={
                     "success": True, 
@@ -598,12 +805,48 @@ class CustomUserChangeEmailConfirmationAPIView(APIView):
     serializer_class = CustomUserDetailSerializer
     authentication_classes = (JWTAuthentication,)
 
-    def get(self, request, *args, **kwargs):
-        delete_token = AccessTokenToUpdateCustomUserFields.objects.get(user=request.user.email)
-        delete_token.delete()
-        user = CustomUser.objects.get(pk=request.user.pk)
-        user.email = request.get_full_path().split("~")[1]
-        user.save()
+    def get(self, request, token, *args, **kwargs):
+        change = get_token(token, OneTimeToken.PURPOSE_EMAIL_CHANGE)
+        if change is None or change.user_id != request.user.pk:
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Email change token is invalid or has expired",
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
+
+        # The address may have been registered since the link was sent, the token stays usable then
+        email_taken = Response(
+            data={
+                "success": False,
+                "result": "This email is already registered",
+            },
+            status=status.HTTP_409_CONFLICT,
+        )
+        if CustomUser.objects.filter(email=change.payload).exclude(pk=change.user_id).exists():
+            return email_taken
+
+        user = change.user
+        user.email = change.payload
+        try:
+            # The token is only used up together with the new email
+            with transaction.atomic():
+                consumed = consume_token(change)
+                if consumed:
+                    user.save(update_fields=["email"])
+        except IntegrityError:
+            # Registered by a concurrent request after the check above
+            return email_taken
+
+        if not consumed:
+            return Response(
+                data={
+                    "success": False,
+                    "result": "Email change token is invalid or has expired",
+                },
+                status=status.HTTP_404_NOT_FOUND,
+            )
 
         return Response(
             data={